@@ -0,0 +1,214 @@
+#!/usr/bin/env python3
+"""
+Benchmark per-packet UDP overhead: one recvfrom/sendto per datagram vs batched I/O
+"""
+
+import sys
+import os
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+os.chdir(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import time
+import signal
+import socket
+import select
+import argparse
+from dnslib import DNSRecord, QTYPE
+from core import batch_io
+from core.batch_io import DrainSocket, MMsgSocket, HAVE_MMSG, MAX_DATAGRAM
+from core.querylog import log, WARNING
+from core.udp_server import run_udp_server
+from server import dns_server
+
+def build_queries():
+    """One wire-format query for every zone name and type with a compiled answer"""
+    return [
+        DNSRecord.question(name, QTYPE[qtype]).pack()
+        for name, qtype in dns_server.STATE.index.keys()
+    ]
+
+class SingleSocket(DrainSocket):
+    """The unbatched server loop: one recvfrom and one sendto per datagram"""
+
+    def recv(self):
+        self.syscalls += 1
+        try:
+            return [self.sock.recvfrom(MAX_DATAGRAM)]
+        except (BlockingIOError, InterruptedError):
+            return []
+
+def socket_pair():
+    server = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    client = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    for sock in (server, client):
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 4 << 20)
+        sock.bind(("127.0.0.1", 0))
+    client.setblocking(False)
+    return server, client
+
+def run(io, client, handler, queries, burst, packets):
+    """Answer packets queries sent burst at a time; returns server-side seconds
+
+    Only the server's receive, handle and send are timed: the client
+    fills the socket buffer with a burst before the clock starts and
+    drains the replies after it stops.
+    """
+    address = io.sock.getsockname()
+    elapsed = 0.0
+    answered = 0
+    n = 0
+    while answered < packets:
+        for _ in range(burst):
+            client.sendto(queries[n % len(queries)], address)
+            n += 1
+
+        start = time.perf_counter()
+        pending = burst
+        while pending:
+            batch = io.recv()
+            replies = [(handler(data, addr), addr) for data, addr in batch]
+            io.send(replies)
+            pending -= len(batch)
+        elapsed += time.perf_counter() - start
+        answered += burst
+
+        received = 0
+        while received < burst:
+            try:
+                client.recv(MAX_DATAGRAM)
+                received += 1
+            except BlockingIOError:
+                time.sleep(0)
+    return elapsed
+
+def bench(label, make_io, handler, queries, burst, packets, repeat):
+    """Best of repeat runs, in µs per packet"""
+    best = None
+    for _ in range(repeat):
+        server, client = socket_pair()
+        io = make_io(server, burst)
+        elapsed = run(io, client, handler, queries, burst, packets)
+        client.close()
+        io.close()
+        best = elapsed if best is None else min(best, elapsed)
+    elapsed = best
+    per_packet = elapsed / packets * 1e6
+    print(f"{label:<10} {packets / elapsed:>12,.0f} pps   {per_packet:7.2f} µs/packet   "
+          f"{io.syscalls / packets:5.2f} syscalls/packet")
+    return per_packet
+
+def server_cpu(pid):
+    """CPU seconds (user + system) used so far by process pid (Linux /proc)"""
+    with open(f"/proc/{pid}/stat") as f:
+        fields = f.read().rsplit(")", 1)[1].split()
+    return (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")
+
+def free_port():
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+def bench_server(label, batch, handler, queries, burst, packets, mmsg=HAVE_MMSG):
+    """Drive the real serve() loop in a child process; returns server CPU µs per packet
+
+    The client keeps burst queries in flight, so up to burst datagrams
+    are waiting whenever the server wakes up.
+    """
+    port = free_port()
+    pid = os.fork()
+    if pid == 0:
+        log.configure(level=WARNING)
+        # Lets the drain fallback be measured where recvmmsg exists
+        batch_io.HAVE_MMSG = mmsg
+        try:
+            run_udp_server(handler, "127.0.0.1", port, name="bench", batch=batch)
+        finally:
+            os._exit(0)
+
+    client = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    client.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 4 << 20)
+    client.connect(("127.0.0.1", port))
+    try:
+        # Wait for the server to come up
+        for _ in range(100):
+            try:
+                client.send(queries[0])
+                if select.select([client], [], [], 0.05)[0]:
+                    client.recv(MAX_DATAGRAM)
+                    break
+            except ConnectionRefusedError:
+                time.sleep(0.05)
+
+        cpu = server_cpu(pid)
+        start = time.perf_counter()
+        received = lost = 0
+        n = 0
+        while received + lost < packets:
+            for _ in range(burst):
+                client.send(queries[n % len(queries)])
+                n += 1
+            outstanding = burst
+            while outstanding and select.select([client], [], [], 0.5)[0]:
+                client.recv(MAX_DATAGRAM)
+                outstanding -= 1
+                received += 1
+            lost += outstanding
+        elapsed = time.perf_counter() - start
+        cpu = server_cpu(pid) - cpu
+    finally:
+        client.close()
+        os.kill(pid, signal.SIGTERM)
+        os.waitpid(pid, 0)
+
+    per_packet = cpu / received * 1e6 if received else float("inf")
+    print(f"{label:<10} {received / elapsed:>12,.0f} pps   {per_packet:7.2f} µs server CPU/packet   {lost} lost")
+    return per_packet
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--packets", type=int, default=100000, help="datagrams answered per mode")
+    parser.add_argument("--batch", type=int, nargs="+", default=[1, 8, 32, 64], help="burst/batch sizes to try")
+    parser.add_argument("--repeat", type=int, default=3, help="runs per mode; the fastest is reported")
+    parser.add_argument("--server", action="store_true",
+                        help="run the real serve() loop (--batch 0 vs N) in a child process instead of the socket loop")
+    parser.add_argument("--handler", choices=("echo", "auth"), default="echo",
+                        help="echo: I/O cost alone; auth: the authoritative server's handle_query")
+    args = parser.parse_args()
+
+    dns_server.use_zone_file(dns_server.ZONE_FILE)
+    queries = build_queries()
+    if args.handler == "auth":
+        log.configure(level=WARNING)
+        handler = dns_server.handle_query
+    else:
+        handler = lambda data, addr: data
+
+    if args.server:
+        print(f"🧪 {args.packets:,} packets per mode through serve(), handler {args.handler}")
+        for burst in args.batch:
+            print(f"\n📦 {burst} queries in flight")
+            single = bench_server("--batch 0", 0, handler, queries, burst, args.packets)
+            if burst > 1:
+                batched = bench_server(f"--batch {burst}", burst, handler, queries, burst, args.packets)
+                print(f"⚡ {single - batched:.2f} µs/packet less server CPU ({single / batched:.1f}x)")
+                if HAVE_MMSG:
+                    bench_server("  (drain)", burst, handler, queries, burst, args.packets, mmsg=False)
+        return
+
+    modes = [("single", SingleSocket), ("drain", DrainSocket)]
+    if HAVE_MMSG:
+        modes.append(("mmsg", MMsgSocket))
+    else:
+        print("⚠️  recvmmsg/sendmmsg not available here, only the drain fallback is measured")
+
+    print(f"🧪 {args.packets:,} packets per mode, handler {args.handler}")
+    for burst in args.batch:
+        print(f"\n📦 {burst} datagrams ready per wakeup")
+        costs = {label: bench(label, make_io, handler, queries, burst, args.packets, args.repeat) for label, make_io in modes}
+        best = min(costs, key=costs.get)
+        if best != "single":
+            print(f"⚡ {best}: {costs['single'] - costs[best]:.2f} µs/packet less than single "
+                  f"({costs['single'] / costs[best]:.1f}x)")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+"""
+Benchmark hierarchy walks in the enhanced resolver: loopback UDP vs in-process transport
+
+Every walk goes root -> TLD -> authoritative and must end in an answer;
+the last hop goes to an authoritative server serving zone/hierarchy.json.
+"""
+
+import sys
+import os
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+os.chdir(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import time
+import asyncio
+import argparse
+import subprocess
+from dnslib import DNSRecord
+from core import upstream
+from core.querylog import log, WARNING
+from zone.rotation import set_mode, FIXED
+import enhanced_recursive
+
+# Names in zone/hierarchy.json, so every walk ends in an answer
+NAMES = [
+    "www.google.com.", "mail.github.com.", "example.org.", "api.stackoverflow.com.",
+    "www.example.com.", "google.com.",
+]
+
+async def walk_all(names, rounds):
+    """Walk the hierarchy for every name, rounds times; returns (seconds, answers)"""
+    answers = []
+    start = time.perf_counter()
+    for _ in range(rounds):
+        for name in names:
+            # Forget every zone cut so each walk starts at the root
+            enhanced_recursive.delegations.entries.clear()
+            answers.append(await enhanced_recursive.walk_hierarchy(name, "A"))
+    return time.perf_counter() - start, answers
+
+def summary(name, response):
+    # A failed walk is as quick as it is useless: don't time those
+    assert response is not None and response.header.rcode == 0 and response.rr, f"walk for {name} found no answer"
+    return response.header.rcode, sorted(str(rr) for rr in response.rr + response.auth)
+
+def bench(label, transport, rounds):
+    enhanced_recursive.TRANSPORT = transport
+    queries = transport.queries
+    elapsed, answers = asyncio.run(walk_all(NAMES, rounds))
+    walks = rounds * len(NAMES)
+    hops = (transport.queries - queries) / walks
+    print(f"{label:<10} {walks / elapsed:>10,.0f} walks/s   {elapsed / walks * 1e6:9.1f} µs/walk   {hops:.1f} queries/walk")
+    return elapsed, [summary(name, answer) for name, answer in zip(NAMES * rounds, answers)]
+
+def wait_until_up(server):
+    request = DNSRecord.question("com.", "NS")
+    for _ in range(50):
+        try:
+            request.send(*server, timeout=0.1)
+            return
+        except OSError:
+            time.sleep(0.1)
+    raise SystemExit(f"❌ Nothing answering on {server[0]}:{server[1]}")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--rounds", type=int, default=200, help="walks per name and transport")
+    parser.add_argument("--spawn", action="store_true", help="start root_server.py, tld_server.py and a hierarchy.json authoritative server for the UDP run")
+    parser.add_argument("--auth-server", default="127.0.0.1:8058", metavar="HOST:PORT", help="authoritative server for zone/hierarchy.json")
+    args = parser.parse_args()
+    auth_server = upstream.parse_address(args.auth_server)
+    enhanced_recursive.AUTH_SERVERS = [auth_server]
+
+    # Neither the simulators nor the resolver should log every query
+    log.configure(level=WARNING)
+    set_mode(FIXED)
+
+    processes = []
+    if args.spawn:
+        auth = ["server/dns_server.py", "--zone-file", enhanced_recursive.HIERARCHY_ZONE_FILE,
+                "--host", auth_server[0], "--port", str(auth_server[1]),
+                "--rotation", "fixed", "--reload-interval", "0", "--health-interval", "0"]
+        for command in (["root_server.py"], ["tld_server.py", "--rotation", "fixed"], auth):
+            processes.append(subprocess.Popen([sys.executable, *command, "--log-level", "warning"],
+                                              stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL))
+    try:
+        wait_until_up(enhanced_recursive.ROOT_SERVER)
+        wait_until_up(enhanced_recursive.TLD_SERVER)
+        wait_until_up(auth_server)
+        print(f"🧪 {len(NAMES)} names x {args.rounds} rounds, every walk from the root")
+        udp, udp_answers = bench("udp", upstream.UpstreamTransport(), args.rounds)
+        local, local_answers = bench("inprocess", enhanced_recursive.inprocess_transport(), args.rounds)
+    finally:
+        for process in processes:
+            process.terminate()
+
+    # Same walk, same answers: only the cost of getting there differs
+    assert udp_answers == local_answers
+    print(f"⚡ In-process: {udp / local:.1f}x faster, "
+          f"{(udp - local) / (args.rounds * len(NAMES)) * 1e6:.0f} µs/walk of packing, sockets and parsing saved")
+
+if __name__ == "__main__":
+    main()
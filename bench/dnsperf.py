@@ -0,0 +1,282 @@
+#!/usr/bin/env python3
+"""
+Load generator and latency benchmark for the local DNS servers (dnsperf-style)
+"""
+
+import sys
+import os
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+os.chdir(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import json
+import time
+import random
+import socket
+import asyncio
+import argparse
+import subprocess
+from collections import Counter, deque
+from dnslib import DNSRecord, DNSError, RCODE
+from zone.zone_loader import load_zones
+from zone.compiler import SUPPORTED_QTYPES
+from root_server import ROOT_ZONES
+from tld_server import TLD_ZONES
+
+SERVERS = {
+    "auth": 8053,
+    "recursive": 8054,
+    "root": 8055,
+    "tld": 8056,
+    "enhanced": 8057,
+}
+
+PERCENTILES = (50, 90, 99, 99.9)
+
+# The authoritative stand-in for the domains the TLD server delegates
+# (server/dns_server.py --zone-file zone/hierarchy.json --port 8058)
+HIERARCHY_AUTH = ("127.0.0.1", 8058)
+
+def query_mix(server, zone_file="zone/zones.json", hierarchy=False):
+    """(qname, qtype) pairs each server can answer without leaving this host
+
+    The enhanced resolver only gets the delegated domains (google.com. and
+    the rest) with hierarchy set: without --auth-server it would send them
+    to the real glue addresses on port 53.
+    """
+    zones = load_zones(zone_file)
+    local_a = [(name, "A") for name, zone in zones.items() if "A" in zone]
+
+    if server == "auth":
+        mix = [(name, qtype) for name, zone in zones.items() for qtype in zone if qtype in SUPPORTED_QTYPES]
+        # Some misses, so NXDOMAIN is part of the mix
+        return mix + [(f"missing{i}.local.", "A") for i in range(max(1, len(mix) // 10))]
+    if server == "recursive":
+        # Anything else would be forwarded to 8.8.8.8
+        return local_a
+    if server == "root":
+        return [(tld, qtype) for tld in ROOT_ZONES for qtype in ("NS", "A")]
+    if server == "tld":
+        return [(name, qtype) for name in TLD_ZONES for qtype in ("NS", "A")] + [("nope.com.", "NS")]
+    if server == "enhanced":
+        return local_a + ([(name, "A") for name in TLD_ZONES] if hierarchy else [])
+    raise ValueError(f"unknown server {server!r}")
+
+def load_query_file(path):
+    """Read a dnsperf-style query file: one "name type" per line"""
+    mix = []
+    with open(path) as f:
+        for line in f:
+            line = line.split("#", 1)[0].split()
+            if line:
+                name = line[0] if line[0].endswith(".") else line[0] + "."
+                mix.append((name, line[1].upper() if len(line) > 1 else "A"))
+    return mix
+
+class LoadClient(asyncio.DatagramProtocol):
+    """One UDP socket with many outstanding queries, matched by ID"""
+
+    def __init__(self):
+        self.transport = None
+        self.pending = {}
+        ids = list(range(65536))
+        random.shuffle(ids)
+        # Released IDs go to the back, so a late reply can't match a new query
+        self.free_ids = deque(ids)
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def datagram_received(self, data, addr):
+        if len(data) < 12:
+            return
+        future = self.pending.pop(data[0] << 8 | data[1], None)
+        if future is not None and not future.done():
+            future.set_result((time.perf_counter(), data[3] & 0x0F))
+
+    def error_received(self, exc):
+        pass
+
+    def send(self, packet):
+        """Send a packed query under a free ID; returns (ID, future)"""
+        qid = self.free_ids.popleft()
+        future = asyncio.get_running_loop().create_future()
+        self.pending[qid] = future
+        self.transport.sendto(bytes([qid >> 8, qid & 0xFF]) + packet[2:])
+        return qid, future
+
+    def release(self, qid):
+        self.pending.pop(qid, None)
+        self.free_ids.append(qid)
+
+class Results:
+    """Counters and latency samples for one run"""
+
+    def __init__(self):
+        self.sent = 0
+        self.received = 0
+        self.lost = 0
+        self.rcodes = Counter()
+        self.latencies = []
+
+    def summary(self, elapsed):
+        latencies = sorted(self.latencies)
+        def percentile(p):
+            if not latencies:
+                return None
+            # Nearest rank
+            rank = max(1, -(-len(latencies) * p // 100))
+            return round(latencies[int(rank) - 1] * 1000, 3)
+        return {
+            "sent": self.sent,
+            "received": self.received,
+            "lost": self.lost,
+            "loss_pct": round(100.0 * self.lost / self.sent, 3) if self.sent else 0.0,
+            "qps": round(self.received / elapsed, 1) if elapsed else 0.0,
+            "elapsed": round(elapsed, 3),
+            "latency_ms": {
+                **{f"p{p:g}": percentile(p) for p in PERCENTILES},
+                "min": round(latencies[0] * 1000, 3) if latencies else None,
+                "max": round(latencies[-1] * 1000, 3) if latencies else None,
+                "mean": round(sum(latencies) / len(latencies) * 1000, 3) if latencies else None,
+            },
+            "rcodes": {RCODE.get(rcode, str(rcode)): count for rcode, count in sorted(self.rcodes.items())},
+        }
+
+async def run_load(host, port, mix, concurrency, rate, duration, timeout, sockets):
+    """Drive host:port with concurrency outstanding queries for duration seconds
+
+    With a target rate, sends are paced to rate queries/second across all
+    senders (an open loop, capped at concurrency in flight); without one,
+    every sender fires its next query as soon as the last one completes.
+    """
+    loop = asyncio.get_running_loop()
+    clients = []
+    for _ in range(sockets):
+        _, client = await loop.create_datagram_endpoint(LoadClient, remote_addr=(host, port))
+        clients.append(client)
+
+    packets = [DNSRecord.question(name, qtype).pack() for name, qtype in mix]
+    results = Results()
+    start = time.perf_counter()
+    deadline = start + duration
+    next_send = [start]
+    interval = 1.0 / rate if rate else 0
+
+    async def sender(n):
+        client = clients[n % len(clients)]
+        while True:
+            now = time.perf_counter()
+            if interval:
+                send_at = next_send[0]
+                next_send[0] = max(send_at, now - 1) + interval
+                if send_at > now:
+                    await asyncio.sleep(send_at - now)
+                    now = time.perf_counter()
+            if now >= deadline:
+                return
+
+            sent = time.perf_counter()
+            qid, future = client.send(random.choice(packets))
+            results.sent += 1
+            try:
+                received, rcode = await asyncio.wait_for(future, timeout)
+            except asyncio.TimeoutError:
+                results.lost += 1
+            else:
+                results.received += 1
+                results.rcodes[rcode] += 1
+                results.latencies.append(received - sent)
+            finally:
+                client.release(qid)
+
+    await asyncio.gather(*(sender(n) for n in range(concurrency)))
+    elapsed = time.perf_counter() - start
+    for client in clients:
+        client.transport.close()
+    return results.summary(elapsed)
+
+def hierarchy_auth_up(timeout=1.0):
+    """Whether the hierarchy's authoritative stand-in answers for its zones"""
+    name = next(iter(TLD_ZONES))
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+        sock.settimeout(timeout)
+        try:
+            sock.sendto(DNSRecord.question(name, "A").pack(), HIERARCHY_AUTH)
+            response = DNSRecord.parse(sock.recv(4096))
+        except (OSError, DNSError):
+            return False
+    return response.header.rcode == RCODE.NOERROR and bool(response.rr)
+
+def git_commit():
+    """The checked-out commit, so results can be compared across commits"""
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True).stdout.strip() or None
+    except OSError:
+        return None
+
+def print_summary(result):
+    latency = result["latency_ms"]
+    print(f"\n📊 {result['server']} ({result['host']}:{result['port']}): "
+          f"{result['concurrency']} in flight, rate {result['rate'] or 'max'}, {result['elapsed']}s")
+    print(f"   Sent {result['sent']:,}  received {result['received']:,}  "
+          f"lost {result['lost']:,} ({result['loss_pct']}%)  {result['qps']:,} qps")
+    print("   Latency ms: " + "  ".join(f"{name} {value}" for name, value in latency.items()))
+    print(f"   Rcodes: {result['rcodes']}")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("servers", nargs="*", default=["auth"], help=f"servers to drive: {', '.join(SERVERS)} or all")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=None, help="override the port (single server only)")
+    parser.add_argument("-c", "--concurrency", type=int, default=50, help="queries in flight at once")
+    parser.add_argument("-Q", "--rate", type=float, default=0, help="target queries/second (0: as fast as possible)")
+    parser.add_argument("-l", "--duration", type=float, default=10, help="seconds to run per server")
+    parser.add_argument("-t", "--timeout", type=float, default=2, help="seconds before a query counts as lost")
+    parser.add_argument("--sockets", type=int, default=4, help="client UDP sockets")
+    parser.add_argument("-d", "--queries", default=None, help="dnsperf-style query file instead of the built-in mix")
+    parser.add_argument("--zone-file", default="zone/zones.json", help="zones the built-in mix is drawn from")
+    parser.add_argument("--hierarchy", action="store_true", help="add the delegated domains to the enhanced mix (the resolver must run with --auth-server 127.0.0.1:8058)")
+    parser.add_argument("--json", default=None, metavar="PATH", help="append one JSON result per server to PATH (-: stdout)")
+    args = parser.parse_args()
+
+    servers = list(SERVERS) if "all" in args.servers else args.servers
+    for server in servers:
+        if server not in SERVERS:
+            parser.error(f"unknown server {server!r}")
+    if args.port and len(servers) != 1:
+        parser.error("--port needs exactly one server")
+    if args.hierarchy and "enhanced" in servers and not args.queries and not hierarchy_auth_up():
+        parser.error("--hierarchy needs server/dns_server.py --zone-file zone/hierarchy.json --port 8058 running")
+
+    commit = git_commit()
+    for server in servers:
+        mix = load_query_file(args.queries) if args.queries else query_mix(server, args.zone_file, args.hierarchy)
+        port = args.port or SERVERS[server]
+        if args.json != "-":
+            print(f"🧪 {server}: {len(mix)} distinct queries for {args.duration}s against {args.host}:{port}")
+
+        summary = asyncio.run(run_load(args.host, port, mix, args.concurrency, args.rate,
+                                       args.duration, args.timeout, args.sockets))
+        result = {
+            "commit": commit,
+            "time": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "server": server,
+            "host": args.host,
+            "port": port,
+            "concurrency": args.concurrency,
+            "rate": args.rate,
+            "duration": args.duration,
+            "distinct_queries": len(mix),
+            **summary,
+        }
+
+        if args.json == "-":
+            print(json.dumps(result))
+        else:
+            print_summary(result)
+            if args.json:
+                with open(args.json, "a") as f:
+                    f.write(json.dumps(result) + "\n")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,219 @@
+#!/usr/bin/env python3
+"""
+Replay a query capture (--capture) against a server, at the original pace or scaled, and compare the answers
+"""
+
+import sys
+import os
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+os.chdir(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import json
+import time
+import asyncio
+import argparse
+from collections import Counter
+from dnslib import DNSRecord, QTYPE
+from core.capture import read_capture
+from dnsperf import SERVERS, LoadClient, Results, git_commit, print_summary
+
+class ReplayClient(LoadClient):
+    """A LoadClient whose futures resolve to (time received, response bytes)"""
+
+    def datagram_received(self, data, addr):
+        if len(data) < 12:
+            return
+        future = self.pending.pop(data[0] << 8 | data[1], None)
+        if future is not None and not future.done():
+            future.set_result((time.perf_counter(), data))
+
+def answer_summary(data):
+    """What two answers must agree on: rcode and the records in each section, ignoring ID, TTLs and order"""
+    try:
+        reply = DNSRecord.parse(data)
+    except Exception:
+        return ("unparseable", len(data))
+    def records(section):
+        return tuple(sorted((str(rr.rname).lower(), rr.rtype, str(rr.rdata)) for rr in section))
+    return reply.header.rcode, reply.header.tc, records(reply.rr), records(reply.auth)
+
+def describe(query):
+    try:
+        question = DNSRecord.parse(query).q
+        return f"{question.qname} {QTYPE.get(question.qtype, question.qtype)}"
+    except Exception:
+        return f"<{len(query)} byte query>"
+
+class Comparison:
+    """Replayed answers checked against the captured ones"""
+
+    def __init__(self, show=5):
+        self.show = show
+        self.matched = 0
+        self.mismatched = 0
+        self.unanswered = 0
+        self.kinds = Counter()
+        self.examples = []
+
+    def check(self, query, expected, got):
+        if not expected:
+            # Dropped or failed when captured: nothing to compare with
+            self.unanswered += 1
+            return
+        want, have = answer_summary(expected), answer_summary(got)
+        if want == have:
+            self.matched += 1
+            return
+        self.mismatched += 1
+        kind = "rcode" if want[0] != have[0] else "records"
+        self.kinds[kind] += 1
+        if len(self.examples) < self.show:
+            self.examples.append((describe(query), want, have))
+
+    def summary(self):
+        return {
+            "matched": self.matched,
+            "mismatched": self.mismatched,
+            "not_answered_in_capture": self.unanswered,
+            "mismatch_kinds": dict(self.kinds),
+        }
+
+async def replay(host, port, records, speed, timeout, sockets, concurrency, comparison):
+    """Send every captured query at its original offset / speed; speed 0 sends them back to back
+
+    At most concurrency queries are in flight; a send held back by that
+    shows up as schedule lag. Each captured client always uses the same
+    one of sockets, so per-client behaviour (rate limits, rotation) sees
+    a consistent source.
+    """
+    loop = asyncio.get_running_loop()
+    clients = []
+    for _ in range(sockets):
+        _, client = await loop.create_datagram_endpoint(ReplayClient, remote_addr=(host, port))
+        clients.append(client)
+
+    results = Results()
+    lag = []
+    tasks = []
+    slots = asyncio.Semaphore(concurrency)
+
+    async def wait(client, qid, future, sent, query, expected):
+        try:
+            received, response = await asyncio.wait_for(future, timeout)
+        except asyncio.TimeoutError:
+            results.lost += 1
+            return
+        finally:
+            client.release(qid)
+            slots.release()
+        results.received += 1
+        results.rcodes[response[3] & 0x0F] += 1
+        results.latencies.append(received - sent)
+        if comparison is not None:
+            comparison.check(query, expected, response)
+
+    start = time.perf_counter()
+    for offset, client_addr, query, expected in records:
+        if speed:
+            due = start + offset / speed
+            now = time.perf_counter()
+            if due > now:
+                await asyncio.sleep(due - now)
+        if len(query) < 12:
+            continue
+        await slots.acquire()
+        if speed:
+            lag.append(max(time.perf_counter() - due, 0))
+        client = clients[hash(client_addr) % len(clients)]
+        sent = time.perf_counter()
+        qid, future = client.send(query)
+        results.sent += 1
+        tasks.append(asyncio.ensure_future(wait(client, qid, future, sent, query, expected)))
+
+    await asyncio.gather(*tasks)
+    elapsed = time.perf_counter() - start
+    for client in clients:
+        client.transport.close()
+
+    summary = results.summary(elapsed)
+    lag.sort()
+    summary["schedule_lag_ms"] = {
+        "p50": round(lag[len(lag) // 2] * 1000, 3) if lag else None,
+        "p99": round(lag[min(len(lag) - 1, len(lag) * 99 // 100)] * 1000, 3) if lag else None,
+        "max": round(lag[-1] * 1000, 3) if lag else None,
+    }
+    return summary
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("capture", help="capture file written by a server's --capture")
+    parser.add_argument("server", nargs="?", default="auth", help=f"server to replay against: {', '.join(SERVERS)}")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=None, help="override the server's port")
+    parser.add_argument("-s", "--speed", type=float, default=1.0, help="replay N times faster than captured (0: as fast as possible)")
+    parser.add_argument("-t", "--timeout", type=float, default=2, help="seconds before a query counts as lost")
+    parser.add_argument("-c", "--concurrency", type=int, default=500, help="queries in flight at once, at most")
+    parser.add_argument("--sockets", type=int, default=16, help="client UDP sockets captured clients are spread over")
+    parser.add_argument("--limit", type=int, default=0, help="replay only the first N queries (0: all)")
+    parser.add_argument("--no-compare", action="store_true", help="don't check answers against the captured ones")
+    parser.add_argument("--show", type=int, default=5, help="mismatched answers to print")
+    parser.add_argument("--json", default=None, metavar="PATH", help="append the JSON result to PATH (-: stdout)")
+    args = parser.parse_args()
+
+    if args.server not in SERVERS:
+        parser.error(f"unknown server {args.server!r}")
+    port = args.port or SERVERS[args.server]
+    started, records = read_capture(args.capture)
+    if args.limit:
+        records = records[:args.limit]
+    if not records:
+        raise SystemExit(f"❌ No queries in {args.capture}")
+    # Start the clock at the first query, not when the capture was opened
+    first = records[0][0]
+    records = [(offset - first, *rest) for offset, *rest in records]
+    span = records[-1][0]
+
+    comparison = None if args.no_compare else Comparison(args.show)
+    if args.json != "-":
+        pace = f"{args.speed:g}x speed ({span / args.speed:.1f}s)" if args.speed else "as fast as possible"
+        print(f"🎬 Replaying {len(records):,} queries captured over {span:.1f}s "
+              f"({time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(started))}) against {args.host}:{port}, {pace}")
+
+    summary = asyncio.run(replay(args.host, port, records, args.speed, args.timeout, args.sockets,
+                                   args.concurrency, comparison))
+    result = {
+        "commit": git_commit(),
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "capture": args.capture,
+        "server": args.server,
+        "host": args.host,
+        "port": port,
+        "speed": args.speed,
+        "rate": round(len(records) / span * args.speed, 1) if span and args.speed else 0,
+        "concurrency": args.concurrency,
+        **summary,
+    }
+    if comparison is not None:
+        result["answers"] = comparison.summary()
+
+    if args.json == "-":
+        print(json.dumps(result))
+    else:
+        print_summary(result)
+        lag = result["schedule_lag_ms"]
+        if args.speed:
+            print(f"   Behind schedule ms: p50 {lag['p50']}  p99 {lag['p99']}  max {lag['max']}")
+        if comparison is not None:
+            answers = result["answers"]
+            icon = "✅" if not answers["mismatched"] else "⚠️ "
+            kinds = "".join(f" ({kind}: {count:,})" for kind, count in answers["mismatch_kinds"].items())
+            print(f"{icon} Answers: {answers['matched']:,} match, {answers['mismatched']:,} differ{kinds}, "
+                  f"{answers['not_answered_in_capture']:,} unanswered when captured")
+            for query, want, have in comparison.examples:
+                print(f"   {query}\n      captured: {want}\n      replayed: {have}")
+        if args.json:
+            with open(args.json, "a") as f:
+                f.write(json.dumps(result) + "\n")
+
+if __name__ == "__main__":
+    main()
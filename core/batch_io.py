@@ -0,0 +1,228 @@
+import errno
+import socket
+import struct
+import ctypes
+import ctypes.util
+
+MSG_DONTWAIT = getattr(socket, "MSG_DONTWAIT", 0x40)
+MAX_DATAGRAM = 4096
+
+class _IOVec(ctypes.Structure):
+    _fields_ = [("iov_base", ctypes.c_void_p), ("iov_len", ctypes.c_size_t)]
+
+class _MsgHdr(ctypes.Structure):
+    _fields_ = [
+        ("msg_name", ctypes.c_void_p),
+        ("msg_namelen", ctypes.c_uint32),
+        ("msg_iov", ctypes.POINTER(_IOVec)),
+        ("msg_iovlen", ctypes.c_size_t),
+        ("msg_control", ctypes.c_void_p),
+        ("msg_controllen", ctypes.c_size_t),
+        ("msg_flags", ctypes.c_int),
+    ]
+
+class _MMsgHdr(ctypes.Structure):
+    _fields_ = [("msg_hdr", _MsgHdr), ("msg_len", ctypes.c_uint)]
+
+MMSG_SIZE = ctypes.sizeof(_MMsgHdr)
+IOVEC_SIZE = ctypes.sizeof(_IOVec)
+MSG_LEN = _MMsgHdr.msg_len.offset
+MSG_NAMELEN = _MMsgHdr.msg_hdr.offset + _MsgHdr.msg_namelen.offset
+IOV_LEN = _IOVec.iov_len.offset
+# Room for a sockaddr_in6
+NAME_SIZE = 32
+_UINT = struct.Struct("=I")
+_SIZE = struct.Struct("N")
+
+def _load_libc():
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        recvmmsg, sendmmsg = libc.recvmmsg, libc.sendmmsg
+    except (OSError, AttributeError):
+        return None
+    recvmmsg.argtypes = [ctypes.c_int, ctypes.POINTER(_MMsgHdr), ctypes.c_uint, ctypes.c_int, ctypes.c_void_p]
+    sendmmsg.argtypes = [ctypes.c_int, ctypes.c_void_p, ctypes.c_uint, ctypes.c_int]
+    recvmmsg.restype = sendmmsg.restype = ctypes.c_int
+    return libc
+
+# None where libc has no recvmmsg/sendmmsg (anything but Linux)
+_libc = _load_libc()
+HAVE_MMSG = _libc is not None
+
+class DrainSocket:
+    """Batched I/O with plain recvfrom/sendto: one syscall per datagram
+
+    recv() still drains every datagram that is ready (up to batch) in one
+    wakeup, so the event loop is entered once per batch rather than once
+    per packet.
+    """
+
+    def __init__(self, sock, batch=64):
+        sock.setblocking(False)
+        self.sock = sock
+        self.batch = batch
+        self.syscalls = 0
+
+    def fileno(self):
+        return self.sock.fileno()
+
+    def recv(self):
+        """Return up to batch ready (data, addr) pairs without blocking"""
+        packets = []
+        recvfrom = self.sock.recvfrom
+        for _ in range(self.batch):
+            self.syscalls += 1
+            try:
+                packets.append(recvfrom(MAX_DATAGRAM))
+            except (BlockingIOError, InterruptedError):
+                break
+            except OSError:
+                # e.g. ICMP port unreachable from an earlier reply
+                continue
+        return packets
+
+    def send(self, replies):
+        """Send (data, addr) pairs; returns how many went out"""
+        sent = 0
+        for data, addr in replies:
+            self.syscalls += 1
+            try:
+                self.sock.sendto(data, addr)
+                sent += 1
+            except OSError:
+                pass
+        return sent
+
+    def sendto(self, data, addr):
+        return self.send([(data, addr)])
+
+    def close(self):
+        self.sock.close()
+
+class MMsgSocket(DrainSocket):
+    """Batched I/O with recvmmsg/sendmmsg: one syscall per batch
+
+    Datagrams, addresses and message headers live in contiguous buffers
+    allocated once; per packet, only slices are copied and lengths
+    patched with struct, so no ctypes objects are touched on the hot path.
+    """
+
+    def __init__(self, sock, batch=64):
+        super().__init__(sock, batch)
+        self.family = sock.family
+        self.recv_area = self._buffers(batch)
+        self.send_area = self._buffers(batch)
+        # The receive headers as set up, restored before every recvmmsg
+        # (the kernel overwrites msg_namelen and msg_len)
+        self.recv_template = bytes(self.recv_area[2])
+        self.names = {}
+        self.addresses = {}
+
+    def _buffers(self, batch):
+        data = ctypes.create_string_buffer(batch * MAX_DATAGRAM)
+        names = ctypes.create_string_buffer(batch * NAME_SIZE)
+        iovecs = (_IOVec * batch)()
+        msgs = (_MMsgHdr * batch)()
+        for i in range(batch):
+            iovecs[i].iov_base = ctypes.addressof(data) + i * MAX_DATAGRAM
+            iovecs[i].iov_len = MAX_DATAGRAM
+            hdr = msgs[i].msg_hdr
+            hdr.msg_name = ctypes.addressof(names) + i * NAME_SIZE
+            hdr.msg_namelen = NAME_SIZE
+            hdr.msg_iov = ctypes.pointer(iovecs[i])
+            hdr.msg_iovlen = 1
+        # The ctypes objects (kept alive here) and byte views onto them
+        return (data, names, msgs, iovecs,
+                memoryview(data).cast("B"), memoryview(names).cast("B"), memoryview(msgs).cast("B"), memoryview(iovecs).cast("B"))
+
+    def recv(self):
+        data, names, msgs, _, data_view, names_view, msgs_view, _ = self.recv_area
+        ctypes.memmove(msgs, self.recv_template, len(self.recv_template))
+        self.syscalls += 1
+        count = _libc.recvmmsg(self.sock.fileno(), msgs, self.batch, MSG_DONTWAIT, None)
+        if count < 0:
+            code = ctypes.get_errno()
+            if code in (errno.EAGAIN, errno.EWOULDBLOCK, errno.EINTR, errno.ECONNREFUSED):
+                return []
+            raise OSError(code, "recvmmsg failed")
+
+        packets = []
+        addresses = self.addresses
+        for i in range(count):
+            header = i * MMSG_SIZE
+            size, = _UINT.unpack_from(msgs_view, header + MSG_LEN)
+            namelen, = _UINT.unpack_from(msgs_view, header + MSG_NAMELEN)
+            name = bytes(names_view[i * NAME_SIZE:i * NAME_SIZE + namelen])
+            addr = addresses.get(name)
+            if addr is None:
+                if len(addresses) >= 4096:
+                    addresses.clear()
+                addr = addresses[name] = _unpack_address(name)
+            offset = i * MAX_DATAGRAM
+            packets.append((bytes(data_view[offset:offset + size]), addr))
+        return packets
+
+    def send(self, replies):
+        _, _, msgs, _, data_view, names_view, msgs_view, iovecs_view = self.send_area
+        base = ctypes.addressof(msgs)
+        sent = 0
+        # A reply bigger than a slot would spill into the next one: those
+        # go out one at a time instead
+        large = [reply for reply in replies if len(reply[0]) > MAX_DATAGRAM]
+        if large:
+            sent += DrainSocket.send(self, large)
+            replies = [reply for reply in replies if len(reply[0]) <= MAX_DATAGRAM]
+        for start in range(0, len(replies), self.batch):
+            chunk = replies[start:start + self.batch]
+            for i, (data, addr) in enumerate(chunk):
+                name = self._address(addr)
+                offset = i * MAX_DATAGRAM
+                data_view[offset:offset + len(data)] = data
+                names_view[i * NAME_SIZE:i * NAME_SIZE + len(name)] = name
+                _SIZE.pack_into(iovecs_view, i * IOVEC_SIZE + IOV_LEN, len(data))
+                _UINT.pack_into(msgs_view, i * MMSG_SIZE + MSG_NAMELEN, len(name))
+
+            done = 0
+            while done < len(chunk):
+                self.syscalls += 1
+                count = _libc.sendmmsg(self.sock.fileno(), base + done * MMSG_SIZE, len(chunk) - done, MSG_DONTWAIT)
+                if count <= 0:
+                    # Full socket buffer or a bad destination: the rest go
+                    # one at a time, and whatever still fails is dropped
+                    sent += DrainSocket.send(self, chunk[done:])
+                    break
+                done += count
+                sent += count
+        return sent
+
+    def _address(self, addr):
+        # Packed sockaddr per client, cached (clients repeat)
+        name = self.names.get(addr)
+        if name is None:
+            if len(self.names) >= 4096:
+                self.names.clear()
+            name = self.names[addr] = _pack_address(self.family, addr)
+        return name
+
+def _unpack_address(raw):
+    family = struct.unpack_from("=H", raw)[0]
+    if family == socket.AF_INET:
+        port, = struct.unpack_from("!H", raw, 2)
+        return socket.inet_ntop(socket.AF_INET, raw[4:8]), port
+    port, flowinfo = struct.unpack_from("!HI", raw, 2)
+    scope_id, = struct.unpack_from("=I", raw, 24)
+    return socket.inet_ntop(socket.AF_INET6, raw[8:24]), port, flowinfo, scope_id
+
+def _pack_address(family, addr):
+    if family == socket.AF_INET:
+        return struct.pack("=H", family) + struct.pack("!H", addr[1]) + socket.inet_pton(family, addr[0]) + bytes(8)
+    flowinfo = addr[2] if len(addr) > 2 else 0
+    scope_id = addr[3] if len(addr) > 3 else 0
+    return (struct.pack("=H", family) + struct.pack("!HI", addr[1], flowinfo)
+            + socket.inet_pton(family, addr[0]) + struct.pack("=I", scope_id))
+
+def batch_socket(sock, batch=64):
+    """Wrap a UDP socket for batched I/O, using recvmmsg/sendmmsg where available"""
+    if HAVE_MMSG and sock.family in (socket.AF_INET, socket.AF_INET6):
+        return MMsgSocket(sock, batch)
+    return DrainSocket(sock, batch)
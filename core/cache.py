@@ -0,0 +1,252 @@
+import time
+from collections import OrderedDict
+from dnslib import DNSRecord, DNSQuestion, QTYPE, RCODE, RR
+
+def cache_key(qname, qtype, qclass=1):
+    """Build a normalized (qname, qtype, qclass) cache key"""
+    if isinstance(qtype, str):
+        qtype = QTYPE.reverse[qtype]
+    return (str(qname).lower(), qtype, qclass)
+
+# lookup() states
+FRESH = "fresh"
+PREFETCH = "prefetch"  # fresh, but hot and close to expiry: refresh it now
+STALE = "stale"        # expired, served (RFC 8767) while a refresh runs
+
+class CacheEntry:
+    """A cached response: its records, when it was stored and when it expires"""
+
+    __slots__ = ("rcode", "answers", "authority", "additional", "stored", "expires", "size", "hits", "prefetched")
+
+    def __init__(self, rcode, answers, authority, additional, stored, expires, size):
+        self.rcode = rcode
+        self.answers = answers
+        self.authority = authority
+        self.additional = additional
+        self.stored = stored
+        self.expires = expires
+        self.size = size
+        self.hits = 0
+        self.prefetched = False
+
+class DNSCache:
+    """Bounded, TTL-aware LRU cache for positive and negative DNS answers"""
+
+    def __init__(self, max_entries=10000, max_bytes=None, negative_ttl=60, max_ttl=86400, clock=time.monotonic,
+                 prefetch_fraction=0.1, prefetch_hits=2, serve_stale=False, stale_ttl=30, max_stale=86400):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.negative_ttl = negative_ttl
+        self.max_ttl = max_ttl
+        self.clock = clock
+
+        # Prefetch entries hit at least prefetch_hits times once less than
+        # prefetch_fraction of their TTL is left (0 disables prefetching)
+        self.prefetch_fraction = prefetch_fraction
+        self.prefetch_hits = prefetch_hits
+
+        # RFC 8767: keep expired entries for max_stale seconds and serve
+        # them with stale_ttl while they are refreshed
+        self.serve_stale = serve_stale
+        self.stale_ttl = stale_ttl
+        self.max_stale = max_stale
+        self.entries = OrderedDict()
+        self.bytes = 0
+
+        # A SharedCache behind this one, shared with other worker
+        # processes: misses are looked up there, new answers stored there
+        self.shared = None
+        # Restored from a snapshot but not parsed yet: key -> (stored, expires, packed)
+        self.restored = {}
+
+        # Counters
+        self.hits = 0
+        self.negative_hits = 0
+        self.misses = 0
+        self.expired = 0
+        self.evictions = 0
+        self.prefetches = 0
+        self.stale_hits = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get(self, key):
+        """Return a reply for key with TTLs decremented, or None on a miss"""
+        reply, state = self.lookup(key)
+        return reply if state in (FRESH, PREFETCH) else None
+
+    def lookup(self, key):
+        """Return (reply, state) for key; state is None on a miss
+
+        PREFETCH means the answer is still fresh but should be refreshed
+        in the background; STALE means it expired and is only being served
+        (with a short TTL) because serve_stale is on.
+        """
+        entry = self.entries.get(key)
+        if entry is None and (self.shared is not None or self.restored):
+            entry = self._from_backing(key)
+        if entry is None:
+            self.misses += 1
+            return None, None
+
+        now = self.clock()
+        if now >= entry.expires:
+            if not self.serve_stale or now >= entry.expires + self.max_stale:
+                self._remove(key)
+                self.expired += 1
+                self.misses += 1
+                return None, None
+            self.entries.move_to_end(key)
+            self.stale_hits += 1
+            return self._reply(key, entry, ttl=self.stale_ttl), STALE
+
+        self.entries.move_to_end(key)
+        self.hits += 1
+        entry.hits += 1
+        if entry.rcode != RCODE.NOERROR or not entry.answers:
+            self.negative_hits += 1
+
+        reply = self._reply(key, entry, elapsed=int(now - entry.stored))
+        ttl = entry.expires - entry.stored
+        if (self.prefetch_fraction and not entry.prefetched and entry.hits >= self.prefetch_hits
+                and entry.expires - now <= ttl * self.prefetch_fraction):
+            # Only the first caller past the threshold triggers a refresh
+            entry.prefetched = True
+            self.prefetches += 1
+            return reply, PREFETCH
+        return reply, FRESH
+
+    def _reply(self, key, entry, elapsed=0, ttl=None):
+        """Build a reply from an entry, aging (or overriding) its TTLs"""
+        qname, qtype, qclass = key
+        reply = DNSRecord(q=DNSQuestion(qname, qtype, qclass)).reply()
+        reply.header.rcode = entry.rcode
+        for rr in entry.answers:
+            reply.add_answer(_aged(rr, elapsed, ttl))
+        for rr in entry.authority:
+            reply.add_auth(_aged(rr, elapsed, ttl))
+        for rr in entry.additional:
+            reply.add_ar(_aged(rr, elapsed, ttl))
+        return reply
+
+    def put(self, key, response):
+        """Cache a response; negative answers live for the SOA minimum"""
+        rcode = response.header.rcode
+        if rcode == RCODE.NOERROR and response.rr:
+            ttl = min(rr.ttl for rr in response.rr)
+        elif rcode in (RCODE.NOERROR, RCODE.NXDOMAIN):
+            ttl = self._negative_ttl(response)
+        else:
+            # SERVFAIL, REFUSED, ... are never cached
+            return False
+
+        ttl = min(ttl, self.max_ttl)
+        if ttl <= 0:
+            return False
+
+        if key in self.entries:
+            self._remove(key)
+
+        now = self.clock()
+        packed = response.pack()
+        size = len(packed)
+        self.entries[key] = CacheEntry(
+            rcode, list(response.rr), list(response.auth), list(response.ar),
+            now, now + ttl, size
+        )
+        self.bytes += size
+        self._evict()
+        if self.shared is not None:
+            self.shared.put(key, packed, now, now + ttl)
+        return True
+
+    def restore(self, key, stored, expires, packed):
+        """Add a packed response from a snapshot; it is only parsed when first looked up"""
+        if self.shared is not None:
+            # Workers may already have fetched something fresher
+            if self.shared.get(key) is None:
+                self.shared.put(key, packed, stored, expires)
+        else:
+            self.restored[key] = (stored, expires, packed)
+
+    def packed_entries(self):
+        """(key, stored, expires, packed response) for everything cached, for a snapshot"""
+        if self.shared is not None:
+            # Every worker's answers, not just this one's
+            yield from self.shared.items()
+            return
+        for key, entry in list(self.entries.items()):
+            yield key, entry.stored, entry.expires, self._reply(key, entry).pack()
+        yield from ((key, *found) for key, found in list(self.restored.items()))
+
+    def _from_backing(self, key):
+        """Copy key's entry from a snapshot or the shared cache into this one, or return None"""
+        found = self.restored.pop(key, None)
+        if found is None and self.shared is not None:
+            found = self.shared.get(key)
+        if found is None:
+            return None
+        stored, expires, packed = found
+        if self.clock() >= expires + (self.max_stale if self.serve_stale else 0):
+            return None
+        response = DNSRecord.parse(packed)
+        entry = self.entries[key] = CacheEntry(
+            response.header.rcode, list(response.rr), list(response.auth), list(response.ar),
+            stored, expires, len(packed)
+        )
+        self.bytes += entry.size
+        self._evict()
+        return entry
+
+    def invalidate(self, names):
+        """Drop every cached answer for any of the given names"""
+        names = {str(name).lower() for name in names}
+        self.restored = {key: found for key, found in self.restored.items() if key[0] not in names}
+        stale = [key for key in self.entries if key[0] in names]
+        for key in stale:
+            self._remove(key)
+        if self.shared is not None and names:
+            self.shared.invalidate(names)
+        return len(stale)
+
+    def stats(self):
+        """Return cache counters"""
+        return {
+            "entries": len(self.entries),
+            "restored": len(self.restored),
+            "bytes": self.bytes,
+            "hits": self.hits,
+            "negative_hits": self.negative_hits,
+            "misses": self.misses,
+            "expired": self.expired,
+            "evictions": self.evictions,
+            "prefetches": self.prefetches,
+            "stale_hits": self.stale_hits,
+        }
+
+    def _negative_ttl(self, response):
+        # RFC 2308: negative answers are cached for min(SOA TTL, SOA minimum)
+        for rr in response.auth:
+            if rr.rtype == QTYPE.SOA:
+                return min(rr.ttl, rr.rdata.times[4])
+        return self.negative_ttl
+
+    def _remove(self, key):
+        entry = self.entries.pop(key)
+        self.bytes -= entry.size
+
+    def _evict(self):
+        while self.entries and (
+            (self.max_entries and len(self.entries) > self.max_entries)
+            or (self.max_bytes and self.bytes > self.max_bytes)
+        ):
+            _, entry = self.entries.popitem(last=False)
+            self.bytes -= entry.size
+            self.evictions += 1
+
+def _aged(rr, elapsed, ttl=None):
+    """Copy an RR with its TTL reduced by the time it spent in the cache"""
+    if ttl is None:
+        ttl = max(rr.ttl - elapsed, 0)
+    return RR(rr.rname, rr.rtype, rr.rclass, ttl, rr.rdata)
@@ -0,0 +1,151 @@
+import os
+import time
+import struct
+import atexit
+import threading
+from collections import deque
+
+MAGIC = b"MRCAP1\n"
+_HEADER = struct.Struct("!dd")       # wall clock and perf_counter when the capture started
+_RECORD = struct.Struct("!dHBHH")    # arrival (perf_counter), client port, client host length, query length, response length
+
+class QueryCapture:
+    """Append-only recording of the queries a server receives, and its answers
+
+    record() packs one record into a bounded buffer; a background thread
+    appends the buffer to the file, one write() at a time, so forked
+    workers can share a file without splitting each other's records.
+    Arrival times are time.perf_counter() values, which every process
+    on the host shares, so a replay can keep the original spacing.
+    When the buffer is full the record is dropped and counted.
+    """
+
+    def __init__(self, path=None, max_buffer=100000, flush_interval=0.2):
+        self.path = path
+        self.max_buffer = max_buffer
+        self.flush_interval = flush_interval
+        self.buffer = deque()
+        self.lock = threading.Lock()
+        self.fd = None
+        self.pid = None
+
+        # Counters
+        self.captured = 0
+        self.written = 0
+        self.dropped = 0
+
+        atexit.register(self.flush)
+
+    def record(self, data, addr, response, start):
+        """Capture a query from addr that arrived at start (perf_counter) and what it got back"""
+        if self.path is None:
+            return
+        if self.pid != os.getpid():
+            self._start()
+        if len(self.buffer) >= self.max_buffer:
+            self.dropped += 1
+            return
+        host = addr[0].encode()
+        response = response or b""
+        self.buffer.append(_RECORD.pack(start, addr[1], len(host), len(data), len(response)) + host + data + response)
+        self.captured += 1
+
+    def _start(self):
+        # Also runs in forked workers, which don't inherit the writer thread
+        self.pid = os.getpid()
+        self.buffer = deque()
+        self.lock = threading.Lock()
+        self.fd = None
+        threading.Thread(target=self._run, name="capture", daemon=True).start()
+
+    def _run(self):
+        while True:
+            time.sleep(self.flush_interval)
+            self.flush()
+
+    def flush(self):
+        """Append everything buffered so far"""
+        if self.path is None:
+            return
+        with self.lock:
+            records = []
+            while self.buffer:
+                records.append(self.buffer.popleft())
+            if not records:
+                return
+            data = b"".join(records)
+            try:
+                if self.fd is None:
+                    self.fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+                view = memoryview(data)
+                while view:
+                    view = view[os.write(self.fd, view):]
+            except OSError:
+                self.dropped += len(records)
+                return
+            self.written += len(records)
+
+    def configure(self, path=None, max_buffer=None):
+        """Start a fresh capture file at path (before serving starts and workers fork)"""
+        self.flush()
+        if max_buffer is not None:
+            self.max_buffer = max_buffer
+        if path is None:
+            return
+        with open(path, "wb") as f:
+            f.write(MAGIC + _HEADER.pack(time.time(), time.perf_counter()))
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+        self.path = path
+
+    def stats(self):
+        """Return capture counters"""
+        return {
+            "buffered": len(self.buffer),
+            "captured": self.captured,
+            "written": self.written,
+            "dropped": self.dropped,
+        }
+
+def read_capture(path):
+    """(started wall clock, [(seconds since start, (host, port), query, response)]) from a capture file
+
+    Records are sorted by arrival, since workers append theirs in
+    batches. A record cut short at the end of the file is ignored.
+    """
+    with open(path, "rb") as f:
+        data = f.read()
+    if not data.startswith(MAGIC):
+        raise ValueError(f"{path} is not a query capture")
+    offset = len(MAGIC)
+    wall, clock = _HEADER.unpack_from(data, offset)
+    offset += _HEADER.size
+
+    records = []
+    while offset + _RECORD.size <= len(data):
+        start, port, host_length, query_length, response_length = _RECORD.unpack_from(data, offset)
+        offset += _RECORD.size
+        end = offset + host_length + query_length + response_length
+        if end > len(data):
+            break
+        host = data[offset:offset + host_length].decode()
+        offset += host_length
+        query = data[offset:offset + query_length]
+        offset += query_length
+        records.append((start - clock, (host, port), query, data[offset:end]))
+        offset = end
+    records.sort(key=lambda record: record[0])
+    return wall, records
+
+def add_capture_arguments(parser):
+    """Add the query capture options to a server's argument parser"""
+    parser.add_argument("--capture", default=None, metavar="PATH", help="record every query and response to PATH for bench/replay.py (overwritten on start)")
+    parser.add_argument("--capture-buffer", type=int, default=100000, help="captured queries buffered before new ones are dropped")
+
+def configure_capture(args):
+    """Apply add_capture_arguments() options to the shared capture"""
+    capture.configure(args.capture, args.capture_buffer)
+
+# Shared by every server in the process
+capture = QueryCapture()
@@ -0,0 +1,83 @@
+import time
+from collections import OrderedDict
+
+class Delegation:
+    """A zone cut: the zone's nameservers and the addresses to reach them"""
+
+    __slots__ = ("zone", "nameservers", "servers", "expires")
+
+    def __init__(self, zone, nameservers, servers, expires):
+        self.zone = zone
+        self.nameservers = nameservers
+        self.servers = servers
+        self.expires = expires
+
+    def __repr__(self):
+        return f"Delegation({self.zone}, {self.nameservers}, {self.servers})"
+
+class DelegationCache:
+    """Referrals learned while walking the hierarchy, keyed by zone cut
+
+    Lookups return the deepest cached cut above a name, so resolution can
+    skip straight to the servers closest to the answer.
+    """
+
+    def __init__(self, max_entries=10000, max_ttl=86400, clock=time.monotonic):
+        self.max_entries = max_entries
+        self.max_ttl = max_ttl
+        self.clock = clock
+        self.entries = OrderedDict()
+
+        # Counters
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def add(self, zone, nameservers, servers, ttl):
+        """Remember that zone is served by nameservers at servers [(ip, port)]"""
+        ttl = min(ttl, self.max_ttl)
+        if ttl <= 0 or not servers:
+            return None
+
+        zone = zone.lower()
+        delegation = Delegation(zone, list(nameservers), list(servers), self.clock() + ttl)
+        self.entries[zone] = delegation
+        self.entries.move_to_end(zone)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+            self.evictions += 1
+        return delegation
+
+    def get(self, zone):
+        """Return the unexpired delegation for exactly zone, or None"""
+        delegation = self.entries.get(zone)
+        if delegation is None:
+            return None
+        if self.clock() >= delegation.expires:
+            del self.entries[zone]
+            return None
+        self.entries.move_to_end(zone)
+        return delegation
+
+    def find(self, qname):
+        """Return the deepest cached zone cut at or above qname, or None"""
+        labels = qname.lower().rstrip(".").split(".")
+        for i in range(len(labels)):
+            delegation = self.get(".".join(labels[i:]) + ".")
+            if delegation is not None:
+                self.hits += 1
+                return delegation
+        self.misses += 1
+        return None
+
+    def stats(self):
+        """Return delegation cache counters"""
+        return {
+            "zones": len(self.entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
@@ -0,0 +1,119 @@
+import socket
+import threading
+import http.client
+from concurrent.futures import ThreadPoolExecutor
+from core.querylog import log
+
+class HealthChecker:
+    """Probes backend addresses from a background thread and tracks which are down
+
+    A target is (address, check, port, path): check "tcp" only connects,
+    "http" also sends GET path and counts any status below 500 as
+    healthy. A target goes down after fall failed probes in a row and
+    comes back after rise good ones. down is replaced, never changed in
+    place, so the serving path can read it without locking.
+    """
+
+    def __init__(self, interval=5.0, timeout=1.0, rise=2, fall=2, max_parallel=16):
+        self.interval = interval
+        self.timeout = timeout
+        self.rise = rise
+        self.fall = fall
+        self.max_parallel = max_parallel
+        self.targets = frozenset()
+        self.down = frozenset()
+        # target -> consecutive results, positive for successes, negative for failures
+        self.streaks = {}
+        self.wakeup = threading.Event()
+        self.thread = None
+
+        # Counters
+        self.probes = 0
+        self.failures = 0
+        self.transitions = 0
+
+    def watch(self, targets):
+        """Replace the set of targets probed (e.g. after a zone reload)"""
+        self.targets = frozenset(targets)
+        self.down = self.down & self.targets
+        self.streaks = {target: streak for target, streak in self.streaks.items() if target in self.targets}
+        self.wakeup.set()
+
+    def is_up(self, target):
+        return target not in self.down
+
+    def probe(self, target):
+        """Run one probe; True if the target answered"""
+        address, check, port, path = target
+        try:
+            if check == "http":
+                conn = http.client.HTTPConnection(address, port, timeout=self.timeout)
+                try:
+                    conn.request("GET", path or "/")
+                    return conn.getresponse().status < 500
+                finally:
+                    conn.close()
+            with socket.create_connection((address, port), timeout=self.timeout):
+                return True
+        except (OSError, http.client.HTTPException):
+            return False
+
+    def check_all(self):
+        """Probe every target once and update down"""
+        targets = list(self.targets)
+        if not targets:
+            return
+        with ThreadPoolExecutor(max_workers=min(self.max_parallel, len(targets))) as pool:
+            results = list(pool.map(self.probe, targets))
+
+        down = set(self.down)
+        for target, ok in zip(targets, results):
+            self.probes += 1
+            streak = self.streaks.get(target, 0)
+            if ok:
+                streak = streak + 1 if streak > 0 else 1
+            else:
+                self.failures += 1
+                streak = streak - 1 if streak < 0 else -1
+            self.streaks[target] = streak
+
+            address, check, port, _ = target
+            if target in down and streak >= self.rise:
+                down.discard(target)
+                self.transitions += 1
+                log.warning("backend_up", address=address, check=check, port=port)
+            elif target not in down and -streak >= self.fall:
+                down.add(target)
+                self.transitions += 1
+                log.warning("backend_down", address=address, check=check, port=port)
+        self.down = frozenset(down & self.targets)
+
+    def start(self):
+        """Probe every interval seconds from a daemon thread"""
+        if self.interval <= 0 or self.thread is not None:
+            return self
+        self.thread = threading.Thread(target=self._run, name="health", daemon=True)
+        self.thread.start()
+        return self
+
+    def _run(self):
+        while True:
+            self.wakeup.clear()
+            try:
+                self.check_all()
+            except Exception as e:
+                log.error("health_check_error", error=repr(e))
+            self.wakeup.wait(self.interval)
+
+    def stats(self):
+        """Return probe counters"""
+        return {
+            "targets": len(self.targets),
+            "down": len(self.down),
+            "probes": self.probes,
+            "failures": self.failures,
+            "transitions": self.transitions,
+        }
+
+# Shared by every server in the process
+health = HealthChecker()
@@ -0,0 +1,192 @@
+import time
+import threading
+from bisect import bisect_left
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from dnslib import QTYPE, RCODE
+from core.querylog import log
+from core.capture import capture
+from core.profiler import profiler
+
+# Latency buckets in seconds, 100µs to 10s
+LATENCY_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+class Counter:
+    """A monotonically increasing count per label combination"""
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.values = {}
+
+    def inc(self, *labels, value=1):
+        self.values[labels] = self.values.get(labels, 0) + value
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        for labels, value in sorted(list(self.values.items())):
+            lines.append(f"{self.name}{_labels(self.labels, labels)} {value}")
+        return lines
+
+class Histogram:
+    """Bucketed observations (e.g. latencies) per label combination
+
+    observe() is one bisect and three additions; buckets are only made
+    cumulative when rendered.
+    """
+
+    def __init__(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.buckets = buckets
+        self.values = {}
+
+    def observe(self, value, *labels):
+        series = self.values.get(labels)
+        if series is None:
+            # Per bucket counts (the last one is +Inf), then sum
+            series = self.values[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+        series[bisect_left(self.buckets, value)] += 1
+        series[-1] += value
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        for labels, series in sorted(list(self.values.items())):
+            series = list(series)
+            total = 0
+            for bound, count in zip(self.buckets + ("+Inf",), series):
+                total += count
+                lines.append(f"{self.name}_bucket{_labels(self.labels + ('le',), labels + (bound,))} {total}")
+            lines.append(f"{self.name}_sum{_labels(self.labels, labels)} {series[-1]:.6f}")
+            lines.append(f"{self.name}_count{_labels(self.labels, labels)} {total}")
+        return lines
+
+class Registry:
+    """Every metric and stats collector exposed by a process"""
+
+    def __init__(self):
+        self.metrics = []
+        self.collectors = []
+
+    def counter(self, name, help, labels=()):
+        metric = Counter(name, help, labels)
+        self.metrics.append(metric)
+        return metric
+
+    def histogram(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        metric = Histogram(name, help, labels, buckets)
+        self.metrics.append(metric)
+        return metric
+
+    def collect(self, prefix, stats, **labels):
+        """Expose the numbers in a stats() dict as gauges named prefix_<key>"""
+        self.collectors.append((prefix, stats, labels, None))
+
+    def collect_each(self, prefix, stats, key, **labels):
+        """Like collect(), for a stats() dict of dicts: the outer keys become label key"""
+        self.collectors.append((prefix, stats, labels, key))
+
+    def render(self):
+        """Return every metric in the Prometheus text exposition format"""
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.render())
+        for prefix, stats, labels, key_label in self.collectors:
+            names, values = tuple(labels), tuple(labels.values())
+            if key_label is None:
+                grouped = {key: [((), value)] for key, value in stats().items()}
+            else:
+                # {outer: {key: value}} -> {key: [((outer,), value), ...]}, one TYPE line per gauge
+                names += (key_label,)
+                grouped = {}
+                for outer, inner in stats().items():
+                    for key, value in inner.items():
+                        grouped.setdefault(key, []).append(((outer,), value))
+            for key, series in grouped.items():
+                series = [(extra, value) for extra, value in series
+                          if isinstance(value, (int, float)) and not isinstance(value, bool)]
+                if series:
+                    lines.append(f"# TYPE {prefix}_{key} gauge")
+                    for extra, value in series:
+                        lines.append(f"{prefix}_{key}{_labels(names, values + extra)} {value}")
+        return "\n".join(lines) + "\n"
+
+def _labels(names, values):
+    if not names:
+        return ""
+    pairs = ",".join(f'{name}="{_escape(value)}"' for name, value in zip(names, values))
+    return "{" + pairs + "}"
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+# Shared by every server in the process
+registry = Registry()
+
+QUERIES = registry.counter("dns_queries_total", "Queries answered, by server, qtype and rcode", ("server", "qtype", "rcode"))
+QUERY_DURATION = registry.histogram("dns_query_duration_seconds", "Time to answer a query, by server and qtype", ("server", "qtype"))
+STAGE_DURATION = registry.histogram("dns_stage_duration_seconds", "Time spent in each stage of answering a query", ("server", "stage"))
+registry.collect("dns_querylog", log.stats)
+registry.collect("dns_capture", capture.stats)
+registry.collect("dns_profiler", profiler.stats)
+
+def record_query(server, request, response, elapsed):
+    """Count one answered query and its latency, reading qtype and rcode from the wire"""
+    qtype = _question_type(request)
+    qtype = QTYPE.get(qtype, str(qtype))
+    rcode = RCODE.get(response[3] & 0x0F, "unknown") if response and len(response) >= 12 else "none"
+    QUERIES.inc(server, qtype, rcode)
+    QUERY_DURATION.observe(elapsed, server, qtype)
+
+def _question_type(data):
+    # Skip the header and the question's name labels
+    offset = 12
+    try:
+        while data[offset]:
+            if data[offset] & 0xC0:
+                offset += 1
+                break
+            offset += data[offset] + 1
+        offset += 1
+        return data[offset] << 8 | data[offset + 1]
+    except IndexError:
+        return "unknown"
+
+def stage(server, name, start):
+    """Record that a stage that began at start (time.perf_counter()) just ended"""
+    STAGE_DURATION.observe(time.perf_counter() - start, server, name)
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] not in ("/metrics", "/"):
+            self.send_error(404)
+            return
+        body = registry.render().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+def serve_metrics(port, host="127.0.0.1"):
+    """Serve /metrics on host:port from a background thread"""
+    server = ThreadingHTTPServer((host, port), MetricsHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="metrics", daemon=True).start()
+    print(f"📈 Metrics on http://{host}:{port}/metrics")
+    return server
+
+def add_metrics_arguments(parser, default_port=0):
+    """Add the metrics endpoint options to a server's argument parser"""
+    parser.add_argument("--metrics-port", type=int, default=default_port, help="serve Prometheus metrics on this port (0: off)")
+    parser.add_argument("--metrics-host", default="127.0.0.1", help="address for the metrics endpoint")
+
+def start_metrics(args, offset=0):
+    """Start the endpoint requested by add_metrics_arguments() options, if any"""
+    if args.metrics_port:
+        return serve_metrics(args.metrics_port + offset, args.metrics_host)
+    return None
@@ -0,0 +1,63 @@
+import random
+
+class ServerSelector:
+    """Pick nameservers by smoothed round-trip time
+
+    Every answer folds its RTT into the server's SRTT; failures double it,
+    to at least the failure penalty and at most max_penalty. Each time
+    servers are ranked, the ones not picked have their SRTT decayed a
+    little, and every probe_every rankings the slowest goes first, so a
+    server that was slow or down once gets re-probed instead of being
+    shunned forever.
+    """
+
+    def __init__(self, alpha=0.3, decay=0.98, failure_penalty=2.0, max_penalty=8.0,
+                 initial_rtt=0.005, probe_every=64):
+        self.alpha = alpha
+        self.decay = decay
+        self.failure_penalty = failure_penalty
+        self.max_penalty = max_penalty
+        self.initial_rtt = initial_rtt
+        self.probe_every = probe_every
+        self.srtt = {}
+        self.failures = {}
+        self.ranks = 0
+
+    def rank(self, servers):
+        """Return servers fastest first, decaying everyone but the winner"""
+        for server in servers:
+            if server not in self.srtt:
+                # Unknown servers start fast (and in random order) so they get tried
+                self.srtt[server] = random.uniform(0, self.initial_rtt)
+
+        ranked = sorted(servers, key=self.srtt.__getitem__)
+        for server in ranked[1:]:
+            self.srtt[server] *= self.decay
+        self.ranks += 1
+        if self.probe_every and self.ranks % self.probe_every == 0 and len(ranked) > 1:
+            ranked.insert(0, ranked.pop())
+        return ranked
+
+    def record(self, server, rtt):
+        """Fold a successful query's RTT into the server's SRTT"""
+        # The first answer replaces the random starting guess from rank()
+        old = self.srtt.get(server) if server in self.failures else None
+        self.srtt[server] = rtt if old is None else (1 - self.alpha) * old + self.alpha * rtt
+        self.failures[server] = 0
+
+    def record_failure(self, server):
+        """Penalize a server that timed out or errored"""
+        old = self.srtt.get(server, 0)
+        self.srtt[server] = min(max(old * 2, self.failure_penalty), self.max_penalty)
+        self.failures[server] = self.failures.get(server, 0) + 1
+
+    def record_lower_bound(self, server, elapsed):
+        """A query we abandoned took at least elapsed seconds"""
+        self.srtt[server] = max(self.srtt.get(server, 0), elapsed)
+
+    def stats(self):
+        """Return SRTT (ms) and consecutive failures per server"""
+        return {
+            f"{ip}:{port}": {"srtt_ms": round(srtt * 1000, 2), "failures": self.failures.get((ip, port), 0)}
+            for (ip, port), srtt in self.srtt.items()
+        }
@@ -0,0 +1,85 @@
+import time
+import asyncio
+from core.cache import PREFETCH, STALE
+from core.singleflight import SingleFlightFull
+
+class Prefetcher:
+    """Answer from the cache, refreshing hot and expired entries in the background
+
+    Fresh answers are returned as is. Answers the cache flags for prefetch
+    (hot and near expiry) or serves stale are returned immediately too,
+    while one background task per key fetches a new copy. Misses are
+    fetched in the foreground, shared with identical in-flight lookups.
+    A failed refresh is not retried for retry_interval seconds, so a dead
+    upstream isn't hammered while stale answers are being served.
+    """
+
+    def __init__(self, cache, inflight, retry_interval=30, clock=time.monotonic):
+        self.cache = cache
+        self.inflight = inflight
+        self.retry_interval = retry_interval
+        self.clock = clock
+        self.tasks = set()
+        self.failed = {}
+
+        # Counters
+        self.refreshes = 0
+        self.refresh_failures = 0
+
+    async def resolve(self, key, fetch, *args):
+        """Return (reply, state) for key; fetch(*args) resolves it upstream
+
+        state is FRESH, PREFETCH or STALE for cached answers and None for
+        freshly fetched ones; reply is None if the lookup failed.
+        """
+        reply, state = self.cache.lookup(key)
+        if state in (PREFETCH, STALE):
+            self.refresh(key, fetch, *args)
+        if reply is not None:
+            return reply, state
+
+        try:
+            return await self.inflight.do(key, self._fetch, key, fetch, *args), None
+        except (SingleFlightFull, asyncio.TimeoutError):
+            return None, None
+
+    def refresh(self, key, fetch, *args):
+        """Start a background refresh of key unless one is running or just failed"""
+        if key in self.inflight.calls:
+            return
+        failed = self.failed.get(key)
+        if failed is not None and self.clock() - failed < self.retry_interval:
+            return
+        task = asyncio.ensure_future(self._refresh(key, fetch, *args))
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+
+    async def _refresh(self, key, fetch, *args):
+        self.refreshes += 1
+        try:
+            response = await self.inflight.do(key, self._fetch, key, fetch, *args)
+        except Exception:
+            response = None
+        if response is None:
+            # Keep serving whatever is cached until retry_interval has passed
+            self.refresh_failures += 1
+            now = self.clock()
+            if len(self.failed) >= len(self.cache) + 1000:
+                self.failed = {k: t for k, t in self.failed.items() if now - t < self.retry_interval}
+            self.failed[key] = now
+        else:
+            self.failed.pop(key, None)
+
+    async def _fetch(self, key, fetch, *args):
+        response = await fetch(*args)
+        if response:
+            self.cache.put(key, response)
+        return response
+
+    def stats(self):
+        """Return refresh counters"""
+        return {
+            "refreshing": len(self.tasks),
+            "refreshes": self.refreshes,
+            "refresh_failures": self.refresh_failures,
+        }
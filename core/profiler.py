@@ -0,0 +1,163 @@
+import os
+import io
+import sys
+import time
+import pstats
+import signal
+import cProfile
+import threading
+from collections import Counter
+from core.querylog import log
+
+CPROFILE = "cprofile"
+SAMPLE = "sample"
+MODES = (CPROFILE, SAMPLE)
+
+class StackSampler:
+    """A low-overhead sampling profiler: records the main thread's stack every interval seconds
+
+    Runs on its own thread, so the server pays nothing but the GIL hand-off
+    per sample. Stacks are kept collapsed ("outer;inner;leaf" -> count),
+    the input flame graph tools (flamegraph.pl, speedscope) take.
+    """
+
+    def __init__(self, interval=0.005):
+        self.interval = interval
+        self.thread_id = threading.main_thread().ident
+        self.stacks = Counter()
+        self.samples = 0
+        self.running = False
+
+    def enable(self):
+        self.running = True
+        threading.Thread(target=self._run, name="sampler", daemon=True).start()
+
+    def disable(self):
+        self.running = False
+
+    def _run(self):
+        while self.running:
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+                frame = frame.f_back
+            if stack:
+                self.stacks[";".join(reversed(stack))] += 1
+                self.samples += 1
+            time.sleep(self.interval)
+
+    def dump(self, path):
+        """Write the collapsed stacks to path; returns the busiest leaf functions"""
+        with open(path, "w") as f:
+            for stack, count in self.stacks.most_common():
+                f.write(f"{stack} {count}\n")
+        leaves = Counter()
+        for stack, count in self.stacks.items():
+            leaves[stack.rsplit(";", 1)[-1]] += count
+        return [f"{leaf} {count * 100 / self.samples:.1f}%" for leaf, count in leaves.most_common(10)]
+
+class Profiler:
+    """Profiles a running server for a while when it gets SIGUSR1
+
+    The first signal starts cProfile (or a StackSampler) in the serving
+    thread; it stops after seconds, or at a second signal, and the
+    results go to directory: a pstats file plus a text report sorted by
+    cumulative time for cProfile, collapsed stacks for the sampler. The
+    top entries also go to the query log. Under run_workers() the
+    supervisor passes the signal on and each worker writes its own files.
+    """
+
+    def __init__(self, name="dns", mode=CPROFILE, seconds=30, directory="/tmp"):
+        self.name = name
+        self.mode = mode
+        self.seconds = seconds
+        self.directory = directory
+        self.signum = signal.SIGUSR1
+        self.active = None
+        self.started = None
+        self.timer = None
+
+        # Counters
+        self.profiles = 0
+
+    def install(self, signum=signal.SIGUSR1):
+        """Toggle profiling on signum"""
+        signal.signal(signum, self.toggle)
+        self.signum = signum
+
+    def toggle(self, signum=None, frame=None):
+        # Python runs signal handlers in the main thread, the one serving
+        if self.active is None:
+            self.start()
+        else:
+            self.stop()
+
+    def start(self):
+        self.active = cProfile.Profile() if self.mode == CPROFILE else StackSampler()
+        self.started = time.time()
+        self.active.enable()
+        # Stopping must also happen in the serving thread, so the timer signals us again
+        self.timer = threading.Timer(self.seconds, os.kill, (os.getpid(), self.signum))
+        self.timer.daemon = True
+        self.timer.start()
+        log.warning("profile_started", server=self.name, mode=self.mode, seconds=self.seconds)
+
+    def stop(self):
+        profile, self.active = self.active, None
+        profile.disable()
+        self.timer.cancel()
+        elapsed = round(time.time() - self.started, 1)
+        stamp = time.strftime("%Y%m%d-%H%M%S", time.localtime(self.started))
+        base = os.path.join(self.directory, f"{self.name}-{os.getpid()}-{stamp}")
+        try:
+            if self.mode == CPROFILE:
+                path = f"{base}.prof"
+                profile.dump_stats(path)
+                top = self.report(profile, f"{base}.txt")
+            else:
+                path = f"{base}.folded"
+                top = profile.dump(path)
+        except OSError as e:
+            log.error("profile_failed", server=self.name, error=repr(e))
+            return
+        self.profiles += 1
+        log.warning("profile_saved", server=self.name, mode=self.mode, seconds=elapsed, path=path, top=top)
+
+    def report(self, profile, path, lines=40):
+        """Write a cumulative-time report to path; returns the top functions"""
+        out = io.StringIO()
+        stats = pstats.Stats(profile, stream=out)
+        stats.sort_stats(pstats.SortKey.CUMULATIVE).print_stats(lines)
+        with open(path, "w") as f:
+            f.write(out.getvalue())
+        top = []
+        for (filename, line, function), (_, calls, _, cumulative, _) in stats.stats.items():
+            top.append((cumulative, f"{os.path.basename(filename)}:{line}({function}) {calls} calls {cumulative * 1000:.1f}ms"))
+        top.sort(reverse=True)
+        return [entry for _, entry in top[:10]]
+
+    def stats(self):
+        """Return profiler counters"""
+        return {
+            "active": int(self.active is not None),
+            "profiles": self.profiles,
+        }
+
+def add_profile_arguments(parser):
+    """Add the on-demand profiling options to a server's argument parser"""
+    parser.add_argument("--profile-mode", default=CPROFILE, choices=MODES, help="what kill -USR1 runs: cProfile, or a low-overhead stack sampler")
+    parser.add_argument("--profile-seconds", type=float, default=30, help="seconds a kill -USR1 profile runs (a second signal stops it early)")
+    parser.add_argument("--profile-dir", default="/tmp", help="where profiles are written")
+
+def configure_profiler(args, name):
+    """Apply add_profile_arguments() options to the shared profiler and listen for SIGUSR1"""
+    profiler.name = name
+    profiler.mode = args.profile_mode
+    profiler.seconds = args.profile_seconds
+    profiler.directory = args.profile_dir
+    profiler.install()
+
+# Shared by every server in the process
+profiler = Profiler()
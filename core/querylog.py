@@ -0,0 +1,170 @@
+import os
+import sys
+import json
+import time
+import atexit
+import random
+import threading
+from collections import deque
+from dnslib import QTYPE, RCODE
+
+DEBUG = 10
+INFO = 20
+WARNING = 30
+ERROR = 40
+
+LEVELS = {"debug": DEBUG, "info": INFO, "warning": WARNING, "error": ERROR}
+LEVEL_NAMES = {level: name for name, level in LEVELS.items()}
+
+class QueryLog:
+    """Structured JSON-lines log, written by a background thread
+
+    Logging a record only appends a tuple to a bounded buffer; formatting
+    and writing happen on the writer thread. When the buffer is full the
+    record is dropped and counted, so a slow disk or terminal never holds
+    up a query. Below WARNING, only a sample share of records is kept.
+    """
+
+    def __init__(self, path=None, level=INFO, sample=1.0, max_buffer=10000, flush_interval=0.2):
+        self.path = path
+        self.level = level
+        self.sample = sample
+        self.max_buffer = max_buffer
+        self.flush_interval = flush_interval
+        self.buffer = deque()
+        self.lock = threading.Lock()
+        self.stream = None
+        self.pid = None
+
+        # Counters
+        self.written = 0
+        self.dropped = 0
+        self.sampled_out = 0
+
+        atexit.register(self.flush)
+
+    def log(self, level, event, **fields):
+        """Queue one record: {"ts", "level", "event", **fields}"""
+        if level < self.level:
+            return
+        if level < WARNING and self.sample < 1 and random.random() >= self.sample:
+            self.sampled_out += 1
+            return
+        self._put((time.time(), level, event, fields))
+
+    def debug(self, event, **fields):
+        self.log(DEBUG, event, **fields)
+
+    def info(self, event, **fields):
+        self.log(INFO, event, **fields)
+
+    def warning(self, event, **fields):
+        self.log(WARNING, event, **fields)
+
+    def error(self, event, **fields):
+        self.log(ERROR, event, **fields)
+
+    def query(self, server, qname, qtype, addr, response=None, **fields):
+        """Log one answered query; rcode and answer count come from the response bytes"""
+        if INFO < self.level:
+            return
+        if self.sample < 1 and random.random() >= self.sample:
+            self.sampled_out += 1
+            return
+        record = {"server": server, "qname": qname, "qtype": qtype, "client": addr, "response": response}
+        record.update(fields)
+        self._put((time.time(), INFO, "query", record))
+
+    def _put(self, record):
+        if self.pid != os.getpid():
+            self._start()
+        if len(self.buffer) >= self.max_buffer:
+            self.dropped += 1
+            return
+        self.buffer.append(record)
+
+    def _start(self):
+        # Also runs in forked workers, which don't inherit the writer thread
+        self.pid = os.getpid()
+        self.buffer = deque()
+        self.lock = threading.Lock()
+        threading.Thread(target=self._run, name="querylog", daemon=True).start()
+
+    def _run(self):
+        while True:
+            time.sleep(self.flush_interval)
+            self.flush()
+
+    def flush(self):
+        """Write out everything buffered so far"""
+        with self.lock:
+            lines = []
+            while self.buffer:
+                lines.append(_format(self.buffer.popleft()))
+            if not lines:
+                return
+            try:
+                if self.stream is None:
+                    self.stream = open(self.path, "a") if self.path not in (None, "-") else sys.stdout
+                self.stream.write("".join(lines))
+                self.stream.flush()
+            except (OSError, ValueError):
+                self.dropped += len(lines)
+                return
+            self.written += len(lines)
+
+    def configure(self, path=None, level=None, sample=None, max_buffer=None):
+        """Change where and what gets logged (before serving starts)"""
+        self.flush()
+        if path is not None and path != self.path:
+            if self.stream not in (None, sys.stdout):
+                self.stream.close()
+            self.path = path
+            self.stream = None
+        if level is not None:
+            self.level = LEVELS[level] if isinstance(level, str) else level
+        if sample is not None:
+            self.sample = sample
+        if max_buffer is not None:
+            self.max_buffer = max_buffer
+
+    def stats(self):
+        """Return log counters"""
+        return {
+            "buffered": len(self.buffer),
+            "written": self.written,
+            "dropped": self.dropped,
+            "sampled_out": self.sampled_out,
+        }
+
+def _format(record):
+    ts, level, event, fields = record
+    line = {"ts": round(ts, 6), "level": LEVEL_NAMES.get(level, level), "event": event}
+    for name, value in fields.items():
+        if name == "response":
+            # Decoded here, off the serving path
+            if value and len(value) >= 12:
+                line["rcode"] = RCODE.get(value[3] & 0x0F, value[3] & 0x0F)
+                line["answers"] = value[6] << 8 | value[7]
+                line["size"] = len(value)
+        elif name == "qtype" and isinstance(value, int):
+            line[name] = QTYPE.get(value, value)
+        elif name == "client" and isinstance(value, tuple):
+            line[name] = f"{value[0]}:{value[1]}"
+        else:
+            line[name] = value
+    return json.dumps(line, default=str) + "\n"
+
+def add_log_arguments(parser):
+    """Add the query log options to a server's argument parser"""
+    parser.add_argument("--log-file", default="-", help="query log path (-: stdout)")
+    parser.add_argument("--log-level", default="info", choices=LEVELS, help="least severe level logged (debug: every resolution step)")
+    parser.add_argument("--log-sample", type=float, default=1.0, help="share of debug/info records kept")
+    parser.add_argument("--log-buffer", type=int, default=10000, help="records buffered before new ones are dropped")
+
+def configure_log(args):
+    """Apply add_log_arguments() options to the shared log"""
+    log.configure(args.log_file, args.log_level, args.log_sample, args.log_buffer)
+
+# Shared by every server in the process
+log = QueryLog()
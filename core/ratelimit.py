@@ -0,0 +1,190 @@
+import time
+import ipaddress
+from dnslib import RCODE
+from core.wire import decode_query, empty_reply, truncated_reply
+
+# What RateLimiter.check() decides for a query
+ALLOW = "allow"  # answer normally
+SLIP = "slip"    # answer with an empty TC=1 reply (a real client retries over TCP)
+DROP = "drop"    # send nothing
+
+SHED_RCODES = {"servfail": RCODE.SERVFAIL, "refused": RCODE.REFUSED}
+
+class Overloaded(Exception):
+    """Raised when a query is turned away to protect the server"""
+
+class RateLimiter:
+    """Token bucket per client prefix (response rate limiting)
+
+    Clients are grouped by ipv4_prefix/ipv6_prefix, so a flood spread
+    over one network shares one bucket. Each bucket refills at rate
+    tokens a second up to burst; a query over the limit is dropped,
+    except every slip-th one, which gets a TC=1 reply so a genuine
+    client whose address is being spoofed can still get through.
+    """
+
+    def __init__(self, rate=0, burst=None, slip=2, ipv4_prefix=24, ipv6_prefix=56, max_clients=100000, clock=time.monotonic):
+        self.rate = rate
+        self.burst = burst or max(rate, 1)
+        self.slip = slip
+        self.ipv4_prefix = ipv4_prefix
+        self.ipv6_prefix = ipv6_prefix
+        self.max_clients = max_clients
+        self.clock = clock
+        # prefix -> [tokens, last refill, queries limited]
+        self.buckets = {}
+        self.prefixes = {}
+
+        # Counters
+        self.allowed = 0
+        self.slipped = 0
+        self.dropped = 0
+
+    def prefix(self, host):
+        """The bucket key for a client address"""
+        key = self.prefixes.get(host)
+        if key is None:
+            if len(self.prefixes) >= self.max_clients:
+                self.prefixes.clear()
+            try:
+                address = ipaddress.ip_address(host.split("%")[0])
+                bits = self.ipv4_prefix if address.version == 4 else self.ipv6_prefix
+                # Plain string keys: hashing ip_network objects is slow
+                key = str(ipaddress.ip_network(f"{address}/{bits}", strict=False))
+            except ValueError:
+                key = host
+            self.prefixes[host] = key
+        return key
+
+    def check(self, addr):
+        """ALLOW, SLIP or DROP for a query from addr"""
+        if not self.rate:
+            return ALLOW
+        now = self.clock()
+        key = self.prefixes.get(addr[0]) or self.prefix(addr[0])
+        bucket = self.buckets.get(key)
+        if bucket is None:
+            if len(self.buckets) >= self.max_clients:
+                self.prune(now)
+            bucket = self.buckets[key] = [self.burst, now, 0]
+
+        tokens = min(self.burst, bucket[0] + (now - bucket[1]) * self.rate)
+        bucket[1] = now
+        if tokens >= 1:
+            bucket[0] = tokens - 1
+            self.allowed += 1
+            return ALLOW
+        bucket[0] = tokens
+        bucket[2] += 1
+        if self.slip and bucket[2] % self.slip == 0:
+            self.slipped += 1
+            return SLIP
+        self.dropped += 1
+        return DROP
+
+    def prune(self, now):
+        """Forget buckets that have refilled (their clients went quiet)"""
+        full = self.burst / self.rate
+        self.buckets = {key: bucket for key, bucket in self.buckets.items() if now - bucket[1] < full}
+        if len(self.buckets) >= self.max_clients:
+            self.buckets.clear()
+
+    def stats(self):
+        """Return rate limiting counters"""
+        return {
+            "clients": len(self.buckets),
+            "allowed": self.allowed,
+            "slipped": self.slipped,
+            "dropped": self.dropped,
+        }
+
+class Admission:
+    """Caps how many resolutions run at once; the rest are refused right away"""
+
+    def __init__(self, max_inflight=0):
+        self.max_inflight = max_inflight
+        self.inflight = 0
+
+        # Counters
+        self.admitted = 0
+        self.rejected = 0
+
+    async def run(self, fn, *args):
+        """Return await fn(*args), or raise Overloaded if max_inflight are already running"""
+        if self.max_inflight and self.inflight >= self.max_inflight:
+            self.rejected += 1
+            raise Overloaded(f"{self.inflight} resolutions in flight")
+        self.inflight += 1
+        self.admitted += 1
+        try:
+            return await fn(*args)
+        finally:
+            self.inflight -= 1
+
+    def stats(self):
+        """Return admission counters"""
+        return {
+            "inflight": self.inflight,
+            "admitted": self.admitted,
+            "rejected": self.rejected,
+        }
+
+class OverloadGuard:
+    """What a UDP server checks before answering a query
+
+    admit() applies the client rate limit as soon as a datagram arrives.
+    late() is asked again when the handler is about to run: a query that
+    already waited longer than max_queue_delay seconds (behind a batch,
+    or for the event loop) is shed with shed_rcode instead, since its
+    client has likely given up and answering it only delays the rest.
+    """
+
+    def __init__(self, limiter=None, max_queue_delay=0.0, shed_rcode=RCODE.SERVFAIL):
+        self.limiter = limiter or RateLimiter()
+        self.max_queue_delay = max_queue_delay
+        self.shed_rcode = shed_rcode
+
+        # Counters
+        self.shed_count = 0
+
+    def admit(self, data, addr):
+        """None to answer the query, else the reply to send instead (b"": nothing)"""
+        verdict = self.limiter.check(addr)
+        if verdict is ALLOW:
+            return None
+        if verdict is SLIP:
+            return truncated_reply(data) or b""
+        return b""
+
+    def late(self, start):
+        """True if a query received at start (perf_counter) waited too long"""
+        return self.max_queue_delay > 0 and time.perf_counter() - start > self.max_queue_delay
+
+    def shed(self, data):
+        """The reply to a query turned away under load (b"" if it can't be parsed)"""
+        self.shed_count += 1
+        try:
+            return empty_reply(data, decode_query(data), self.shed_rcode)
+        except Exception:
+            return b""
+
+    def stats(self):
+        """Return rate limiting and shedding counters"""
+        return dict(self.limiter.stats(), shed=self.shed_count)
+
+def add_overload_arguments(parser, recursion=False):
+    """Add the rate limiting and load shedding options to a server's argument parser"""
+    parser.add_argument("--rate-limit", type=float, default=0, help="queries per second allowed per client prefix (0: off)")
+    parser.add_argument("--rate-burst", type=float, default=None, help="queries a client prefix may send at once (default: --rate-limit)")
+    parser.add_argument("--slip", type=int, default=2, help="answer every Nth rate-limited query with TC=1 instead of dropping it (0: drop all)")
+    parser.add_argument("--ipv4-prefix", type=int, default=24, help="IPv4 prefix length clients are grouped by")
+    parser.add_argument("--ipv6-prefix", type=int, default=56, help="IPv6 prefix length clients are grouped by")
+    parser.add_argument("--max-queue-delay", type=float, default=0, help="shed queries that waited longer than this many seconds (0: off)")
+    parser.add_argument("--shed-rcode", default="servfail", choices=SHED_RCODES, help="rcode for shed and refused queries")
+    if recursion:
+        parser.add_argument("--max-recursions", type=int, default=0, help="resolutions allowed in flight at once (0: unlimited)")
+
+def overload_guard(args):
+    """An OverloadGuard built from add_overload_arguments() options"""
+    limiter = RateLimiter(args.rate_limit, args.rate_burst, args.slip, args.ipv4_prefix, args.ipv6_prefix)
+    return OverloadGuard(limiter, args.max_queue_delay, SHED_RCODES[args.shed_rcode])
@@ -0,0 +1,205 @@
+import zlib
+import struct
+import multiprocessing
+from multiprocessing import shared_memory
+
+# Slot header: seqlock counter, hash, stored, expires, key length, data length
+_SLOT = struct.Struct("=IIddHH")
+_SEQ = struct.Struct("=I")
+SLOT_HEADER = _SLOT.size
+
+def key_bytes(key):
+    """A DNSCache key (qname, qtype, qclass) as bytes"""
+    qname, qtype, qclass = key
+    return f"{qname}|{qtype}|{qclass}".encode()
+
+class SharedCache:
+    """Fixed-size open-addressing hash table of packed answers in shared memory
+
+    Made before the resolver forks its workers, so every worker maps the
+    same table: one worker's upstream answer is a hit for all of them.
+    Each slot holds one key and its packed response with the times it
+    was stored and expires (time.monotonic is shared by every process).
+
+    Reads take no lock. A slot's seqlock counter is odd while a writer is
+    inside it, and a read that sees it odd or changed is thrown away.
+    A key lives in one of probes slots after its hash; a full
+    neighbourhood evicts the entry closest to expiry. Writers lock the
+    stripes (runs of slots) their key's neighbourhood falls in before
+    picking a slot, so writers to different parts of the table rarely
+    wait for each other.
+    """
+
+    def __init__(self, slots=65536, slot_size=512, probes=8, stripes=64):
+        self.slots = slots
+        self.slot_size = slot_size
+        self.probes = min(probes, slots)
+        self.memory = shared_memory.SharedMemory(create=True, size=slots * slot_size)
+        # Workers inherit the mapping when they fork; nothing needs the
+        # name after that, so it can't leak if we are killed
+        self.memory.unlink()
+        self.buf = self.memory.buf
+        self.locks = [multiprocessing.Lock() for _ in range(stripes)]
+
+        # Counters (per process)
+        self.hits = 0
+        self.misses = 0
+        self.stores = 0
+        self.evictions = 0
+        self.too_large = 0
+        self.retries = 0
+
+    def _read(self, offset, key, hash_):
+        """(stored, expires, data) if the slot at offset holds key, else None"""
+        buf = self.buf
+        for _ in range(4):
+            seq, slot_hash, stored, expires, key_len, data_len = _SLOT.unpack_from(buf, offset)
+            if seq & 1:
+                self.retries += 1
+                continue
+            if slot_hash != hash_ or key_len != len(key):
+                return None
+            start = offset + SLOT_HEADER
+            found = bytes(buf[start:start + key_len]) == key
+            data = bytes(buf[start + key_len:start + key_len + data_len]) if found else None
+            if _SEQ.unpack_from(buf, offset)[0] != seq:
+                # A writer got in while we copied
+                self.retries += 1
+                continue
+            return (stored, expires, data) if found else None
+        return None
+
+    def get(self, key):
+        """(stored, expires, packed response) for key, or None"""
+        raw = key_bytes(key)
+        hash_ = zlib.crc32(raw) or 1
+        first = hash_ % self.slots
+        for i in range(self.probes):
+            offset = (first + i) % self.slots * self.slot_size
+            found = self._read(offset, raw, hash_)
+            if found is not None:
+                self.hits += 1
+                return found
+        self.misses += 1
+        return None
+
+    def _stripe(self, index):
+        # Stripes are contiguous runs of slots, so a key's probes span one or two
+        return index * len(self.locks) // self.slots
+
+    def _claim(self, first, raw, hash_):
+        """The slot for key raw: its own, else a free one, else the one expiring soonest
+
+        Call with the stripes of every probed slot locked.
+        """
+        buf = self.buf
+        free = oldest = oldest_expires = None
+        for i in range(self.probes):
+            index = (first + i) % self.slots
+            offset = index * self.slot_size
+            _, slot_hash, _, slot_expires, key_len, _ = _SLOT.unpack_from(buf, offset)
+            if not slot_hash:
+                # Never used, so the key isn't in any slot after it either
+                return index if free is None else free
+            if slot_hash == hash_ and key_len == len(raw):
+                start = offset + SLOT_HEADER
+                if buf[start:start + key_len] == raw:
+                    return index
+            if not key_len:
+                # Invalidated
+                if free is None:
+                    free = index
+            elif oldest is None or slot_expires < oldest_expires:
+                oldest, oldest_expires = index, slot_expires
+        if free is not None:
+            return free
+        self.evictions += 1
+        return oldest
+
+    def put(self, key, data, stored, expires):
+        """Store a packed response; False if it doesn't fit in a slot"""
+        raw = key_bytes(key)
+        if SLOT_HEADER + len(raw) + len(data) > self.slot_size:
+            self.too_large += 1
+            return False
+        hash_ = zlib.crc32(raw) or 1
+        first = hash_ % self.slots
+
+        # The slot is picked under the locks, so two writers can't both claim it
+        stripes = sorted({self._stripe((first + i) % self.slots) for i in range(self.probes)})
+        for stripe in stripes:
+            self.locks[stripe].acquire()
+        try:
+            victim = self._claim(first, raw, hash_)
+            buf = self.buf
+            offset = victim * self.slot_size
+            start = offset + SLOT_HEADER
+            seq = _SEQ.unpack_from(buf, offset)[0]
+            _SEQ.pack_into(buf, offset, seq + 1)
+            buf[start:start + len(raw)] = raw
+            buf[start + len(raw):start + len(raw) + len(data)] = data
+            _SLOT.pack_into(buf, offset, seq + 1, hash_, stored, expires, len(raw), len(data))
+            _SEQ.pack_into(buf, offset, seq + 2)
+        finally:
+            for stripe in reversed(stripes):
+                self.locks[stripe].release()
+        self.stores += 1
+        return True
+
+    def items(self):
+        """(key, stored, expires, packed response) for every entry, e.g. for a snapshot"""
+        buf = self.buf
+        for index in range(self.slots):
+            offset = index * self.slot_size
+            seq, slot_hash, stored, expires, key_len, data_len = _SLOT.unpack_from(buf, offset)
+            if not slot_hash or not key_len or seq & 1:
+                continue
+            start = offset + SLOT_HEADER
+            raw = bytes(buf[start:start + key_len])
+            data = bytes(buf[start + key_len:start + key_len + data_len])
+            if _SEQ.unpack_from(buf, offset)[0] != seq:
+                continue
+            qname, qtype, qclass = raw.decode().rsplit("|", 2)
+            yield (qname, int(qtype), int(qclass)), stored, expires, data
+
+    def invalidate(self, names):
+        """Drop every entry for any of the given names (scans the whole table)"""
+        names = {str(name).lower().encode() for name in names}
+        dropped = 0
+        buf = self.buf
+        for index in range(self.slots):
+            offset = index * self.slot_size
+            if not self._holds(offset, names):
+                continue
+            with self.locks[self._stripe(index)]:
+                # A put may have reused the slot since the unlocked look
+                if not self._holds(offset, names):
+                    continue
+                seq, slot_hash = _SLOT.unpack_from(buf, offset)[:2]
+                _SEQ.pack_into(buf, offset, seq + 1)
+                # Keeps the slot taken (so probes continue past it) but matching no key
+                _SLOT.pack_into(buf, offset, seq + 1, slot_hash, 0.0, 0.0, 0, 0)
+                _SEQ.pack_into(buf, offset, seq + 2)
+            dropped += 1
+        return dropped
+
+    def _holds(self, offset, names):
+        """Whether the slot at offset holds an entry for one of names"""
+        buf = self.buf
+        _, slot_hash, _, _, key_len, _ = _SLOT.unpack_from(buf, offset)
+        if not slot_hash or not key_len:
+            return False
+        start = offset + SLOT_HEADER
+        return bytes(buf[start:start + key_len]).split(b"|", 1)[0] in names
+
+    def stats(self):
+        """Return shared cache counters (this process's lookups)"""
+        return {
+            "slots": self.slots,
+            "hits": self.hits,
+            "misses": self.misses,
+            "stores": self.stores,
+            "evictions": self.evictions,
+            "too_large": self.too_large,
+            "retries": self.retries,
+        }
@@ -0,0 +1,77 @@
+import asyncio
+
+class SingleFlightFull(Exception):
+    """Raised when too many callers are already waiting on the same key"""
+
+class SingleFlight:
+    """Collapse concurrent identical lookups into one upstream call
+
+    The first caller for a key runs the lookup; everyone who asks for the
+    same key while it is in flight waits for that result instead (at most
+    max_waiters of them, each for at most timeout seconds).
+    """
+
+    def __init__(self, max_waiters=1000, timeout=10):
+        self.max_waiters = max_waiters
+        self.timeout = timeout
+        self.calls = {}
+
+        # Counters
+        self.leaders = 0
+        self.coalesced = 0
+        self.rejected = 0
+        self.timeouts = 0
+
+    def __len__(self):
+        return len(self.calls)
+
+    async def do(self, key, fn, *args):
+        """Return await fn(*args), sharing the call with identical keys"""
+        call = self.calls.get(key)
+        if call is not None:
+            return await self._wait(call)
+
+        future = asyncio.get_running_loop().create_future()
+        # Nobody may be waiting; don't warn about unretrieved exceptions
+        future.add_done_callback(lambda f: f.cancelled() or f.exception())
+        call = self.calls[key] = [future, 0]
+        self.leaders += 1
+        try:
+            result = await fn(*args)
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            del self.calls[key]
+
+    async def _wait(self, call):
+        future, waiters = call
+        if waiters >= self.max_waiters:
+            self.rejected += 1
+            raise SingleFlightFull(f"{waiters} callers already waiting")
+
+        call[1] += 1
+        self.coalesced += 1
+        try:
+            return await asyncio.wait_for(asyncio.shield(future), self.timeout)
+        except asyncio.TimeoutError:
+            self.timeouts += 1
+            raise
+        finally:
+            call[1] -= 1
+
+    def stats(self):
+        """Return singleflight counters"""
+        return {
+            "in_flight": len(self.calls),
+            "leaders": self.leaders,
+            "coalesced": self.coalesced,
+            "rejected": self.rejected,
+            "timeouts": self.timeouts,
+        }
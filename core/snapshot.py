@@ -0,0 +1,236 @@
+import os
+import json
+import time
+import signal
+import struct
+import asyncio
+from core.querylog import log
+
+MAGIC = b"MRSNAP1\n"
+_HEADER = struct.Struct("!d")        # wall clock time of the snapshot
+_RECORD = struct.Struct("!BI")       # kind, payload length
+_ANSWER = struct.Struct("!ddHHB")    # age, seconds left, qtype, qclass, qname length
+
+ANSWER = 1
+DELEGATION = 2
+
+class CacheSnapshot:
+    """Saves a resolver's answer cache and delegations to disk, and restores them on startup
+
+    The file is a header and a stream of length-prefixed records: answers
+    as packed wire responses, delegations as JSON. Times are stored
+    relative to the moment of the snapshot, and the snapshot's wall
+    clock time is in the header, so on load every entry loses however
+    long the resolver was down; whatever has expired by then is skipped.
+    Answers are restored packed and only parsed when first looked up.
+    """
+
+    def __init__(self, path, cache, delegations=None, interval=300, clock=time.monotonic, wall_clock=time.time):
+        self.path = path
+        self.cache = cache
+        self.delegations = delegations
+        self.interval = interval
+        self.clock = clock
+        self.wall_clock = wall_clock
+
+        # Counters
+        self.saves = 0
+        self.saved = 0
+        self.loaded = 0
+        self.skipped = 0
+
+    def records(self):
+        """The snapshot file, piece by piece: header, then one record per entry"""
+        now = self.clock()
+        yield MAGIC + _HEADER.pack(self.wall_clock())
+        for (qname, qtype, qclass), stored, expires, packed in self.cache.packed_entries():
+            if expires <= now:
+                continue
+            name = qname.encode()
+            payload = _ANSWER.pack(now - stored, expires - now, qtype, qclass, len(name)) + name + packed
+            yield _RECORD.pack(ANSWER, len(payload)) + payload
+        if self.delegations is not None:
+            for delegation in list(self.delegations.entries.values()):
+                if delegation.expires <= now:
+                    continue
+                payload = json.dumps([delegation.zone, delegation.nameservers, delegation.servers,
+                                      delegation.expires - now]).encode()
+                yield _RECORD.pack(DELEGATION, len(payload)) + payload
+
+    def write(self, data):
+        """Replace the snapshot file atomically"""
+        tmp = f"{self.path}.tmp"
+        with open(tmp, "wb") as f:
+            f.write(data)
+        os.replace(tmp, self.path)
+
+    def save(self):
+        """Write a snapshot now (blocking); returns the entries saved"""
+        start = time.perf_counter()
+        chunks = list(self.records())
+        data = b"".join(chunks)
+        self.write(data)
+        self.saves += 1
+        self.saved = count = len(chunks) - 1
+        log.info("snapshot_saved", path=self.path, entries=count, bytes=len(data),
+                 ms=round((time.perf_counter() - start) * 1000, 1))
+        return count
+
+    async def save_async(self, chunk=500):
+        """Write a snapshot without holding up queries
+
+        Entries are packed chunk at a time between queries, and the file
+        is written from a thread.
+        """
+        chunks = []
+        for record in self.records():
+            chunks.append(record)
+            if len(chunks) % chunk == 0:
+                await asyncio.sleep(0)
+        data = b"".join(chunks)
+        await asyncio.get_running_loop().run_in_executor(None, self.write, data)
+        self.saves += 1
+        self.saved = count = len(chunks) - 1
+        log.info("snapshot_saved", path=self.path, entries=count, bytes=len(data))
+
+    def read(self, answers=True):
+        """Parse the snapshot file, without touching the cache; returns (entries, expired, downtime) or None
+
+        Entries are (ANSWER, key, stored, expires, packed) and (DELEGATION,
+        zone, nameservers, servers, ttl), their times already reduced by
+        the downtime, for apply(). Only reads, so it can run in a thread.
+        With answers false, only delegations are read.
+        """
+        try:
+            with open(self.path, "rb") as f:
+                data = f.read()
+        except FileNotFoundError:
+            return None
+        if not data.startswith(MAGIC):
+            log.warning("snapshot_invalid", path=self.path)
+            return None
+
+        now = self.clock()
+        offset = len(MAGIC)
+        taken, = _HEADER.unpack_from(data, offset)
+        offset += _HEADER.size
+        # Time spent down counts against every TTL
+        elapsed = max(self.wall_clock() - taken, 0)
+        stale = self.cache.max_stale if self.cache.serve_stale else 0
+        entries = []
+        skipped = 0
+        try:
+            while offset < len(data):
+                kind, length = _RECORD.unpack_from(data, offset)
+                offset += _RECORD.size
+                payload = data[offset:offset + length]
+                offset += length
+                if kind == ANSWER and answers:
+                    age, left, qtype, qclass, name_length = _ANSWER.unpack_from(payload)
+                    left -= elapsed
+                    if left + stale <= 0:
+                        skipped += 1
+                        continue
+                    name_end = _ANSWER.size + name_length
+                    key = (payload[_ANSWER.size:name_end].decode(), qtype, qclass)
+                    entries.append((ANSWER, key, now - elapsed - age, now + left, payload[name_end:]))
+                elif kind == DELEGATION and self.delegations is not None:
+                    zone, nameservers, servers, left = json.loads(payload)
+                    left -= elapsed
+                    if left <= 0:
+                        skipped += 1
+                        continue
+                    entries.append((DELEGATION, zone, nameservers, [tuple(server) for server in servers], left))
+        except (struct.error, ValueError, UnicodeDecodeError) as e:
+            # A truncated file still gives us everything before the damage
+            log.warning("snapshot_truncated", path=self.path, error=repr(e))
+        return entries, skipped, elapsed
+
+    def apply(self, entries):
+        """Put entries from read() into the cache and delegations"""
+        for kind, *entry in entries:
+            if kind == ANSWER:
+                self.cache.restore(*entry)
+            else:
+                self.delegations.add(*entry)
+
+    def _loaded(self, found, start):
+        entries, skipped, elapsed = found
+        self.loaded += len(entries)
+        self.skipped += skipped
+        log.info("snapshot_loaded", path=self.path, entries=len(entries), expired=skipped,
+                 downtime=round(elapsed, 1), ms=round((time.perf_counter() - start) * 1000, 1))
+        return len(entries)
+
+    def load(self, answers=True):
+        """Restore a snapshot now (blocking; missing or bad files are ignored); returns entries loaded"""
+        start = time.perf_counter()
+        found = self.read(answers)
+        if found is None:
+            return 0
+        self.apply(found[0])
+        return self._loaded(found, start)
+
+    async def load_async(self, answers=True, chunk=500):
+        """Restore a snapshot without holding up queries
+
+        The file is read and parsed in a thread; entries go into the
+        cache chunk at a time between queries.
+        """
+        start = time.perf_counter()
+        found = await asyncio.get_running_loop().run_in_executor(None, self.read, answers)
+        if found is None:
+            return 0
+        entries = found[0]
+        for i in range(0, len(entries), chunk):
+            self.apply(entries[i:i + chunk])
+            await asyncio.sleep(0)
+        return self._loaded(found, start)
+
+    async def run(self):
+        """Load the snapshot, then save one every interval and on SIGTERM/SIGINT
+
+        Meant to run as a task once the server's socket is bound, so
+        queries are answered while the snapshot is read. Saving on a
+        signal starts only once loading is done, so a half-restored
+        cache never replaces the file.
+        """
+        await self.load_async()
+        loop = asyncio.get_running_loop()
+        for signum in (signal.SIGTERM, signal.SIGINT):
+            loop.add_signal_handler(signum, self.shutdown)
+        while self.interval > 0:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.save_async()
+            except OSError as e:
+                log.error("snapshot_failed", path=self.path, error=repr(e))
+
+    async def restore(self, answers=True):
+        """Just load the snapshot: for workers that read it but leave saving to another
+
+        With answers false (the answers are in a cache another worker
+        restores) only the delegations are loaded.
+        """
+        if answers or self.delegations is not None:
+            await self.load_async(answers)
+
+    def shutdown(self):
+        """Save a final snapshot and stop the server"""
+        try:
+            self.save()
+        except OSError as e:
+            log.error("snapshot_failed", path=self.path, error=repr(e))
+        # Workers leave with os._exit(), which skips the log's atexit flush
+        log.flush()
+        # run_udp_server() treats this as a clean stop
+        raise KeyboardInterrupt
+
+    def stats(self):
+        """Return snapshot counters"""
+        return {
+            "saves": self.saves,
+            "saved": self.saved,
+            "loaded": self.loaded,
+            "skipped": self.skipped,
+        }
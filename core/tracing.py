@@ -0,0 +1,160 @@
+import time
+import random
+import contextvars
+from core.querylog import log
+
+# The trace and span the running task is inside (each query is its own task)
+_trace = contextvars.ContextVar("trace", default=None)
+_span = contextvars.ContextVar("span", default=None)
+
+class Span:
+    """One timed step of a traced query, e.g. a hop to the root servers"""
+
+    __slots__ = ("trace", "name", "fields", "parent", "start", "end", "token")
+
+    def __init__(self, trace, name, fields):
+        self.trace = trace
+        self.name = name
+        self.fields = fields
+        self.parent = None
+        self.start = None
+        self.end = None
+        self.token = None
+
+    def set(self, **fields):
+        """Add fields (server chosen, outcome, ...) to the span"""
+        self.fields.update(fields)
+
+    def __enter__(self):
+        self.parent = _span.get()
+        self.token = _span.set(self)
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.end = time.perf_counter()
+        _span.reset(self.token)
+        if exc_type is not None and exc_type is not GeneratorExit:
+            self.fields["error"] = exc_type.__name__
+        if not self.trace.finished:
+            self.trace.spans.append(self)
+        return False
+
+    def record(self):
+        origin = self.trace.start
+        record = {"name": self.name, "at_ms": round((self.start - origin) * 1000, 3),
+                  "ms": round((self.end - self.start) * 1000, 3)}
+        if self.parent is not None:
+            record["parent"] = self.parent.name
+        record.update(self.fields)
+        return record
+
+class _NoSpan:
+    """Stands in for a Span when the query isn't traced"""
+
+    def set(self, **fields):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+NO_SPAN = _NoSpan()
+
+class Trace:
+    """The spans recorded while answering one query"""
+
+    __slots__ = ("server", "qname", "qtype", "client", "sampled", "start", "spans", "finished", "token")
+
+    def __init__(self, server, qname, qtype, client, sampled):
+        self.server = server
+        self.qname = qname
+        self.qtype = qtype
+        self.client = client
+        self.sampled = sampled
+        self.start = time.perf_counter()
+        self.spans = []
+        self.finished = False
+        self.token = None
+
+class Tracer:
+    """Decides which queries are traced and logs their spans
+
+    A sample share of queries is traced and logged. With slow (seconds)
+    set, every query is traced but only logged if it was sampled or took
+    at least that long, which is how the odd slow lookup gets caught.
+    Spans end up in the query log as one "trace" record per query.
+    """
+
+    def __init__(self, sample=0.0, slow=0.0):
+        self.sample = sample
+        self.slow = slow
+
+        # Counters
+        self.traced = 0
+        self.logged = 0
+
+    def begin(self, server, qname, qtype, client=None):
+        """Start tracing a query in the current task; returns the Trace, or None if it isn't traced"""
+        sampled = self.sample > 0 and (self.sample >= 1 or random.random() < self.sample)
+        if not sampled and not self.slow:
+            return None
+        trace = Trace(server, qname, qtype, client, sampled)
+        trace.token = _trace.set(trace)
+        self.traced += 1
+        return trace
+
+    def end(self, trace, response=None):
+        """Finish a trace from begin() and log it if it was sampled or slow"""
+        if trace is None:
+            return
+        trace.finished = True
+        _trace.reset(trace.token)
+        elapsed = time.perf_counter() - trace.start
+        if not trace.sampled and elapsed < self.slow:
+            return
+        self.logged += 1
+        # Spans are appended as they end; list them in the order they began
+        spans = sorted(trace.spans, key=lambda span: span.start)
+        log.info("trace", server=trace.server, qname=trace.qname, qtype=trace.qtype, client=trace.client,
+                 response=response, ms=round(elapsed * 1000, 3), slow=not trace.sampled,
+                 spans=[span.record() for span in spans])
+
+    def stats(self):
+        """Return tracing counters"""
+        return {
+            "traced": self.traced,
+            "logged": self.logged,
+        }
+
+def span(name, **fields):
+    """A Span for a step of the traced query this task is answering (a no-op if it isn't traced)
+
+    Use as a context manager: with span("root_hop", server=...) as s: ...
+    """
+    trace = _trace.get()
+    if trace is None or trace.finished:
+        # Not traced, or a background task (a prefetch) outliving its query
+        return NO_SPAN
+    return Span(trace, name, fields)
+
+def annotate(**fields):
+    """Add fields to the innermost open span, if the current query is traced"""
+    current = _span.get()
+    if current is not None:
+        current.fields.update(fields)
+
+def add_trace_arguments(parser):
+    """Add the query tracing options to a server's argument parser"""
+    parser.add_argument("--trace-sample", type=float, default=0, help="share of queries traced hop by hop into the query log")
+    parser.add_argument("--trace-slow", type=float, default=0, metavar="MS", help="also log the trace of any query slower than this (0: off)")
+
+def configure_tracing(args):
+    """Apply add_trace_arguments() options to the shared tracer"""
+    tracer.sample = args.trace_sample
+    tracer.slow = args.trace_slow / 1000
+
+# Shared by every server in the process
+tracer = Tracer()
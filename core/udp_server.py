@@ -0,0 +1,205 @@
+import time
+import socket
+import asyncio
+import inspect
+from core.querylog import log
+from core.capture import capture
+from core.metrics import record_query
+from core.batch_io import batch_socket
+from core.ratelimit import Overloaded
+
+class DNSServerProtocol(asyncio.DatagramProtocol):
+    """Datagram protocol that hands every query to a server's handler
+
+    The handler is called as handler(data, addr) and returns the response
+    bytes (or None to send nothing). Coroutine handlers run as tasks, so a
+    slow upstream lookup never holds up other clients. An OverloadGuard
+    rate limits clients before the handler runs and sheds queries that
+    waited too long (or whose handler raised Overloaded).
+    """
+
+    def __init__(self, handler, name="DNS", stats=None, guard=None):
+        self.handler = handler
+        self.name = name
+        self.guard = guard
+        self.is_async = inspect.iscoroutinefunction(handler)
+        self.transport = None
+        self.tasks = set()
+        # Any mapping works here, e.g. a worker's slice of shared counters
+        self.stats = stats if stats is not None else {"queries": 0, "responses": 0, "errors": 0}
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def datagram_received(self, data, addr):
+        self.stats["queries"] += 1
+        start = time.perf_counter()
+        if self.guard is not None:
+            reply = self.guard.admit(data, addr)
+            if reply is not None:
+                self.send(reply, addr)
+                capture.record(data, addr, reply, start)
+                return
+
+        if self.is_async:
+            task = asyncio.ensure_future(self.handle_async(data, addr, start))
+            self.tasks.add(task)
+            task.add_done_callback(self.tasks.discard)
+            return
+
+        try:
+            response = self.handler(data, addr)
+        except Exception as e:
+            self.stats["errors"] += 1
+            log.error("handler_error", server=self.name, client=addr, error=repr(e))
+            capture.record(data, addr, None, start)
+            return
+        self.send(response, addr)
+        record_query(self.name, data, response, time.perf_counter() - start)
+        capture.record(data, addr, response, start)
+
+    async def handle_async(self, data, addr, start):
+        guard = self.guard
+        try:
+            if guard is not None and guard.late(start):
+                response = guard.shed(data)
+            else:
+                response = await self.handler(data, addr)
+        except Overloaded:
+            response = guard.shed(data) if guard is not None else None
+        except Exception as e:
+            self.stats["errors"] += 1
+            log.error("handler_error", server=self.name, client=addr, error=repr(e))
+            capture.record(data, addr, None, start)
+            return
+        self.send(response, addr)
+        record_query(self.name, data, response, time.perf_counter() - start)
+        capture.record(data, addr, response, start)
+
+    def send(self, response, addr):
+        if not response or self.transport is None:
+            return
+        self.transport.sendto(response, addr)
+        self.stats["responses"] += 1
+
+    def error_received(self, exc):
+        log.warning("socket_error", server=self.name, error=repr(exc))
+
+class BatchedDNSServer(DNSServerProtocol):
+    """Serve a raw socket in batches: drain up to batch datagrams per wakeup
+
+    Synchronous handlers answer the whole batch before the replies are
+    flushed together (one sendmmsg on Linux); coroutine handlers still
+    run as tasks and send their own replies.
+    """
+
+    def __init__(self, handler, sock, batch, name="DNS", stats=None, guard=None):
+        super().__init__(handler, name, stats, guard)
+        self.io = batch_socket(sock, batch)
+        # send() and handle_async() write through io.sendto()
+        self.transport = self.io
+
+    def read_ready(self):
+        packets = self.io.recv()
+        if not packets:
+            return
+        self.stats["queries"] += len(packets)
+        start = time.perf_counter()
+        guard = self.guard
+        if guard is not None:
+            admitted = []
+            for data, addr in packets:
+                reply = guard.admit(data, addr)
+                if reply is None:
+                    admitted.append((data, addr))
+                    continue
+                if reply:
+                    self.send(reply, addr)
+                capture.record(data, addr, reply, start)
+            packets = admitted
+
+        if self.is_async:
+            for data, addr in packets:
+                task = asyncio.ensure_future(self.handle_async(data, addr, start))
+                self.tasks.add(task)
+                task.add_done_callback(self.tasks.discard)
+            return
+
+        replies = []
+        answered = []
+        for data, addr in packets:
+            try:
+                if guard is not None and guard.late(start):
+                    # Stuck behind the rest of the batch for too long
+                    response = guard.shed(data) or None
+                else:
+                    response = self.handler(data, addr)
+            except Exception as e:
+                self.stats["errors"] += 1
+                log.error("handler_error", server=self.name, client=addr, error=repr(e))
+                capture.record(data, addr, None, start)
+                continue
+            if response is not None:
+                replies.append((response, addr))
+            answered.append((data, addr, response))
+        if replies:
+            self.stats["responses"] += self.io.send(replies)
+
+        # Every query in the batch waited for the whole batch
+        elapsed = time.perf_counter() - start
+        for data, addr, response in answered:
+            record_query(self.name, data, response, elapsed)
+            capture.record(data, addr, response, start)
+
+async def run_until_cancelled(startup=None):
+    """Wait forever, running startup() (if any) alongside once the socket is bound"""
+    task = asyncio.create_task(startup()) if startup is not None else None
+    try:
+        await asyncio.Event().wait()
+    finally:
+        if task is not None:
+            task.cancel()
+
+async def serve_batched(handler, host, port, batch, name="DNS", reuse_port=False, stats=None, guard=None, startup=None):
+    """Serve handler on host:port with batched receives and sends until cancelled"""
+    loop = asyncio.get_running_loop()
+    family = socket.AF_INET6 if ":" in host else socket.AF_INET
+    sock = socket.socket(family, socket.SOCK_DGRAM)
+    if reuse_port:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+    sock.bind((host, port))
+    server = BatchedDNSServer(handler, sock, batch, name, stats, guard)
+    loop.add_reader(sock.fileno(), server.read_ready)
+    try:
+        await run_until_cancelled(startup)
+    finally:
+        loop.remove_reader(sock.fileno())
+        sock.close()
+
+async def serve(handler, host, port, name="DNS", reuse_port=False, stats=None, batch=0, guard=None, startup=None):
+    """Bind a UDP endpoint for handler and serve until cancelled
+
+    With batch > 1, datagrams are received and answered batch at a time
+    (see BatchedDNSServer) instead of one per event loop callback.
+    startup, a coroutine function, runs as a task once the socket is
+    bound, so slow startup work doesn't hold up answering.
+    """
+    if batch > 1:
+        return await serve_batched(handler, host, port, batch, name, reuse_port, stats, guard, startup)
+    loop = asyncio.get_running_loop()
+    transport, protocol = await loop.create_datagram_endpoint(
+        lambda: DNSServerProtocol(handler, name, stats, guard),
+        local_addr=(host, port),
+        reuse_port=reuse_port or None,
+    )
+    try:
+        await run_until_cancelled(startup)
+    finally:
+        transport.close()
+
+def run_udp_server(handler, host, port, name="DNS", reuse_port=False, stats=None, batch=0, guard=None, startup=None):
+    """Run handler on host:port in a fresh event loop (blocks forever)"""
+    try:
+        asyncio.run(serve(handler, host, port, name, reuse_port, stats, batch, guard, startup))
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,248 @@
+import errno
+import random
+import socket
+import asyncio
+from dnslib import DNSRecord, RCODE
+from core.wire import read_question, qtype_name
+from core.tracing import annotate
+
+# IDs and source ports must be unpredictable to resist spoofed answers
+_random = random.SystemRandom()
+
+class UpstreamSocket(asyncio.DatagramProtocol):
+    """One long-lived UDP socket shared by many in-flight queries
+
+    Replies are matched to queries by (ID, qname, qtype, qclass), so any
+    number of queries can be outstanding on the socket at once.
+    """
+
+    def __init__(self):
+        self.transport = None
+        self.pending = {}
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def datagram_received(self, data, addr):
+        question = read_question(data)
+        if question is None:
+            return
+        qname, qtype, qclass, _ = question
+        key = (data[0] << 8 | data[1], qname, qtype, qclass)
+        future = self.pending.pop(key, None)
+        if future is not None and not future.done():
+            future.set_result(data)
+
+    def error_received(self, exc):
+        # On a connected socket this is usually ICMP port unreachable,
+        # and it can't be tied to one query: fail everything waiting so
+        # UpstreamTransport.query() retries each of them like a timeout
+        for future in self.pending.values():
+            if not future.done():
+                future.set_exception(exc)
+        self.pending.clear()
+
+    def connection_lost(self, exc):
+        self.error_received(exc or ConnectionError("upstream socket closed"))
+
+    def send(self, request, key):
+        """Send a packed query and return the future for its reply"""
+        future = asyncio.get_running_loop().create_future()
+        self.pending[key] = future
+        self.transport.sendto(request)
+        return future
+
+    def forget(self, key):
+        self.pending.pop(key, None)
+
+class UpstreamPool:
+    """A few long-lived sockets, on random source ports, to one upstream"""
+
+    def __init__(self, host, port, size=4):
+        self.host = host
+        self.port = port
+        self.size = size
+        self.sockets = []
+        self.lock = asyncio.Lock()
+
+    async def _open(self):
+        loop = asyncio.get_running_loop()
+        family = socket.AF_INET6 if ":" in self.host else socket.AF_INET
+        sock = socket.socket(family, socket.SOCK_DGRAM)
+        sock.setblocking(False)
+        for _ in range(16):
+            try:
+                sock.bind(("", _random.randint(1024, 65535)))
+                break
+            except OSError as e:
+                if e.errno != errno.EADDRINUSE:
+                    sock.close()
+                    raise
+        else:
+            sock.bind(("", 0))
+        sock.connect((self.host, self.port))
+        _, protocol = await loop.create_datagram_endpoint(UpstreamSocket, sock=sock)
+        return protocol
+
+    async def socket(self):
+        """Pick a pooled socket, opening more until the pool is full"""
+        if any(s.transport.is_closing() for s in self.sockets):
+            self.sockets = [s for s in self.sockets if not s.transport.is_closing()]
+        if len(self.sockets) < self.size:
+            async with self.lock:
+                if len(self.sockets) < self.size:
+                    upstream = await self._open()
+                    self.sockets.append(upstream)
+        return _random.choice(self.sockets)
+
+    def close(self):
+        for upstream in self.sockets:
+            if upstream.transport:
+                upstream.transport.close()
+        self.sockets = []
+
+class UpstreamTransport:
+    """Pooled, multiplexed UDP queries to any number of upstream servers"""
+
+    def __init__(self, pool_size=4, timeout=2, retries=2):
+        self.pool_size = pool_size
+        self.timeout = timeout
+        self.retries = retries
+        self.pools = {}
+        self.loop = None
+
+        # Counters
+        self.queries = 0
+        self.retransmits = 0
+        self.timeouts = 0
+        self.errors = 0
+
+    def pool(self, host, port):
+        loop = asyncio.get_running_loop()
+        if loop is not self.loop:
+            # Sockets belong to the loop that created them
+            self.pools = {}
+            self.loop = loop
+        pool = self.pools.get((host, port))
+        if pool is None:
+            pool = self.pools[(host, port)] = UpstreamPool(host, port, self.pool_size)
+        return pool
+
+    async def query(self, host, port, request, timeout=None, retries=None):
+        """Send a DNSRecord upstream and await the parsed reply
+
+        Each attempt waits timeout seconds and uses a fresh ID and a
+        (possibly) different pooled socket; a socket error (ICMP
+        unreachable) is retried like a timeout. Once every attempt has
+        failed, raises the last socket error, or asyncio.TimeoutError.
+        """
+        timeout = self.timeout if timeout is None else timeout
+        retries = self.retries if retries is None else retries
+        pool = self.pool(host, port)
+        q = request.q
+        qname = str(q.qname).lower()
+        self.queries += 1
+
+        error = None
+        for attempt in range(retries + 1):
+            if attempt:
+                self.retransmits += 1
+                annotate(retries=attempt)
+            upstream = await pool.socket()
+
+            qid = _random.getrandbits(16)
+            key = (qid, qname, q.qtype, q.qclass)
+            while key in upstream.pending:
+                qid = _random.getrandbits(16)
+                key = (qid, qname, q.qtype, q.qclass)
+
+            request.header.id = qid
+            future = upstream.send(request.pack(), key)
+            try:
+                data = await asyncio.wait_for(future, timeout)
+            except asyncio.TimeoutError:
+                upstream.forget(key)
+                error = None
+                continue
+            except OSError as e:
+                upstream.forget(key)
+                self.errors += 1
+                error = e
+                continue
+            return DNSRecord.parse(data)
+
+        if error is not None:
+            raise error
+        self.timeouts += 1
+        raise asyncio.TimeoutError(f"no reply from {host}:{port} after {retries + 1} attempts")
+
+    def stats(self):
+        """Return transport counters"""
+        return {
+            "queries": self.queries,
+            "retransmits": self.retransmits,
+            "timeouts": self.timeouts,
+            "errors": self.errors,
+            "sockets": sum(len(pool.sockets) for pool in self.pools.values()),
+        }
+
+class InProcessTransport:
+    """Answers upstream queries by calling resolver functions directly: no sockets
+
+    servers maps (host, port) to resolve(request) returning a reply
+    DNSRecord, or None for NXDOMAIN; default answers for any other
+    address (None: the query fails like an unreachable server). The
+    request is never packed and the reply never parsed.
+    """
+
+    def __init__(self, servers=None, default=None):
+        self.servers = dict(servers or {})
+        self.default = default
+
+        # Counters
+        self.queries = 0
+        self.failures = 0
+
+    async def query(self, host, port, request, timeout=None, retries=None):
+        """Same as UpstreamTransport.query(), answered in-process"""
+        self.queries += 1
+        resolve = self.servers.get((host, port), self.default)
+        if resolve is None:
+            self.failures += 1
+            raise ConnectionRefusedError(f"no in-process server for {host}:{port}")
+        reply = resolve(request)
+        if reply is None:
+            reply = request.reply()
+            reply.header.rcode = RCODE.NXDOMAIN
+        reply.header.id = request.header.id
+        return reply
+
+    def stats(self):
+        """Return transport counters"""
+        return {
+            "queries": self.queries,
+            "failures": self.failures,
+        }
+
+def question(request):
+    """(qname, qtype name) of a request, as the simulators' resolve functions take them"""
+    return str(request.q.qname).lower(), qtype_name(request.q.qtype)
+
+def parse_address(text, default_port=53):
+    """(host, port) from "host", "host:port" or "[v6]:port" """
+    if text.startswith("["):
+        host, _, port = text[1:].partition("]")
+        port = port.lstrip(":")
+    elif text.count(":") == 1:
+        host, port = text.split(":")
+    else:
+        host, port = text, ""
+    return host, int(port) if port else default_port
+
+
+# Shared by every resolver in the process
+transport = UpstreamTransport()
+
+async def query(server_ip, port, request, timeout=None, retries=None):
+    """Send a DNSRecord to server_ip:port over the shared pooled transport"""
+    return await transport.query(server_ip, port, request, timeout, retries)
@@ -0,0 +1,152 @@
+import struct
+from collections import namedtuple
+from dnslib import DNSRecord, DNSHeader, QTYPE
+
+# id/flags/qtype/qclass come straight from the header and question;
+# qname is the canonical lowercase key ("myapp.local.") used by the zone
+# index; question_end is the offset just past the question section;
+# record is the full DNSRecord when dnslib had to parse the message
+WireQuery = namedtuple("WireQuery", "id flags qname qtype qclass question_end record")
+
+# QR, AA and RA set on every authoritative reply (the rest of the flags are echoed)
+AA_FLAG = 0x0400
+REPLY_FLAGS = 0x8000 | AA_FLAG | 0x0080
+
+_HEADER = struct.Struct("!HHHHHH")
+_TYPE_CLASS = struct.Struct("!HH")
+_QTYPE_NAMES = dict(QTYPE.forward)
+
+def qtype_name(qtype):
+    """Name of a numeric qtype ("A", "MX", ...) without a Bimap lookup"""
+    name = _QTYPE_NAMES.get(qtype)
+    if name is None:
+        name = _QTYPE_NAMES[qtype] = f"TYPE{qtype}"
+    return name
+
+def parse_query(data):
+    """Decode the header and single question of a plain query
+
+    Returns a WireQuery, or None for anything that needs the full dnslib
+    parser: responses, non-QUERY opcodes, several questions, compressed or
+    escaped names, EDNS options or other records after the question.
+    """
+    if len(data) < 17:
+        return None
+    qid, flags, qdcount, ancount, nscount, arcount = _HEADER.unpack_from(data)
+    if qdcount != 1 or ancount or nscount or arcount > 1 or flags & 0xF800:
+        return None
+
+    question = read_question(data)
+    if question is None:
+        return None
+    qname, qtype, qclass, question_end = question
+
+    if arcount and not _is_bare_opt(data, question_end):
+        return None
+
+    return WireQuery(qid, flags, qname, qtype, qclass, question_end, None)
+
+def read_question(data):
+    """Decode the first question of any message (query or response)
+
+    Returns (qname, qtype, qclass, question_end) with a lowercase qname,
+    or None if the name is compressed, escaped or truncated.
+    """
+    end = len(data)
+    if end < 17:
+        return None
+    labels = []
+    offset = 12
+    length = data[offset]
+    while length:
+        # Compression pointers never appear in a lone question
+        if length > 63:
+            return None
+        start = offset + 1
+        offset = start + length
+        if offset >= end:
+            return None
+        labels.append(data[start:offset])
+        length = data[offset]
+    offset += 1
+    question_end = offset + 4
+    if question_end > end:
+        return None
+
+    if labels:
+        name = b".".join(labels)
+        # Leave escaping of odd labels ("a.b", "\\", non-ASCII) to dnslib
+        if not name.isascii() or b"\\" in name or name.count(b".") != len(labels) - 1:
+            return None
+        qname = name.lower().decode("ascii") + "."
+    else:
+        qname = "."
+
+    qtype, qclass = _TYPE_CLASS.unpack_from(data, question_end - 4)
+    return qname, qtype, qclass, question_end
+
+def _is_bare_opt(data, offset):
+    """True if the only additional record is an EDNS OPT without options"""
+    # Root owner name (1) + type/class/ttl/rdlength (10)
+    if len(data) != offset + 11 or data[offset] != 0:
+        return False
+    rtype = data[offset + 1] << 8 | data[offset + 2]
+    rdlength = data[offset + 9] << 8 | data[offset + 10]
+    return rtype == QTYPE.OPT and rdlength == 0
+
+def decode_query(data):
+    """Decode a query, falling back to DNSRecord.parse when needed"""
+    query = parse_query(data)
+    if query is not None:
+        return query
+
+    request = DNSRecord.parse(data)
+    q = request.q
+    return WireQuery(request.header.id, request.header.bitmap, str(q.qname).lower(),
+                     q.qtype, q.qclass, None, request)
+
+def plain_query(record):
+    """Re-encode a parsed request's first question as a bare query"""
+    header = DNSHeader(id=record.header.id, bitmap=record.header.bitmap, q=1)
+    return DNSRecord(header, q=record.q).pack()
+
+def empty_reply(data, query, rcode=0, authoritative=False):
+    """Reply with no records (NOERROR/NXDOMAIN/...) echoing the question
+
+    AA is only set for a server answering from its own zones.
+    """
+    if query.record is not None:
+        reply = query.record.reply(aa=int(authoritative))
+        reply.header.rcode = rcode
+        return reply.pack()
+
+    flags = (query.flags | REPLY_FLAGS) & ~0x000F | rcode
+    if not authoritative:
+        flags &= ~AA_FLAG
+    return data[:2] + struct.pack("!HHHHH", flags, 1, 0, 0, 0) + data[12:query.question_end]
+
+def truncated_reply(data):
+    """Empty TC=1 reply telling the client to retry over TCP, or None if data isn't a plain query
+
+    Only skips over the question name, so it stays cheap enough to send
+    to a client that is being rate limited.
+    """
+    end = len(data)
+    if end < 17 or data[4:6] != b"\x00\x01" or data[2] & 0x80:
+        return None
+    offset = 12
+    length = data[offset]
+    while length:
+        if length > 63:
+            return None
+        offset += length + 1
+        if offset >= end:
+            return None
+        length = data[offset]
+    question_end = offset + 5
+    if question_end > end:
+        return None
+    flags, = struct.unpack_from("!H", data, 2)
+    # QR and TC; opcode and RD echoed
+    flags = 0x8000 | 0x0200 | (flags & 0x7900)
+    return data[:2] + struct.pack("!HHHHH", flags, 1, 0, 0, 0) + data[12:question_end]
@@ -0,0 +1,126 @@
+import gc
+import os
+import signal
+import time
+import traceback
+import multiprocessing
+
+STAT_FIELDS = ("queries", "responses", "errors")
+
+class WorkerStats:
+    """A worker's slice of the shared counter array, indexed by field name"""
+
+    def __init__(self, counters, slot, fields=STAT_FIELDS):
+        self.counters = counters
+        self.base = slot * len(fields)
+        self.index = {field: i for i, field in enumerate(fields)}
+
+    def __getitem__(self, field):
+        return self.counters[self.base + self.index[field]]
+
+    def __setitem__(self, field, value):
+        self.counters[self.base + self.index[field]] = value
+
+def aggregate(counters, count, fields=STAT_FIELDS):
+    """Sum every worker's counters into one dict"""
+    totals = dict.fromkeys(fields, 0)
+    for slot in range(count):
+        base = slot * len(fields)
+        for i, field in enumerate(fields):
+            totals[field] += counters[base + i]
+    return totals
+
+def run_workers(worker_main, count, name="worker", fields=STAT_FIELDS, stats_interval=10):
+    """Fork count workers running worker_main(slot, stats) and supervise them
+
+    Anything loaded before calling this (zones, compiled indexes) is shared
+    copy-on-write with every worker. Crashed workers are restarted into
+    the same slot, so their counters keep accumulating.
+    """
+    # Counters live in shared memory so the supervisor can read them
+    counters = multiprocessing.Array("Q", count * len(fields), lock=False)
+    children = {}
+    stopping = False
+
+    def spawn(slot):
+        pid = os.fork()
+        if pid == 0:
+            # The older workers' pids are the supervisor's business
+            children.clear()
+            signal.signal(signal.SIGINT, signal.SIG_DFL)
+            signal.signal(signal.SIGTERM, signal.SIG_DFL)
+            signal.signal(signal.SIGUSR1, on_usr1)
+            # Ignored unless the worker starts a zone reloader, which hooks it
+            signal.signal(signal.SIGHUP, signal.SIG_IGN)
+            code = 0
+            try:
+                worker_main(slot, WorkerStats(counters, slot, fields))
+            except BaseException:
+                traceback.print_exc()
+                code = 1
+            os._exit(code)
+        children[pid] = (slot, time.monotonic())
+
+    def stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+
+    def forward(signum, frame):
+        for pid in children:
+            os.kill(pid, signum)
+
+    # Workers keep what SIGUSR1 did before we took it over (start a profile)
+    on_usr1 = signal.getsignal(signal.SIGUSR1)
+    signal.signal(signal.SIGINT, stop)
+    signal.signal(signal.SIGTERM, stop)
+    # SIGHUP (zone reload) and SIGUSR1 are meant for the workers
+    signal.signal(signal.SIGHUP, forward)
+    signal.signal(signal.SIGUSR1, forward)
+
+    # Keep the long-lived objects loaded so far out of the GC's reach so
+    # collections in the workers don't dirty (and un-share) their pages
+    gc.collect()
+    gc.freeze()
+
+    for slot in range(count):
+        spawn(slot)
+    print(f"👷 Started {count} {name} workers")
+
+    last_report = time.monotonic()
+    while not stopping:
+        time.sleep(0.5)
+
+        while True:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                pid = 0
+            if pid == 0:
+                break
+
+            slot, started = children.pop(pid)
+            if stopping:
+                continue
+            code = os.waitstatus_to_exitcode(status)
+            print(f"💥 {name} worker {slot} (pid {pid}) exited with code {code}, restarting")
+            # Back off a little if the worker is crash-looping
+            if time.monotonic() - started < 1:
+                time.sleep(1)
+            spawn(slot)
+
+        now = time.monotonic()
+        if stats_interval and now - last_report >= stats_interval:
+            last_report = now
+            print(f"📊 {name} stats ({len(children)} workers): {aggregate(counters, count, fields)}")
+
+    for pid in children:
+        try:
+            os.kill(pid, signal.SIGTERM)
+        except ProcessLookupError:
+            pass
+    for pid in list(children):
+        try:
+            os.waitpid(pid, 0)
+        except ChildProcessError:
+            pass
+    print(f"🛑 {name} workers stopped: {aggregate(counters, count, fields)}")
@@ -2,30 +2,98 @@ import sys
 import os
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '.')))
 
-import socket
-from dnslib import DNSRecord, QTYPE, RR, A, CNAME, NS
+import time
+import asyncio
+import argparse
+from dnslib import DNSRecord, QTYPE, RR, A, CNAME, NS, RCODE
 from zone.zone_loader import load_zones
+from zone.reloader import ZoneReloader, changed_names
+from zone.rotation import AddressRotator, MODES, set_mode
+from core.cache import DNSCache, cache_key
+from core.delegation import DelegationCache, Delegation
+from core.nameservers import ServerSelector
+from core.singleflight import SingleFlight
+from core.prefetch import Prefetcher
+from core.ratelimit import Admission, add_overload_arguments, overload_guard
+from core.udp_server import run_udp_server
+from core.workers import run_workers
+from core.shm_cache import SharedCache
+from core.snapshot import CacheSnapshot
+from core.wire import decode_query, empty_reply, qtype_name
+from core.capture import add_capture_arguments, configure_capture
+from core.profiler import add_profile_arguments, configure_profiler
+from core.tracing import tracer, span, annotate, add_trace_arguments, configure_tracing
+from core.querylog import log, add_log_arguments, configure_log, DEBUG
+from core.metrics import registry, stage, add_metrics_arguments, start_metrics
+from core import upstream
 
 # Load our authoritative zones
-zones = load_zones()
+ZONE_FILE = "zone/zones.json"
+zones = load_zones(ZONE_FILE)
 
-def query_dns_server(server_ip, port, query, timeout=5):
-    """Query a specific DNS server"""
+# Order in which local names with several addresses list them
+rotator = AddressRotator()
+
+# Answer cache shared by all queries (resized from the command line)
+cache = DNSCache()
+
+# Zone cut -> nameservers learned from referrals
+delegations = DelegationCache()
+
+# Smoothed RTT per authoritative server, used to pick the fastest
+selector = ServerSelector()
+
+# Race the two fastest authoritative servers (--race)
+RACE_SERVERS = False
+
+# Identical lookups in flight share one walk of the hierarchy
+inflight = SingleFlight()
+
+# Hot and expired cache entries are refreshed in the background
+prefetcher = Prefetcher(cache, inflight)
+
+# Caps the lookups in flight (--max-recursions); cached answers skip it
+admission = Admission()
+
+# Exposed on the metrics endpoint
+registry.collect("dns_cache", cache.stats, server="enhanced")
+registry.collect("dns_delegations", delegations.stats, server="enhanced")
+registry.collect("dns_singleflight", inflight.stats, server="enhanced")
+registry.collect("dns_prefetch", prefetcher.stats, server="enhanced")
+registry.collect("dns_admission", admission.stats, server="enhanced")
+registry.collect("dns_upstream", lambda: TRANSPORT.stats(), server="enhanced")
+registry.collect("dns_tracing", tracer.stats, server="enhanced")
+registry.collect_each("dns_nameserver", lambda: selector.stats(), "nameserver", server="enhanced")
+
+# Our simulated hierarchy (--root-server, --tld-server)
+ROOT_SERVER = ("127.0.0.1", 8055)
+TLD_SERVER = ("127.0.0.1", 8056)
+
+# Authoritative queries go to these instead of to the referral's glue
+# addresses on port 53 (--auth-server, repeatable), e.g. authoritative
+# servers started with --zone-file HIERARCHY_ZONE_FILE
+AUTH_SERVERS = []
+
+# The zones of the domains the TLD server delegates (google.com., ...)
+HIERARCHY_ZONE_FILE = "zone/hierarchy.json"
+
+# How queries reach those servers: pooled UDP sockets, or direct calls
+# into the simulators with --transport inprocess
+TRANSPORT = upstream.transport
+
+def apply_zone_update(new_zones, diff):
+    """Swap in reloaded zones and drop cached answers for changed names (on the event loop)"""
+    global zones
+    zones = new_zones
+    cache.invalidate(changed_names(diff))
+
+async def query_dns_server(server_ip, port, query, timeout=None, retries=None):
+    """Query a specific DNS server (pooled sockets, retried on timeout)"""
     try:
-        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-        sock.settimeout(timeout)
-        
-        # Send query
-        sock.sendto(query.pack(), (server_ip, port))
-        
-        # Receive response
-        data, addr = sock.recvfrom(512)
-        response = DNSRecord.parse(data)
-        
-        sock.close()
-        return response
+        return await TRANSPORT.query(server_ip, port, query, timeout=timeout, retries=retries)
     except Exception as e:
-        print(f"Error querying {server_ip}:{port}: {e}")
+        log.warning("upstream_error", server=f"{server_ip}:{port}", qname=str(query.q.qname), error=repr(e))
+        annotate(error=repr(e))
         return None
 
 def resolve_authoritative(domain, qtype):
@@ -37,121 +105,393 @@ def resolve_authoritative(domain, qtype):
     
     # Handle A records
     if qtype == "A" and "A" in zone:
-        ip = zone["A"]
         ttl = zone.get("TTL", 300)
         reply = DNSRecord.question(domain, "A").reply()
-        reply.add_answer(RR(domain, QTYPE.A, rdata=A(ip), ttl=ttl))
+        for ip in rotator.order(domain, "A", zone):
+            reply.add_answer(RR(domain, QTYPE.A, rdata=A(ip), ttl=ttl))
         return reply
     
     return None
 
-def enhanced_recursive_resolve(domain, qtype):
+async def enhanced_recursive_resolve(domain, qtype):
     """Enhanced recursive resolution using our simulated DNS hierarchy"""
-    print(f"🔍 Enhanced recursive resolve: {domain} ({qtype})")
-    
     # Step 1: Check if we have authoritative data
+    start = time.perf_counter()
     auth_response = resolve_authoritative(domain, qtype)
+    stage("enhanced", "authoritative", start)
     if auth_response:
-        print("✅ Authoritative response")
+        log.debug("authoritative", qname=domain, qtype=qtype)
         return auth_response
     
-    # Step 2: Query root servers for TLD delegation
-    print("📍 Step 1: Querying root servers for TLD delegation...")
-    tld = domain.split('.')[-1] + "."
-    root_query = DNSRecord.question(tld, "NS")
-    
-    root_response = query_dns_server("127.0.0.1", 8055, root_query)
-    if not root_response or not root_response.rr:
-        print("❌ No response from root servers")
+    # Step 1b: Serve from cache if we resolved this recently; otherwise
+    # walk the hierarchy (once for all identical queries) and cache it
+    start = time.perf_counter()
+    with span("resolve") as resolve_span:
+        response, state = await prefetcher.resolve(cache_key(domain, qtype), admission.run, walk_hierarchy, domain, qtype)
+        resolve_span.set(cache=state or "miss")
+    stage("enhanced", "cache" if state else "recursion", start)
+    if state:
+        log.debug("cache_hit", qname=domain, qtype=qtype, state=state)
+    return response
+
+def record_delegation(response, servers=None):
+    """Cache the zone cut announced by the NS records in a referral
+
+    Glue A records in the additional section become the cut's server
+    addresses unless servers is given (the simulated TLD servers all
+    live on one local port). Returns the Delegation, or None.
+    """
+    ns_records = [rr for rr in response.rr + response.auth if rr.rtype == QTYPE.NS]
+    if not ns_records:
         return None
+
+    zone = str(ns_records[0].rname)
+    nameservers = [str(rr.rdata) for rr in ns_records]
+    ttl = min(rr.ttl for rr in ns_records)
+    if servers is None:
+        glue = [rr for rr in response.ar if rr.rtype == QTYPE.A and str(rr.rname) in nameservers]
+        servers = auth_addresses(glue)
+        ttl = min([ttl] + [rr.ttl for rr in glue])
+    return delegations.add(zone, nameservers, servers, ttl)
+
+def address(server):
+    """Format an (ip, port) pair as ip:port"""
+    return f"{server[0]}:{server[1]}"
+
+def auth_addresses(glue):
+    """Where to send a zone's queries, given its nameservers' A records
+
+    With AUTH_SERVERS, nameserver N is reached at AUTH_SERVERS[N % count],
+    so a zone with several nameservers still has several servers to
+    choose between.
+    """
+    if AUTH_SERVERS:
+        return list(dict.fromkeys(AUTH_SERVERS[i % len(AUTH_SERVERS)] for i in range(len(glue))))
+    return [(str(rr.rdata), 53) for rr in glue]
+
+def inprocess_transport():
+    """A transport that calls the root, TLD and authoritative resolvers directly
+
+    Root and TLD queries go to resolve_root_query()/resolve_tld_query(),
+    anything else to the authoritative server's build_reply() over the
+    delegated domains' zones (HIERARCHY_ZONE_FILE). The simulators are
+    imported here since they load their zones on import.
+    """
+    import root_server
+    import tld_server
+    from server import dns_server
+    hierarchy = load_zones(HIERARCHY_ZONE_FILE)
+
+    def authoritative(request):
+        if str(request.q.qname).lower() not in hierarchy:
+            return None
+        return dns_server.build_reply(request, hierarchy)
+
+    return upstream.InProcessTransport({
+        ROOT_SERVER: lambda request: root_server.resolve_root_query(*upstream.question(request)),
+        TLD_SERVER: lambda request: tld_server.resolve_tld_query(*upstream.question(request)),
+    }, default=authoritative)
+
+def negative_reply(domain, qtype, response):
+    """Turn an NXDOMAIN from a server into our (cacheable) answer"""
+    reply = DNSRecord.question(domain, qtype).reply()
+    reply.header.rcode = RCODE.NXDOMAIN
+    for rr in response.auth:
+        reply.add_auth(rr)
+    return reply
+
+async def find_tld_servers(domain, qtype):
+    """Ask the root servers who serves the TLD of domain
+
+    The root refers us to the zone cut above domain, whatever its depth.
+    Returns a Delegation, a negative reply, or None.
+    """
+    log.debug("root_referral", qname=domain)
+    root_query = DNSRecord.question(domain, "NS")
     
-    print(f"✅ Got TLD delegation from root servers")
+    root_response = await query_dns_server(*ROOT_SERVER, root_query)
+    if root_response and root_response.header.rcode == RCODE.NXDOMAIN:
+        log.debug("root_nxdomain", qname=domain)
+        return negative_reply(domain, qtype, root_response)
+    if not root_response or not (root_response.rr or root_response.auth):
+        log.debug("root_referral_failed", qname=domain)
+        return None
     
-    # Step 3: Query TLD servers for domain delegation
-    print("📍 Step 2: Querying TLD servers for domain delegation...")
+    return record_delegation(root_response, [TLD_SERVER])
+
+async def find_auth_servers(domain, qtype, tld_delegation):
+    """Ask the TLD servers who is authoritative for domain
+
+    Returns a Delegation, a negative reply to hand back to the client, or
+    None when the TLD servers can't help.
+    """
+    log.debug("tld_referral", qname=domain, zone=tld_delegation.zone)
     tld_query = DNSRecord.question(domain, "NS")
     
-    tld_response = query_dns_server("127.0.0.1", 8056, tld_query)
-    if not tld_response or not tld_response.rr:
-        print("❌ No response from TLD servers")
+    tld_response = await query_dns_server(*tld_delegation.servers[0], tld_query)
+    if tld_response and tld_response.header.rcode == RCODE.NXDOMAIN:
+        # The TLD says the name does not exist; cacheable as a negative answer
+        log.debug("tld_nxdomain", qname=domain)
+        return negative_reply(domain, qtype, tld_response)
+    if not tld_response or not (tld_response.rr or tld_response.auth):
+        log.debug("tld_referral_failed", qname=domain)
         return None
     
-    print(f"✅ Got domain delegation from TLD servers")
+    # Glue in the referral saves the address lookups below
+    delegation = record_delegation(tld_response)
+    if delegation:
+        return delegation
     
-    # Step 4: Query authoritative servers for final answer
-    print("📍 Step 3: Querying authoritative servers for final answer...")
-    
-    # Extract authoritative server from TLD response
+    # Extract authoritative server from TLD response (an answer for the
+    # domain itself, or a referral to the cut above it)
+    ns_records = [rr for rr in tld_response.rr + tld_response.auth if rr.rtype == QTYPE.NS]
     auth_servers = []
-    for rr in tld_response.rr:
-        if rr.rtype == QTYPE.NS:
-            auth_server = str(rr.rdata)
-            auth_servers.append(auth_server)
-            print(f"  🔍 Found authoritative server: {auth_server}")
+    for rr in ns_records:
+        auth_server = str(rr.rdata)
+        auth_servers.append(auth_server)
     
     if not auth_servers:
-        print("❌ No authoritative servers found")
+        log.debug("no_nameservers", qname=domain)
         return None
     
-    # Query the first authoritative server
-    auth_server = auth_servers[0]
-    print(f"  🔍 Querying authoritative server: {auth_server}")
-    
-    # Get A record for authoritative server first
-    auth_a_query = DNSRecord.question(auth_server, "A")
-    auth_a_response = query_dns_server("127.0.0.1", 8056, auth_a_query)
-    
-    if auth_a_response and auth_a_response.rr:
-        for rr in auth_a_response.rr:
-            if rr.rtype == QTYPE.A:
-                auth_ip = str(rr.rdata)
-                print(f"  ✅ Authoritative server {auth_server} -> {auth_ip}")
-                
-                # Now query the authoritative server for the domain
-                final_query = DNSRecord.question(domain, qtype)
-                final_response = query_dns_server(auth_ip, 53, final_query)
-                
-                if final_response:
-                    print(f"✅ Got final answer from authoritative server")
-                    return final_response
-    
-    print("❌ Could not get final answer")
+    # Get A records for the authoritative servers, in referral order
+    for auth_server in auth_servers:
+        auth_a_query = DNSRecord.question(auth_server, "A")
+        with span("ns_lookup", nameserver=auth_server, server=address(tld_delegation.servers[0])):
+            auth_a_response = await query_dns_server(*tld_delegation.servers[0], auth_a_query)
+        if not auth_a_response:
+            continue
+        # An answer, or a referral carrying the address as glue
+        glue = [rr for rr in auth_a_response.rr + auth_a_response.ar
+                if rr.rtype == QTYPE.A and str(rr.rname) == auth_server]
+        if glue:
+            log.debug("nameserver_address", nameserver=auth_server, addresses=[str(rr.rdata) for rr in glue])
+            zone = str(ns_records[0].rname)
+            ttl = min(rr.ttl for rr in ns_records + glue)
+            return delegations.add(zone, auth_servers, auth_addresses(glue), ttl)
+    
+    log.debug("no_nameserver_addresses", qname=domain, nameservers=auth_servers)
     return None
 
+async def walk_hierarchy(domain, qtype):
+    """Walk root -> TLD -> authoritative servers for domain
+
+    The walk starts at the deepest zone cut in the delegation cache, so
+    repeat lookups under a known domain go straight to its servers.
+    """
+    delegation = delegations.find(domain)
+    if delegation:
+        log.debug("delegation_hit", qname=domain, zone=delegation.zone)
+        annotate(start_zone=delegation.zone)
+    
+    # Step 2: Query root servers for TLD delegation
+    if delegation is None:
+        start = time.perf_counter()
+        with span("root_hop", server=address(ROOT_SERVER)) as hop:
+            delegation = await find_tld_servers(domain, qtype)
+            hop.set(zone=delegation.zone if isinstance(delegation, Delegation) else None)
+        stage("enhanced", "root_hop", start)
+        if not isinstance(delegation, Delegation):
+            return delegation
+    
+    # Step 3: Query TLD servers for domain delegation
+    if TLD_SERVER in delegation.servers:
+        start = time.perf_counter()
+        with span("tld_hop", server=address(delegation.servers[0]), zone=delegation.zone) as hop:
+            delegation = await find_auth_servers(domain, qtype, delegation)
+            hop.set(referral=delegation.zone if isinstance(delegation, Delegation) else None)
+        stage("enhanced", "tld_hop", start)
+        if not isinstance(delegation, Delegation):
+            return delegation
+    
+    # Step 4: Query authoritative servers for final answer
+    final_query = DNSRecord.question(domain, qtype)
+    start = time.perf_counter()
+    with span("auth_hop", zone=delegation.zone, servers=len(delegation.servers)):
+        final_response = await query_auth_servers(delegation, final_query)
+    stage("enhanced", "auth_hop", start)
+    if final_response:
+        return final_response
+    
+    log.debug("no_final_answer", qname=domain, zone=delegation.zone)
+    return None
+
+async def timed_query(server, query, retries):
+    """Query one server and feed the outcome into its smoothed RTT"""
+    start = time.monotonic()
+    try:
+        with span("auth_query", server=address(server)) as attempt:
+            response = await query_dns_server(*server, query, retries=retries)
+            attempt.set(answered=response is not None)
+    except asyncio.CancelledError:
+        selector.record_lower_bound(server, time.monotonic() - start)
+        raise
+    if response is None:
+        selector.record_failure(server)
+    else:
+        selector.record(server, time.monotonic() - start)
+    return response
+
+async def query_auth_servers(delegation, query):
+    """Ask a zone's servers, fastest first, until one answers
+
+    With several servers each gets a single attempt before we move on;
+    with RACE_SERVERS the two fastest are queried at once and the first
+    answer wins.
+    """
+    servers = selector.rank(delegation.servers)
+    retries = 0 if len(servers) > 1 else None
+    
+    if RACE_SERVERS and len(servers) > 1:
+        racers, servers = servers[:2], servers[2:]
+        log.debug("race", zone=delegation.zone, servers=[address(server) for server in racers])
+        annotate(race=True)
+        tasks = [asyncio.ensure_future(timed_query(server, query, retries)) for server in racers]
+        try:
+            for next_done in asyncio.as_completed(tasks):
+                response = await next_done
+                if response:
+                    return response
+        finally:
+            for task in tasks:
+                task.cancel()
+    
+    for server in servers:
+        log.debug("auth_query", zone=delegation.zone, server=address(server))
+        response = await timed_query(server, query, retries)
+        if response:
+            return response
+    return None
+
+async def handle_enhanced_query(data, addr):
+    """Answer one raw query datagram by walking the simulated hierarchy"""
+    start = time.perf_counter()
+    query = decode_query(data)
+    
+    qname = query.qname
+    qtype = qtype_name(query.qtype)
+    stage("enhanced", "parse", start)
+    trace = tracer.begin("enhanced", qname, qtype, addr)
+    
+    # Try enhanced recursive resolution
+    response = await enhanced_recursive_resolve(qname, qtype)
+    
+    start = time.perf_counter()
+    if response:
+        # Forward the response with correct ID
+        response.header.id = query.id
+        response = response.pack()
+    else:
+        # No response found
+        response = empty_reply(data, query, 3)  # NXDOMAIN
+    stage("enhanced", "pack", start)
+    tracer.end(trace, response)
+    
+    log.query("enhanced", qname, qtype, addr, response)
+    if log.level <= DEBUG:
+        log.debug("stats", cache=cache.stats(), delegations=delegations.stats(),
+                  inflight=inflight.stats(), prefetch=prefetcher.stats())
+    return response
+
 def run_enhanced_recursive_server():
     """Run the enhanced recursive DNS server"""
-    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-    sock.bind(("127.0.0.1", 8057))  # Port 8057 for enhanced recursive
+    global RACE_SERVERS, ROOT_SERVER, TLD_SERVER, AUTH_SERVERS, TRANSPORT
+    parser = argparse.ArgumentParser(description="Enhanced recursive DNS resolver")
+    parser.add_argument("--cache-size", type=int, default=10000, help="maximum number of cached answers")
+    parser.add_argument("--cache-memory", type=int, default=None, help="maximum cache size in bytes")
+    parser.add_argument("--reload-interval", type=float, default=2.0, help="seconds between zone file checks (0: SIGHUP only)")
+    parser.add_argument("--race", action="store_true", help="query the two fastest authoritative servers at once")
+    parser.add_argument("--max-waiters", type=int, default=1000, help="queries allowed to wait on one in-flight lookup")
+    parser.add_argument("--waiter-timeout", type=float, default=10, help="seconds a query waits on an in-flight lookup")
+    parser.add_argument("--prefetch-fraction", type=float, default=0.1, help="refresh hot answers with this share of their TTL left (0: off)")
+    parser.add_argument("--prefetch-hits", type=int, default=2, help="hits before an answer counts as hot")
+    parser.add_argument("--serve-stale", action="store_true", help="answer from expired cache entries while refreshing them")
+    parser.add_argument("--stale-ttl", type=int, default=30, help="TTL given to stale answers")
+    parser.add_argument("--max-stale", type=int, default=86400, help="seconds past expiry an answer may still be served")
+    parser.add_argument("--rotation", default="wrr", choices=MODES, help="order of multi-address answers: weighted round-robin, weighted shuffle or zone order")
+    parser.add_argument("--batch", type=int, default=0, help="datagrams received and answered per wakeup (0: one at a time)")
+    parser.add_argument("--workers", type=int, default=1, help="number of SO_REUSEPORT worker processes")
+    parser.add_argument("--stats-interval", type=int, default=10, help="seconds between aggregated worker stats")
+    parser.add_argument("--shared-cache", type=int, default=65536, help="slots in the answer cache shared by --workers (0: each worker caches alone)")
+    parser.add_argument("--snapshot", default=None, metavar="PATH", help="save the cache here periodically and on shutdown, and restore it on startup")
+    parser.add_argument("--snapshot-interval", type=float, default=300, help="seconds between cache snapshots (0: only on shutdown)")
+    parser.add_argument("--transport", default="udp", choices=("udp", "inprocess"), help="reach the hierarchy over UDP, or call the simulators in this process")
+    parser.add_argument("--root-server", default="127.0.0.1:8055", metavar="HOST:PORT", help="root server to start walks at")
+    parser.add_argument("--tld-server", default="127.0.0.1:8056", metavar="HOST:PORT", help="TLD server the root's referrals lead to")
+    parser.add_argument("--auth-server", action="append", default=[], metavar="HOST:PORT", help="send authoritative queries here instead of to glue addresses on port 53 (repeatable: a zone's nameservers are spread over them)")
+    add_overload_arguments(parser, recursion=True)
+    add_log_arguments(parser)
+    add_capture_arguments(parser)
+    add_profile_arguments(parser)
+    add_trace_arguments(parser)
+    add_metrics_arguments(parser)
+    args = parser.parse_args()
+    configure_log(args)
+    configure_capture(args)
+    configure_profiler(args, "enhanced")
+    configure_tracing(args)
+    set_mode(args.rotation)
+    cache.max_entries = args.cache_size
+    cache.max_bytes = args.cache_memory
+    cache.prefetch_fraction = args.prefetch_fraction
+    cache.prefetch_hits = args.prefetch_hits
+    cache.serve_stale = args.serve_stale
+    cache.stale_ttl = args.stale_ttl
+    cache.max_stale = args.max_stale
+    prefetcher.retry_interval = args.stale_ttl
+    inflight.max_waiters = args.max_waiters
+    inflight.timeout = args.waiter_timeout
+    RACE_SERVERS = args.race
+    ROOT_SERVER = upstream.parse_address(args.root_server)
+    TLD_SERVER = upstream.parse_address(args.tld_server)
+    AUTH_SERVERS = [upstream.parse_address(server) for server in args.auth_server]
+    if args.transport == "inprocess":
+        TRANSPORT = inprocess_transport()
+    admission.max_inflight = args.max_recursions
+    guard = overload_guard(args)
+    registry.collect("dns_overload", guard.stats, server="enhanced")
+    if args.workers > 1 and args.shared_cache:
+        # Mapped by every worker: one worker's answers are hits for all
+        cache.shared = SharedCache(args.shared_cache)
+        registry.collect("dns_shared_cache", cache.shared.stats, server="enhanced")
+    snapshot = None
+    if args.snapshot:
+        snapshot = CacheSnapshot(args.snapshot, cache, delegations, args.snapshot_interval)
+        registry.collect("dns_snapshot", snapshot.stats, server="enhanced")
+
+    def worker_main(slot=0, stats=None):
+        # Worker N serves its own counters on --metrics-port + N
+        start_metrics(args, slot)
+
+        async def startup():
+            # Reloads touch the cache, so the reloader hands them to this loop
+            ZoneReloader(ZONE_FILE, zones, apply_zone_update, args.reload_interval,
+                         loop=asyncio.get_running_loop()).start()
+            if snapshot is None:
+                return
+            if slot == 0:
+                # Restores, then saves (with a shared cache, everyone's answers)
+                await snapshot.run()
+            else:
+                # A shared cache already gets worker 0's answers
+                await snapshot.restore(answers=cache.shared is None)
+        run_udp_server(handle_enhanced_query, "127.0.0.1", 8057, name="enhanced", reuse_port=stats is not None, stats=stats,
+                       batch=args.batch, guard=guard, startup=startup)
+
     print("🚀 Enhanced Recursive DNS Server running on 127.0.0.1:8057...")
-    print("🌍 Uses simulated root and TLD servers")
+    if args.transport == "inprocess":
+        print("🧩 Root, TLD and authoritative servers answered in-process (no sockets)")
+    else:
+        print(f"🌍 Uses simulated root ({ROOT_SERVER[0]}:{ROOT_SERVER[1]}) and TLD ({TLD_SERVER[0]}:{TLD_SERVER[1]}) servers")
     print("🔗 Complete DNS hierarchy simulation")
-    
-    while True:
-        try:
-            data, addr = sock.recvfrom(512)
-            request = DNSRecord.parse(data)
-            
-            qname = str(request.q.qname)
-            qtype = QTYPE[request.q.qtype]
-            
-            print(f"\n📨 Enhanced Query: {qname} ({qtype}) from {addr}")
-            
-            # Try enhanced recursive resolution
-            response = enhanced_recursive_resolve(qname, qtype)
-            
-            if response:
-                print(f"✅ Enhanced recursive response")
-                # Forward the response with correct ID
-                response.header.id = request.header.id
-                sock.sendto(response.pack(), addr)
-            else:
-                print("❌ No response found")
-                reply = request.reply()
-                reply.rcode = 3  # NXDOMAIN
-                sock.sendto(reply.pack(), addr)
-            
-        except Exception as e:
-            print(f"Error handling enhanced query: {e}")
+    if snapshot is not None:
+        print(f"💾 Cache snapshot at {args.snapshot} (restored on startup, saved on shutdown)")
+    if args.workers <= 1:
+        worker_main()
+        return
+    if cache.shared is not None:
+        print(f"🗄️  Answer cache shared by all workers ({args.shared_cache} slots)")
+    run_workers(worker_main, args.workers, name="enhanced resolver", stats_interval=args.stats_interval)
 
 if __name__ == "__main__":
     run_enhanced_recursive_server()
@@ -2,79 +2,188 @@ import sys
 import os
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '.')))
 
-import socket
+import time
+import asyncio
+import argparse
 from dnslib import DNSRecord, QTYPE, RR, A, CNAME
 from zone.zone_loader import load_zones
+from zone.reloader import ZoneReloader, changed_names
+from zone.rotation import AddressRotator, MODES, set_mode
+from core.udp_server import run_udp_server
+from core.workers import run_workers
+from core.shm_cache import SharedCache
+from core.snapshot import CacheSnapshot
+from core.cache import DNSCache, cache_key
+from core.singleflight import SingleFlight
+from core.prefetch import Prefetcher
+from core.ratelimit import Admission, add_overload_arguments, overload_guard
+from core.wire import decode_query, empty_reply, qtype_name
+from core.capture import add_capture_arguments, configure_capture
+from core.profiler import add_profile_arguments, configure_profiler
+from core.querylog import log, add_log_arguments, configure_log
+from core.metrics import registry, stage, add_metrics_arguments, start_metrics
+from core import upstream
 
 # Load our authoritative zones
-zones = load_zones()
+ZONE_FILE = "zone/zones.json"
+zones = load_zones(ZONE_FILE)
 
-def query_external_dns(domain, qtype):
+# Order in which local names with several addresses list them
+rotator = AddressRotator()
+
+# Answers from upstream, refreshed in the background while they are hot
+cache = DNSCache()
+
+# Identical lookups in flight share one upstream query
+inflight = SingleFlight()
+prefetcher = Prefetcher(cache, inflight)
+
+# Caps the lookups in flight (--max-recursions); cached answers skip it
+admission = Admission()
+
+# Exposed on the metrics endpoint
+registry.collect("dns_cache", cache.stats, server="recursive")
+registry.collect("dns_singleflight", inflight.stats, server="recursive")
+registry.collect("dns_prefetch", prefetcher.stats, server="recursive")
+registry.collect("dns_admission", admission.stats, server="recursive")
+registry.collect("dns_upstream", upstream.transport.stats, server="recursive")
+
+def apply_zone_update(new_zones, diff):
+    """Swap in reloaded zones and drop cached answers for changed names (on the event loop)"""
+    global zones
+    zones = new_zones
+    cache.invalidate(changed_names(diff))
+
+async def query_external_dns(domain, qtype):
     """Query external DNS server (Google DNS)"""
     try:
-        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-        sock.settimeout(5)
-        
         query = DNSRecord.question(domain, qtype)
-        sock.sendto(query.pack(), ("8.8.8.8", 53))
-        
-        data, addr = sock.recvfrom(512)
-        response = DNSRecord.parse(data)
-        
-        sock.close()
-        return response
+        return await upstream.query("8.8.8.8", 53, query)
     except Exception as e:
-        print(f"Error querying external DNS: {e}")
+        log.warning("upstream_error", server="8.8.8.8:53", qname=domain, qtype=qtype, error=repr(e))
         return None
 
+async def handle_recursive_query(data, addr):
+    """Answer one raw query datagram, recursing for non-local names"""
+    start = time.perf_counter()
+    query = decode_query(data)
+    
+    qname = query.qname
+    qtype = qtype_name(query.qtype)
+    stage("recursive", "parse", start)
+    
+    # Check if we have authoritative data
+    if qname in zones and qtype == "A":
+        zone = zones[qname]
+        if "A" in zone:
+            ttl = zone.get("TTL", 300)
+            
+            # Create reply with correct ID
+            reply = DNSRecord.question(qname, qtype).reply()
+            reply.header.id = query.id
+            for ip in rotator.order(qname, "A", zone):
+                reply.add_answer(RR(qname, QTYPE.A, rdata=A(ip), ttl=ttl))
+            response = reply.pack()
+            log.query("recursive", qname, qtype, addr, response, source="authoritative")
+            return response
+    
+    # Try recursive resolution for external domains
+    start = time.perf_counter()
+    external_response, state = await prefetcher.resolve(cache_key(qname, qtype), admission.run, query_external_dns, qname, qtype)
+    stage("recursive", "cache" if state else "upstream", start)
+    if external_response and external_response.rr:
+        # Forward the external response with correct ID
+        external_response.header.id = query.id
+        response = external_response.pack()
+        log.query("recursive", qname, qtype, addr, response, source=state or "upstream")
+        return response
+    
+    # No response from external DNS
+    response = empty_reply(data, query, 3)  # NXDOMAIN
+    log.query("recursive", qname, qtype, addr, response, source=state or "upstream")
+    return response
+
 def run_final_recursive_server():
     """Run the final recursive DNS server"""
-    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-    sock.bind(("127.0.0.1", 8054))
+    parser = argparse.ArgumentParser(description="Recursive DNS resolver")
+    parser.add_argument("--reload-interval", type=float, default=2.0, help="seconds between zone file checks (0: SIGHUP only)")
+    parser.add_argument("--max-waiters", type=int, default=1000, help="queries allowed to wait on one in-flight lookup")
+    parser.add_argument("--waiter-timeout", type=float, default=10, help="seconds a query waits on an in-flight lookup")
+    parser.add_argument("--cache-size", type=int, default=10000, help="maximum number of cached answers")
+    parser.add_argument("--cache-memory", type=int, default=None, help="maximum cache size in bytes")
+    parser.add_argument("--prefetch-fraction", type=float, default=0.1, help="refresh hot answers with this share of their TTL left (0: off)")
+    parser.add_argument("--prefetch-hits", type=int, default=2, help="hits before an answer counts as hot")
+    parser.add_argument("--serve-stale", action="store_true", help="answer from expired cache entries while refreshing them")
+    parser.add_argument("--stale-ttl", type=int, default=30, help="TTL given to stale answers")
+    parser.add_argument("--max-stale", type=int, default=86400, help="seconds past expiry an answer may still be served")
+    parser.add_argument("--rotation", default="wrr", choices=MODES, help="order of multi-address answers: weighted round-robin, weighted shuffle or zone order")
+    parser.add_argument("--batch", type=int, default=0, help="datagrams received and answered per wakeup (0: one at a time)")
+    parser.add_argument("--workers", type=int, default=1, help="number of SO_REUSEPORT worker processes")
+    parser.add_argument("--stats-interval", type=int, default=10, help="seconds between aggregated worker stats")
+    parser.add_argument("--shared-cache", type=int, default=65536, help="slots in the answer cache shared by --workers (0: each worker caches alone)")
+    parser.add_argument("--snapshot", default=None, metavar="PATH", help="save the cache here periodically and on shutdown, and restore it on startup")
+    parser.add_argument("--snapshot-interval", type=float, default=300, help="seconds between cache snapshots (0: only on shutdown)")
+    add_overload_arguments(parser, recursion=True)
+    add_log_arguments(parser)
+    add_capture_arguments(parser)
+    add_profile_arguments(parser)
+    add_metrics_arguments(parser)
+    args = parser.parse_args()
+    configure_log(args)
+    configure_capture(args)
+    configure_profiler(args, "recursive")
+    set_mode(args.rotation)
+    cache.max_entries = args.cache_size
+    cache.max_bytes = args.cache_memory
+    cache.prefetch_fraction = args.prefetch_fraction
+    cache.prefetch_hits = args.prefetch_hits
+    cache.serve_stale = args.serve_stale
+    cache.stale_ttl = args.stale_ttl
+    cache.max_stale = args.max_stale
+    prefetcher.retry_interval = args.stale_ttl
+    inflight.max_waiters = args.max_waiters
+    inflight.timeout = args.waiter_timeout
+    admission.max_inflight = args.max_recursions
+    guard = overload_guard(args)
+    registry.collect("dns_overload", guard.stats, server="recursive")
+    if args.workers > 1 and args.shared_cache:
+        # Mapped by every worker: one worker's answers are hits for all
+        cache.shared = SharedCache(args.shared_cache)
+        registry.collect("dns_shared_cache", cache.shared.stats, server="recursive")
+    snapshot = None
+    if args.snapshot:
+        snapshot = CacheSnapshot(args.snapshot, cache, interval=args.snapshot_interval)
+        registry.collect("dns_snapshot", snapshot.stats, server="recursive")
+
+    def worker_main(slot=0, stats=None):
+        # Worker N serves its own counters on --metrics-port + N
+        start_metrics(args, slot)
+
+        async def startup():
+            # Reloads touch the cache, so the reloader hands them to this loop
+            ZoneReloader(ZONE_FILE, zones, apply_zone_update, args.reload_interval,
+                         loop=asyncio.get_running_loop()).start()
+            if snapshot is None:
+                return
+            if slot == 0:
+                # Restores, then saves (with a shared cache, everyone's answers)
+                await snapshot.run()
+            else:
+                # A shared cache already gets worker 0's answers
+                await snapshot.restore(answers=cache.shared is None)
+        run_udp_server(handle_recursive_query, "127.0.0.1", 8054, name="recursive", reuse_port=stats is not None, stats=stats,
+                       batch=args.batch, guard=guard, startup=startup)
+
     print("✅ Final Recursive DNS Server running on 127.0.0.1:8054...")
     print("🌍 Can resolve both local domains and external domains!")
-    
-    while True:
-        try:
-            data, addr = sock.recvfrom(512)
-            request = DNSRecord.parse(data)
-            
-            qname = str(request.q.qname)
-            qtype = QTYPE[request.q.qtype]
-            
-            print(f"\n📨 Query: {qname} ({qtype}) from {addr}")
-            
-            # Check if we have authoritative data
-            if qname in zones and qtype == "A":
-                zone = zones[qname]
-                if "A" in zone:
-                    ip = zone["A"]
-                    ttl = zone.get("TTL", 300)
-                    
-                    # Create reply with correct ID
-                    reply = request.reply()
-                    reply.add_answer(RR(qname, QTYPE.A, rdata=A(ip), ttl=ttl))
-                    print(f"✅ Authoritative response: {qname} -> {ip}")
-                    
-                    sock.sendto(reply.pack(), addr)
-                    continue
-            
-            # Try recursive resolution for external domains
-            print(f"🔍 Not authoritative, trying recursive resolution for {qname}")
-            external_response = query_external_dns(qname, qtype)
-            if external_response and external_response.rr:
-                print(f"✅ Recursive response from external DNS")
-                # Forward the external response with correct ID
-                external_response.header.id = request.header.id
-                sock.sendto(external_response.pack(), addr)
-            else:
-                print("❌ No response from external DNS")
-                reply = request.reply()
-                reply.rcode = 3  # NXDOMAIN
-                sock.sendto(reply.pack(), addr)
-            
-        except Exception as e:
-            print(f"Error handling request: {e}")
+    if snapshot is not None:
+        print(f"💾 Cache snapshot at {args.snapshot} (restored on startup, saved on shutdown)")
+    if args.workers <= 1:
+        worker_main()
+        return
+    if cache.shared is not None:
+        print(f"🗄️  Answer cache shared by all workers ({args.shared_cache} slots)")
+    run_workers(worker_main, args.workers, name="recursive resolver", stats_interval=args.stats_interval)
 
 if __name__ == "__main__":
     run_final_recursive_server()
@@ -2,8 +2,16 @@ import sys
 import os
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '.')))
 
-import socket
+import time
+import argparse
 from dnslib import DNSRecord, QTYPE, RR, A, NS
+from zone.tree import ZoneTree, EXACT, DELEGATION
+from core.udp_server import run_udp_server
+from core.wire import decode_query, empty_reply, qtype_name
+from core.capture import add_capture_arguments, configure_capture
+from core.profiler import add_profile_arguments, configure_profiler
+from core.querylog import log, add_log_arguments, configure_log
+from core.metrics import stage, add_metrics_arguments, start_metrics
 
 # Root server zone data - simulates the 13 root servers
 ROOT_ZONES = {
@@ -29,13 +37,33 @@ ROOT_ZONES = {
     }
 }
 
+# The root zone, with every TLD above delegated from it
+ROOT_TREE = ZoneTree(ROOT_ZONES, classify=lambda name, data: (False, True), apexes=["."])
+
+def referral(domain, qtype, cut):
+    """Send the client to a TLD's servers, with their addresses as glue"""
+    reply = DNSRecord.question(domain, qtype).reply()
+    reply.header.aa = 0
+    for ns, ip in zip(cut.data["NS"], cut.data["A"]):
+        reply.add_auth(RR(cut.name, QTYPE.NS, rdata=NS(ns), ttl=3600))
+        reply.add_ar(RR(ns, QTYPE.A, rdata=A(ip), ttl=3600))
+    return reply
+
 def resolve_root_query(domain, qtype):
-    """Resolve queries at the root server level"""
-    print(f"🌍 Root server query: {domain} ({qtype})")
+    """Resolve queries at the root server level
+
+    Returns a reply, or None for TLDs that don't exist. Names below a
+    TLD (google.com.) get a referral to that TLD's servers.
+    """
+    log.debug("root_lookup", qname=domain, qtype=qtype)
+    
+    match = ROOT_TREE.lookup(domain)
+    if match.kind == DELEGATION:
+        return referral(domain, qtype, match.node)
     
     # For root server, we handle TLD queries directly
-    if domain in ROOT_ZONES:
-        zone = ROOT_ZONES[domain]
+    if match.kind == EXACT and match.node.data is not None:
+        zone = match.node.data
         
         if qtype == "NS":
             # Return NS records for TLD delegation
@@ -52,42 +80,59 @@ def resolve_root_query(domain, qtype):
                 for ip in zone["A"]:
                     reply.add_answer(RR(ns, QTYPE.A, rdata=A(ip), ttl=3600))
             return reply
+        
+        return referral(domain, qtype, match.node)
+    
+    if match.kind == EXACT:
+        # The root itself: it exists, we just have no data for it
+        return DNSRecord.question(domain, qtype).reply()
     
-    print(f"❌ No delegation found for {domain}")
     return None
 
+def handle_root_query(data, addr):
+    """Answer one raw query datagram sent to the root server"""
+    start = time.perf_counter()
+    query = decode_query(data)
+    
+    qname = query.qname
+    qtype = qtype_name(query.qtype)
+    stage("root", "parse", start)
+    
+    # Try to resolve the query
+    start = time.perf_counter()
+    response = resolve_root_query(qname, qtype)
+    stage("root", "lookup", start)
+    
+    start = time.perf_counter()
+    if response:
+        response.header.id = query.id
+        response = response.pack()
+    else:
+        # No delegation for this name
+        response = empty_reply(data, query, 3, authoritative=True)  # NXDOMAIN
+    stage("root", "pack", start)
+    
+    log.query("root", qname, qtype, addr, response)
+    return response
+
 def run_root_server():
     """Run the root DNS server simulator"""
-    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-    sock.bind(("127.0.0.1", 8055))  # Port 8055 for root server
+    parser = argparse.ArgumentParser(description="Root DNS server simulator")
+    parser.add_argument("--batch", type=int, default=0, help="datagrams received and answered per wakeup (0: one at a time)")
+    add_log_arguments(parser)
+    add_capture_arguments(parser)
+    add_profile_arguments(parser)
+    add_metrics_arguments(parser)
+    args = parser.parse_args()
+    configure_log(args)
+    configure_capture(args)
+    configure_profiler(args, "root")
+    start_metrics(args)
+
     print("🌍 Root DNS Server Simulator running on 127.0.0.1:8055...")
     print("📍 Simulates the 13 root servers")
     print("🔗 Knows about TLD servers (.com, .org, .net, .edu, .gov)")
-    
-    while True:
-        try:
-            data, addr = sock.recvfrom(512)
-            request = DNSRecord.parse(data)
-            
-            qname = str(request.q.qname)
-            qtype = QTYPE[request.q.qtype]
-            
-            print(f"\n📨 Root Query: {qname} ({qtype}) from {addr}")
-            
-            # Try to resolve the query
-            response = resolve_root_query(qname, qtype)
-            
-            if response:
-                print(f"✅ Root server response for {qname}")
-                sock.sendto(response.pack(), addr)
-            else:
-                print(f"❌ No delegation found for {qname}")
-                reply = request.reply()
-                reply.rcode = 3  # NXDOMAIN
-                sock.sendto(reply.pack(), addr)
-            
-        except Exception as e:
-            print(f"Error handling root query: {e}")
+    run_udp_server(handle_root_query, "127.0.0.1", 8055, name="root", batch=args.batch)  # Port 8055 for root server
 
 if __name__ == "__main__":
     run_root_server()
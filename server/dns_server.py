@@ -2,119 +2,287 @@ import sys
 import os
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 
-import socket
-from dnslib import DNSRecord, QTYPE, RR, A, CNAME, NS, SOA, TXT, MX, PTR, SRV
-from zone.zone_loader import load_zones
-
-zones = load_zones()
-
-def resolve(query):
-    qname = str(query.q.qname)
-    qtype = QTYPE[query.q.qtype]
-    print(f"Query: {qname} ({qtype})")
-
-    if qname in zones:
-        zone = zones[qname]
-
-        # Direct A match
-        if qtype == "A":
-            if "A" in zone:
-                ip = zone["A"]
-                ttl = zone.get("TTL", 300)
-                return RR(qname, QTYPE.A, rdata=A(ip), ttl=ttl)
-
-            # CNAME fallback
-            elif "CNAME" in zone:
-                cname = zone["CNAME"]
-                cname_rr = RR(qname, QTYPE.CNAME, rdata=CNAME(cname), ttl=zone.get("TTL", 300))
-
-                if cname in zones and "A" in zones[cname]:
-                    ip = zones[cname]["A"]
-                    a_rr = RR(cname, QTYPE.A, rdata=A(ip), ttl=zones[cname].get("TTL", 300))
-                    return [cname_rr, a_rr]
-                else:
-                    return cname_rr
-
-        # Explicit CNAME query
-        elif qtype == "CNAME" and "CNAME" in zone:
-            cname = zone["CNAME"]
-            return RR(qname, QTYPE.CNAME, rdata=CNAME(cname), ttl=zone.get("TTL", 300))
-
-        # NS (Name Server) records
-        elif qtype == "NS" and "NS" in zone:
-            ns_servers = zone["NS"]
-            if isinstance(ns_servers, list):
-                return [RR(qname, QTYPE.NS, rdata=NS(ns), ttl=zone.get("TTL", 300)) for ns in ns_servers]
-            else:
-                return RR(qname, QTYPE.NS, rdata=NS(ns_servers), ttl=zone.get("TTL", 300))
-
-        # SOA (Start of Authority) records
-        elif qtype == "SOA" and "SOA" in zone:
-            soa_data = zone["SOA"]
-            soa_rr = RR(qname, QTYPE.SOA, rdata=SOA(
-                mname=soa_data["mname"],
-                rname=soa_data["rname"],
-                times=(
-                    soa_data["serial"],
-                    soa_data["refresh"],
-                    soa_data["retry"],
-                    soa_data["expire"],
-                    soa_data["minimum"]
-                )
-            ), ttl=zone.get("TTL", 300))
-            return soa_rr
-
-        # TXT records
-        elif qtype == "TXT" and "TXT" in zone:
-            txt_data = zone["TXT"]
-            if isinstance(txt_data, list):
-                return [RR(qname, QTYPE.TXT, rdata=TXT(txt), ttl=zone.get("TTL", 300)) for txt in txt_data]
-            else:
-                return RR(qname, QTYPE.TXT, rdata=TXT(txt_data), ttl=zone.get("TTL", 300))
-
-        # MX (Mail Exchange) records
-        elif qtype == "MX" and "MX" in zone:
-            mx_records = zone["MX"]
-            if isinstance(mx_records, list):
-                return [RR(qname, QTYPE.MX, rdata=MX(mx["exchange"], mx["priority"]), ttl=zone.get("TTL", 300)) for mx in mx_records]
-            else:
-                return RR(qname, QTYPE.MX, rdata=MX(mx_records["exchange"], mx_records["priority"]), ttl=zone.get("TTL", 300))
-
-        # PTR (Pointer) records for reverse DNS
-        elif qtype == "PTR" and "PTR" in zone:
-            ptr_target = zone["PTR"]
-            return RR(qname, QTYPE.PTR, rdata=PTR(ptr_target), ttl=zone.get("TTL", 300))
-
-        # SRV (Service) records for service discovery
-        elif qtype == "SRV" and "SRV" in zone:
-            srv_records = zone["SRV"]
-            if isinstance(srv_records, list):
-                return [RR(qname, QTYPE.SRV, rdata=SRV(srv["priority"], srv["weight"], srv["port"], srv["target"]), ttl=zone.get("TTL", 300)) for srv in srv_records]
-            else:
-                return RR(qname, QTYPE.SRV, rdata=SRV(srv_records["priority"], srv_records["weight"], srv_records["port"], srv_records["target"]), ttl=zone.get("TTL", 300))
-
-    return None
+import time
+import argparse
+import threading
+from dnslib import DNSRecord, QTYPE, OPCODE, RCODE
+from zone.zone_loader import load_zones, load_binary_zones
+from zone.records import zone_records
+from zone.compiler import compile_zones, update_index, compile_tree_answers, build_response
+from zone.tree import ZoneTree, EXACT, WILDCARD, DELEGATION
+from zone.rotation import RotatingAnswer, MODES, set_mode, health_targets
+from zone.reloader import ZoneReloader, changed_names
+from zone.transfer import ZonePrimary, ZoneSecondary, zone_apexes
+from core.udp_server import run_udp_server
+from core.upstream import parse_address
+from core.ratelimit import add_overload_arguments, overload_guard
+from core.wire import decode_query, parse_query, plain_query
+from core.workers import run_workers
+from core.capture import add_capture_arguments, configure_capture
+from core.profiler import add_profile_arguments, configure_profiler
+from core.querylog import log, add_log_arguments, configure_log
+from core.metrics import registry, stage, add_metrics_arguments, start_metrics
+from core.health import health
+
+class ZoneState:
+    """One version of everything served: the zone table and what is compiled from it
+
+    Never changed once built: reloads and transfers build the next one
+    and swap STATE in one assignment, so a query that reads STATE once
+    sees a single version throughout, whichever thread swaps it.
+    """
+
+    __slots__ = ("zones", "index", "tree", "answers")
+
+    def __init__(self, zones, index=None, tree=None):
+        self.zones = zones
+        # Every answer we can give, prepacked at load time: (qname, qtype) -> wire bytes
+        self.index = compile_zones(zones) if index is None else index
+        # Owner names as a label tree, for whatever the exact index has no entry
+        # for: NXDOMAIN vs NODATA, wildcards and referrals below zone cuts
+        self.tree = ZoneTree(zones) if tree is None else tree
+        self.answers = compile_tree_answers(zones, self.tree)
+
+# Zones are loaded by run_server() once the options are parsed (or by
+# use_zone_file()/set_zones() when embedded); until then nothing is served
+ZONE_FILE = "zone/zones.json"
+STATE = ZoneState({}, {})
+
+# Reloads (reloader thread) and transfers (secondary thread) build on the
+# current STATE, so one update at a time
+UPDATE_LOCK = threading.Lock()
+
+def resolve(query, table=None):
+    if table is None:
+        table = STATE.zones
+    return zone_records(table, str(query.q.qname), QTYPE[query.q.qtype])
+
+registry.collect("dns_health", health.stats)
+
+# Serves AXFR/IXFR of our zones over TCP and NOTIFYs secondaries (set by
+# start_transfers()); SECONDARY pulls zones from a primary (--primary)
+TRANSFERS = None
+SECONDARY = None
+
+def apply_zone_update(new_zones, diff):
+    """Recompile only the changed names, then swap the new state in one step"""
+    global STATE
+    with UPDATE_LOCK:
+        names = changed_names(diff)
+        old = STATE
+        STATE = ZoneState(new_zones, update_index(old.index, old.zones, new_zones, names),
+                          old.tree.updated(new_zones, names))
+        health.watch(health_targets(new_zones))
+        if TRANSFERS is not None:
+            # Journal the new serials for IXFR and NOTIFY the secondaries
+            TRANSFERS.update(new_zones)
+
+def set_zones(table, index=None):
+    """Serve a whole new zone table, compiled from scratch unless index is given"""
+    global STATE
+    with UPDATE_LOCK:
+        STATE = ZoneState(table, index)
+        health.watch(health_targets(table))
+
+def use_zone_file(path):
+    """Serve from another zone file: zones.json-style or compiled .bin"""
+    global ZONE_FILE
+    ZONE_FILE = path
+    if path.endswith(".bin"):
+        # Lookups go straight to the mmap; there is no table to resolve
+        # from, so no tree either (and no wildcards or zone cuts)
+        set_zones({}, load_binary_zones(path))
+    else:
+        set_zones(load_zones(path))
+
+def tree_answer(qname, qtype, state):
+    """Compiled answer for a name/type state's exact index has nothing for"""
+    answers = state.answers
+    match = state.tree.lookup(qname)
+    zone = match.zone.name if match.zone else None
+    if match.kind == DELEGATION or (match.kind == EXACT and match.node.cut):
+        return answers[("referral", match.node.name)]
+    if match.kind == WILDCARD:
+        entry = answers[("wildcard", match.node.name)].get(qtype)
+        return entry or answers[("nodata", zone)]
+    if match.kind == EXACT:
+        return answers[("nodata", zone)]
+    if not isinstance(state.index, dict) and state.index.find(qname) is not None:
+        # Binary zones have no tree, but the mmap knows which names exist
+        return answers[("nodata", zone)]
+    return answers[("nxdomain", zone)]
+
+def start_reloader(interval):
+    """Watch the zone file (and SIGHUP) for hot reloads"""
+    if ZONE_FILE.endswith(".bin"):
+        print("ℹ️  Binary zones are not hot-reloaded; recompile and restart to pick up changes")
+        return None
+    return ZoneReloader(ZONE_FILE, STATE.zones, apply_zone_update, interval).start()
+
+def start_transfers(args):
+    """Serve zone transfers (and queries) over TCP; pull zones from --primary if given"""
+    global TRANSFERS, SECONDARY
+    TRANSFERS = ZonePrimary(STATE.zones, [parse_address(target) for target in args.notify], args.allow_transfer)
+    registry.collect("dns_transfer", TRANSFERS.stats)
+    try:
+        TRANSFERS.serve(args.host, args.port, handle_query)
+    except OSError as e:
+        print(f"⚠️  No TCP on {args.host}:{args.port} ({e}), zone transfers disabled")
+
+    if args.primary:
+        primary = parse_address(args.primary)
+        apexes = args.transfer_zone
+        SECONDARY = ZoneSecondary(primary, apexes, lambda: STATE.zones, apply_zone_update, args.refresh_interval)
+        registry.collect("dns_secondary", SECONDARY.stats)
+        print(f"🔁 Secondary for {', '.join(apexes)} from {primary[0]}:{primary[1]}")
+        SECONDARY.start()
+
+def start_guard(args):
+    """Rate limiting and load shedding for the UDP listener"""
+    guard = overload_guard(args)
+    registry.collect("dns_overload", guard.stats, server="auth")
+    return guard
+
+def start_health_checks(args):
+    """Probe the addresses of names with a HEALTH entry, if any"""
+    health.interval = args.health_interval
+    health.timeout = args.health_timeout
+    health.watch(health_targets(STATE.zones))
+    if health.targets and health.interval > 0:
+        print(f"🩺 Health checking {len(health.targets)} backends every {health.interval}s")
+    # Running even without targets, so a reload can add some
+    health.start()
+
+def build_reply(request, table=None):
+    """Build a reply from dnslib objects (the uncompiled path)"""
+    reply = request.reply()
+
+    start = time.perf_counter()
+    answer = resolve(request, table)
+    stage("auth", "lookup", start)
+    if answer:
+        if isinstance(answer, list):
+            for record in answer:
+                reply.add_answer(record)
+        else:
+            reply.add_answer(answer)
+
+    return reply
+
+def notify_answer(request, addr):
+    """Acknowledge a NOTIFY, refreshing the zone if it came from our primary"""
+    accepted = SECONDARY is not None and SECONDARY.notify(request, addr)
+    reply = request.reply()
+    if not accepted:
+        reply.header.rcode = RCODE.REFUSED
+    log.info("notify", zone=str(request.q.qname), client=addr, accepted=accepted)
+    return reply.pack()
+
+def handle_query(data, addr):
+    """Answer one raw DNS query datagram"""
+    start = time.perf_counter()
+    query = decode_query(data)
+    if query.record is not None and query.record.header.opcode == OPCODE.NOTIFY:
+        return notify_answer(query.record, addr)
+
+    # Re-encode unusual queries (EDNS options, compressed names, ...) as a
+    # plain question so they can use the compiled index too
+    if query.record is not None and query.record.header.opcode == 0:
+        data = plain_query(query.record)
+        query = parse_query(data) or query
+    stage("auth", "parse", start)
+
+    # Anything the fast decoder couldn't handle, or non-IN classes, takes
+    # the dnslib path
+    if query.record is not None or query.qclass != 1:
+        request = query.record or DNSRecord.parse(data)
+        reply = build_reply(request)
+        start = time.perf_counter()
+        response = reply.pack()
+    else:
+        start = time.perf_counter()
+        state = STATE
+        entry = state.index.get((query.qname, query.qtype))
+        if entry is None:
+            entry = tree_answer(query.qname, query.qtype, state)
+        elif entry.__class__ is RotatingAnswer:
+            # Several addresses: next order, without any that are down
+            entry = entry.answer()
+        stage("auth", "lookup", start)
+        start = time.perf_counter()
+        response = build_response(data, query.question_end, entry)
+    stage("auth", "pack", start)
+
+    log.query("auth", query.qname, query.qtype, addr, response)
+    return response
 
 def run_server():
-    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-    sock.bind(("127.0.0.1", 8053)) 
-    
-    print("✅ DNS Server running on 127.0.0.1:8053...")
-
-    while True:
-        data, addr = sock.recvfrom(512)
-        request = DNSRecord.parse(data)
-        reply = request.reply()
-
-        answer = resolve(request)
-        if answer:
-            if isinstance(answer, list):
-                for record in answer:
-                    reply.add_answer(record)
-            else:
-                reply.add_answer(answer)
-
-        sock.sendto(reply.pack(), addr)
+    parser = argparse.ArgumentParser(description="Authoritative DNS server")
+    parser.add_argument("--zone-file", default=None, help="zones.json-style file, or a .bin from `python -m zone compile`")
+    parser.add_argument("--workers", type=int, default=1, help="number of SO_REUSEPORT worker processes")
+    parser.add_argument("--stats-interval", type=int, default=10, help="seconds between aggregated worker stats")
+    parser.add_argument("--reload-interval", type=float, default=2.0, help="seconds between zone file checks (0: SIGHUP only)")
+    parser.add_argument("--rotation", default="wrr", choices=MODES, help="order of multi-address answers: weighted round-robin, weighted shuffle or zone order")
+    parser.add_argument("--health-interval", type=float, default=5.0, help="seconds between health probes of HEALTH-checked addresses (0: off)")
+    parser.add_argument("--health-timeout", type=float, default=1.0, help="seconds before a health probe fails")
+    parser.add_argument("--batch", type=int, default=0, help="datagrams received and answered per wakeup (0: one at a time)")
+    parser.add_argument("--host", default="127.0.0.1", help="address to serve on (UDP, and TCP for transfers)")
+    parser.add_argument("--port", type=int, default=8053, help="port to serve on")
+    parser.add_argument("--notify", action="append", default=[], metavar="HOST:PORT", help="secondary to NOTIFY when a zone's serial changes (repeatable)")
+    parser.add_argument("--allow-transfer", action="append", default=None, metavar="CIDR", help="networks allowed AXFR/IXFR (default: loopback)")
+    parser.add_argument("--primary", default=None, metavar="HOST:PORT", help="run as a secondary, pulling zones from this primary")
+    parser.add_argument("--transfer-zone", action="append", default=[], metavar="ZONE", help="zone to pull from --primary (repeatable; default: the SOA names in --zone-file)")
+    parser.add_argument("--refresh-interval", type=float, default=300, help="most seconds a secondary waits between serial checks")
+    add_overload_arguments(parser)
+    add_log_arguments(parser)
+    add_capture_arguments(parser)
+    add_profile_arguments(parser)
+    add_metrics_arguments(parser)
+    args = parser.parse_args()
+    configure_log(args)
+    configure_capture(args)
+    configure_profiler(args, "auth")
+    set_mode(args.rotation)
+    if args.allow_transfer is None:
+        args.allow_transfer = ["127.0.0.0/8", "::1/128"]
+
+    if args.primary:
+        if args.workers > 1:
+            parser.error("--primary needs a single process (a NOTIFY reaches only one worker)")
+        # Everything served comes from the primary; a zone file only names the zones
+        args.transfer_zone = args.transfer_zone or sorted(zone_apexes(load_zones(args.zone_file or ZONE_FILE)))
+        set_zones({})
+    else:
+        # A .bin is mapped as is, without loading or compiling zones.json
+        use_zone_file(args.zone_file or ZONE_FILE)
+
+    if args.workers <= 1:
+        print(f"✅ DNS Server running on {args.host}:{args.port}...")
+        if not args.primary:
+            start_reloader(args.reload_interval)
+        start_transfers(args)
+        start_health_checks(args)
+        guard = start_guard(args)
+        start_metrics(args)
+        run_udp_server(handle_query, args.host, args.port, name="auth", batch=args.batch, guard=guard)
+        return
+
+    # Zones are loaded before forking, so every worker shares them
+    def worker_main(slot, stats):
+        start_reloader(args.reload_interval)
+        if slot == 0:
+            # One TCP listener, and one worker NOTIFYing secondaries
+            start_transfers(args)
+        start_health_checks(args)
+        # Rate limits are per worker, but the kernel sends a client's
+        # datagrams to the same worker as long as its source port stays
+        guard = start_guard(args)
+        # Each worker has its own counters: worker N serves them on --metrics-port + N
+        start_metrics(args, slot)
+        run_udp_server(handle_query, args.host, args.port, name="auth", reuse_port=True, stats=stats, batch=args.batch, guard=guard)
+
+    print(f"✅ DNS Server running on {args.host}:{args.port} with {args.workers} workers...")
+    run_workers(worker_main, args.workers, name="DNS", stats_interval=args.stats_interval)
 
 if __name__ == "__main__":
     run_server()
@@ -0,0 +1,166 @@
+#!/usr/bin/env python3
+"""
+Test hierarchy walks in the enhanced resolver, over the in-process transport
+"""
+
+import time
+import asyncio
+from collections import Counter
+import pytest
+from dnslib import DNSRecord, QTYPE
+from core.delegation import Delegation, DelegationCache
+from core.nameservers import ServerSelector
+from core.metrics import registry
+from core.querylog import log, WARNING, ERROR
+import enhanced_recursive
+
+def counting_transport():
+    """The in-process transport, counting the queries each server gets"""
+    transport = enhanced_recursive.inprocess_transport()
+    asked = Counter()
+
+    def counted(server, resolve):
+        def answer(request):
+            asked[server] += 1
+            return resolve(request)
+        return answer
+
+    transport.servers = {server: counted(server, resolve) for server, resolve in transport.servers.items()}
+    transport.default = counted("auth", transport.default)
+    return transport, asked
+
+class LatencyTransport:
+    """Answers like the in-process transport after a per-server delay; a delay of None never answers"""
+
+    def __init__(self, latency):
+        self.latency = latency
+        self.answer = enhanced_recursive.inprocess_transport().default
+        self.asked = Counter()
+
+    async def query(self, host, port, request, timeout=None, retries=None):
+        self.asked[(host, port)] += 1
+        delay = self.latency[(host, port)]
+        if delay is None:
+            raise ConnectionRefusedError(f"{host}:{port} is down")
+        await asyncio.sleep(delay)
+        return self.answer(request)
+
+def addresses(response):
+    return sorted(str(rr.rdata) for rr in response.rr if rr.rtype == QTYPE.A)
+
+def isolated(monkeypatch):
+    """Give the resolver a fresh delegation cache and selector; monkeypatch puts its globals back afterwards"""
+    monkeypatch.setattr(enhanced_recursive, "delegations", DelegationCache())
+    monkeypatch.setattr(enhanced_recursive, "selector", ServerSelector())
+    monkeypatch.setattr(enhanced_recursive, "RACE_SERVERS", False)
+    monkeypatch.setattr(enhanced_recursive, "TRANSPORT", enhanced_recursive.TRANSPORT)
+    return monkeypatch
+
+@pytest.fixture
+def resolver(monkeypatch):
+    return isolated(monkeypatch)
+
+def test_cached_cut(resolver):
+    """A walk caches the domain's cut; the next name under it goes straight to its servers"""
+    print("🧪 Testing Hierarchy Walks")
+    print("=" * 50)
+    log.configure(level=WARNING)
+    transport, asked = counting_transport()
+    resolver.setattr(enhanced_recursive, "TRANSPORT", transport)
+
+    print("\n📍 google.com. A from the root")
+    response = asyncio.run(enhanced_recursive.walk_hierarchy("google.com.", "A"))
+    assert response is not None and response.header.rcode == 0
+    assert addresses(response) == sorted(["8.8.8.8", "8.8.4.4", "142.250.192.110", "142.250.192.111"])
+    assert asked == {enhanced_recursive.ROOT_SERVER: 1, enhanced_recursive.TLD_SERVER: 1, "auth": 1}
+    cut = enhanced_recursive.delegations.get("google.com.")
+    assert cut is not None and len(cut.servers) == 4, "no glue for google.com.'s nameservers"
+    print(f"✅ Answered after root -> TLD -> auth, {cut.zone} cached with {len(cut.servers)} servers")
+
+    print("\n📍 www.google.com. A from the cached cut")
+    asked.clear()
+    response = asyncio.run(enhanced_recursive.walk_hierarchy("www.google.com.", "A"))
+    assert response is not None and response.header.rcode == 0
+    assert addresses(response) == ["142.250.192.100", "142.250.192.101"]
+    assert asked == {"auth": 1}, f"expected one authoritative query, got {dict(asked)}"
+    print("✅ One authoritative query, no root or TLD hops")
+
+    print("\n📍 Names the walk can't find")
+    for name in ("missing.com.", "nope.google.com.", "www.nonexistent-tld."):
+        response = asyncio.run(enhanced_recursive.walk_hierarchy(name, "A"))
+        assert response is not None and response.header.rcode == 3, f"{name} should be NXDOMAIN"
+    print("✅ NXDOMAIN from the root, the TLD and the authoritative server")
+
+def test_server_selection(resolver):
+    """The fastest of a zone's servers gets the queries; racing answers from it even if the other racer fails"""
+    print("🧪 Testing Authoritative Server Selection")
+    print("=" * 50)
+    # The dead server's upstream errors are expected
+    log.configure(level=ERROR)
+    fast, slow, dead = ("10.0.0.1", 53), ("10.0.0.2", 53), ("10.0.0.3", 53)
+    transport = LatencyTransport({fast: 0.001, slow: 0.05, dead: None})
+    resolver.setattr(enhanced_recursive, "TRANSPORT", transport)
+    cut = Delegation("google.com.", ["ns1.google.com.", "ns2.google.com.", "ns3.google.com."],
+                     [fast, slow, dead], time.monotonic() + 3600)
+
+    async def ask(times):
+        for _ in range(times):
+            query = DNSRecord.question("www.google.com.", "A")
+            response = await enhanced_recursive.query_auth_servers(cut, query)
+            assert response is not None and addresses(response) == ["142.250.192.100", "142.250.192.101"]
+
+    print("\n📍 20 queries, one at a time")
+    asyncio.run(ask(20))
+    # Untried servers start with a random guess, so each of the others is tried once at most
+    assert transport.asked[dead] <= 1, "a failed server should not be retried straight away"
+    assert transport.asked[slow] <= 1, "the slow server should be tried at most once"
+    assert transport.asked[fast] >= 18
+    ranked = enhanced_recursive.selector.rank(cut.servers)
+    assert ranked[0] == fast, f"ranked {ranked}"
+    if transport.asked[dead]:
+        assert ranked[-1] == dead, f"ranked {ranked}"
+    print(f"✅ Asked fast {transport.asked[fast]}x, slow {transport.asked[slow]}x, dead {transport.asked[dead]}x")
+
+    print("\n📍 Racing the two fastest")
+    resolver.setattr(enhanced_recursive, "RACE_SERVERS", True)
+    resolver.setattr(enhanced_recursive, "selector", ServerSelector())
+    enhanced_recursive.selector.srtt = {fast: 0.001, slow: 0.05, dead: 2.0}
+    transport.asked.clear()
+    start = time.perf_counter()
+    asyncio.run(ask(1))
+    assert time.perf_counter() - start < 0.04, "the race should not wait for the slow server"
+    assert transport.asked == {fast: 1, slow: 1}
+    print("✅ Both asked, the fast answer used")
+
+    # The dead server looks fastest: the race still answers, from the other racer
+    resolver.setattr(enhanced_recursive, "selector", ServerSelector())
+    enhanced_recursive.selector.srtt = {dead: 0.0001, fast: 0.001, slow: 0.05}
+    transport.asked.clear()
+    asyncio.run(ask(1))
+    assert transport.asked == {dead: 1, fast: 1}
+    assert enhanced_recursive.selector.failures[dead] == 1
+    print("✅ A failed racer falls back to the other")
+
+def test_failed_server_reprobed(resolver):
+    """A server that keeps failing has a bounded SRTT, is tried again now and then, and shows up in the metrics"""
+    print("🧪 Testing Failed Server Recovery")
+    print("=" * 50)
+    fast, dead = ("10.0.0.1", 53), ("10.0.0.3", 53)
+    selector = ServerSelector(probe_every=10)
+    selector.record(fast, 0.001)
+    for _ in range(20):
+        selector.record_failure(dead)
+    assert selector.srtt[dead] == selector.max_penalty
+    firsts = Counter(selector.rank([fast, dead])[0] for _ in range(100))
+    assert firsts[dead] == 10, f"picked first {dict(firsts)}"
+    print(f"✅ SRTT capped at {selector.max_penalty}s, re-probed {firsts[dead]}x in 100 rankings")
+
+    enhanced_recursive.selector.record_failure(dead)
+    metrics = registry.render()
+    assert f'dns_nameserver_failures{{server="enhanced",nameserver="{dead[0]}:{dead[1]}"}}' in metrics
+    print("✅ Per-nameserver SRTT and failures exported")
+
+if __name__ == "__main__":
+    for test in (test_cached_cut, test_server_selection, test_failed_server_reprobed):
+        with pytest.MonkeyPatch.context() as monkeypatch:
+            test(isolated(monkeypatch))
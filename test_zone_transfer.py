@@ -0,0 +1,130 @@
+#!/usr/bin/env python3
+"""
+Test zone transfers: one primary and two secondaries on localhost
+"""
+
+import os
+import sys
+import json
+import time
+import shutil
+import socket
+import tempfile
+import subprocess
+from dnslib import DNSRecord
+from zone.transfer import request_transfer
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+ZONE = "myapp.local."
+
+def free_port():
+    """A port free for both UDP and TCP"""
+    while True:
+        with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as udp:
+            udp.bind(("127.0.0.1", 0))
+            port = udp.getsockname()[1]
+            with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as tcp:
+                try:
+                    tcp.bind(("127.0.0.1", port))
+                except OSError:
+                    continue
+            return port
+
+def start_server(*args):
+    return subprocess.Popen(
+        [sys.executable, "server/dns_server.py", "--health-interval", "0", "--log-level", "warning", *args],
+        cwd=ROOT, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+
+def ask(port, name, qtype):
+    """(rcode, sorted answer rdata) from the server on port, or None on timeout"""
+    try:
+        reply = DNSRecord.parse(DNSRecord.question(name, qtype).send("127.0.0.1", port, timeout=1))
+    except socket.timeout:
+        return None
+    return reply.header.rcode, sorted(str(rr.rdata) for rr in reply.rr)
+
+def wait_for(check, timeout=10):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if check():
+            return True
+        time.sleep(0.1)
+    return False
+
+def serial(port):
+    answer = ask(port, ZONE, "SOA")
+    return int(answer[1][0].split()[2]) if answer and answer[1] else None
+
+def test_zone_transfer():
+    """A primary NOTIFYs two secondaries, which follow it by AXFR then IXFR"""
+    print("🧪 Testing Zone Transfers")
+    print("=" * 50)
+
+    tmp = tempfile.mkdtemp()
+    zone_file = os.path.join(tmp, "zones.json")
+    shutil.copy(os.path.join(ROOT, "zone", "zones.json"), zone_file)
+    with open(zone_file) as f:
+        table = json.load(f)
+    first_serial = table[ZONE]["SOA"]["serial"]
+
+    primary, secondaries = free_port(), [free_port(), free_port()]
+    processes = [start_server(
+        "--port", str(primary), "--zone-file", zone_file, "--reload-interval", "0.2",
+        *[arg for port in secondaries for arg in ("--notify", f"127.0.0.1:{port}")],
+    )]
+    # A long refresh: after the first load, changes must arrive by NOTIFY
+    processes += [
+        start_server("--port", str(port), "--primary", f"127.0.0.1:{primary}",
+                     "--transfer-zone", ZONE, "--refresh-interval", "3600")
+        for port in secondaries
+    ]
+    try:
+        print(f"\n📍 Primary on {primary}, secondaries on {secondaries[0]} and {secondaries[1]}")
+        for port in secondaries:
+            assert wait_for(lambda: serial(port) == first_serial), f"secondary {port} never loaded the zone"
+        for name, qtype in [("www.myapp.local.", "A"), ("mail.myapp.local.", "MX"), ("api.myapp.local.", "AAAA"),
+                            ("missing.myapp.local.", "A"), ("myapp.local.", "TXT")]:
+            expected = ask(primary, name, qtype)
+            for port in secondaries:
+                assert ask(port, name, qtype) == expected, f"{name} {qtype} differs on {port}"
+        print(f"✅ Both secondaries loaded serial {first_serial} by AXFR")
+
+        # Change an address, add a name, drop a name and bump the serial
+        table[ZONE]["SOA"]["serial"] = first_serial + 1
+        table["www.myapp.local."] = {"A": "10.0.0.80"}
+        table["new.myapp.local."] = {"A": "10.0.0.81", "TXT": "v=new"}
+        del table["web2.myapp.local."]
+        with open(zone_file, "w") as f:
+            json.dump(table, f)
+
+        print(f"\n📍 Serial bumped to {first_serial + 1} on the primary")
+        for port in secondaries:
+            assert wait_for(lambda: serial(port) == first_serial + 1, timeout=5), f"secondary {port} missed the NOTIFY"
+            assert ask(port, "www.myapp.local.", "A") == (0, ["10.0.0.80"])
+            assert ask(port, "new.myapp.local.", "TXT") == (0, ['"v=new"'])
+            assert ask(port, "web2.myapp.local.", "A") == ask(primary, "web2.myapp.local.", "A")
+            assert ask(port, "web2.myapp.local.", "A")[0] == 3
+        print("✅ Both secondaries followed the change")
+
+        print("\n📍 Transfers as the secondaries see them")
+        kind, soa, changes = request_transfer(("127.0.0.1", primary), ZONE, first_serial)
+        assert kind == "ixfr" and len(changes) == 1
+        old_soa, removed, new_soa, added = changes[0]
+        names = {str(rr.rname) for rr in removed + added}
+        assert names == {"www.myapp.local.", "new.myapp.local.", "web2.myapp.local."}
+        print(f"✅ IXFR from {first_serial}: {len(removed)} removed, {len(added)} added")
+
+        assert request_transfer(("127.0.0.1", primary), ZONE, first_serial + 1)[0] == "current"
+        kind, soa, records = request_transfer(("127.0.0.1", primary), ZONE)
+        assert kind == "axfr" and {str(rr.rname) for rr in records} >= {"new.myapp.local.", "api.myapp.local."}
+        print(f"✅ AXFR: {len(records)} records")
+    finally:
+        for process in processes:
+            process.terminate()
+        for process in processes:
+            process.wait()
+        shutil.rmtree(tmp)
+
+if __name__ == "__main__":
+    test_zone_transfer()
@@ -2,89 +2,158 @@ import sys
 import os
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '.')))
 
-import socket
+import time
+import argparse
 from dnslib import DNSRecord, QTYPE, RR, A, NS
+from zone.tree import ZoneTree, name_labels, EXACT, DELEGATION
+from zone.rotation import AddressRotator, MODES, set_mode
+from core.udp_server import run_udp_server
+from core.wire import decode_query, empty_reply, qtype_name
+from core.capture import add_capture_arguments, configure_capture
+from core.profiler import add_profile_arguments, configure_profiler
+from core.querylog import log, add_log_arguments, configure_log
+from core.metrics import stage, add_metrics_arguments, start_metrics
 
 # TLD server zone data - simulates TLD servers like .com, .org
+# (A: the domain's own addresses, GLUE: its nameservers' addresses)
 TLD_ZONES = {
     "google.com.": {
         "NS": ["ns1.google.com.", "ns2.google.com.", "ns3.google.com.", "ns4.google.com."],
-        "A": ["8.8.8.8", "8.8.4.4", "142.250.192.110", "142.250.192.111"]
+        "A": ["8.8.8.8", "8.8.4.4", "142.250.192.110", "142.250.192.111"],
+        "GLUE": ["216.239.32.10", "216.239.34.10", "216.239.36.10", "216.239.38.10"]
     },
     "github.com.": {
         "NS": ["ns1.p16.dynect.net.", "ns2.p16.dynect.net.", "ns3.p16.dynect.net.", "ns4.p16.dynect.net."],
-        "A": ["20.207.73.82", "20.207.73.83", "20.207.73.84"]
+        "A": ["20.207.73.82", "20.207.73.83", "20.207.73.84"],
+        "GLUE": ["208.78.70.16", "204.13.250.16", "208.78.71.16", "204.13.251.16"]
     },
     "stackoverflow.com.": {
         "NS": ["ns-1029.awsdns-00.org.", "ns-2010.awsdns-59.co.uk.", "ns-358.awsdns-44.com.", "ns-755.awsdns-30.net."],
-        "A": ["104.18.32.7", "172.64.155.249", "104.18.33.7"]
+        "A": ["104.18.32.7", "172.64.155.249", "104.18.33.7"],
+        "GLUE": ["205.251.196.5", "205.251.199.218", "205.251.193.102", "205.251.194.243"]
     },
     "example.com.": {
         "NS": ["ns1.example.com.", "ns2.example.com."],
-        "A": ["93.184.216.34", "93.184.216.35"]
+        "A": ["93.184.216.34", "93.184.216.35"],
+        "GLUE": ["199.43.135.53", "199.43.133.53"]
     },
     "example.org.": {
         "NS": ["ns1.example.org.", "ns2.example.org."],
-        "A": ["93.184.216.34", "93.184.216.35"]
+        "A": ["93.184.216.34", "93.184.216.35"],
+        "GLUE": ["199.43.135.153", "199.43.133.153"]
     }
 }
 
+# Every domain above is a zone cut in its TLD's zone (com., org., ...)
+TLD_TREE = ZoneTree(
+    TLD_ZONES,
+    classify=lambda name, data: (False, True),
+    apexes={name_labels(name)[0] + "." for name in TLD_ZONES},
+)
+
+# Spreads clients over each domain's addresses instead of always
+# listing them in the same order
+rotator = AddressRotator()
+
+def referral(domain, qtype, cut):
+    """Send the client to the nameservers of the zone cut above domain, with their addresses as glue"""
+    reply = DNSRecord.question(domain, qtype).reply()
+    reply.header.aa = 0
+    for ns in cut.data["NS"]:
+        reply.add_auth(RR(cut.name, QTYPE.NS, rdata=NS(ns), ttl=3600))
+    add_glue(reply, cut.data)
+    return reply
+
+def add_glue(reply, zone):
+    """Add the A records of a domain's nameservers to the additional section"""
+    for ns, ip in zip(zone["NS"], zone["GLUE"]):
+        reply.add_ar(RR(ns, QTYPE.A, rdata=A(ip), ttl=3600))
+
 def resolve_tld_query(domain, qtype):
-    """Resolve queries at the TLD server level"""
-    print(f"🏢 TLD server query: {domain} ({qtype})")
+    """Resolve queries at the TLD server level
+
+    Returns a reply, or None for names that don't exist. Names below a
+    delegated domain (www.google.com.) get a referral to its nameservers.
+    """
+    log.debug("tld_lookup", qname=domain, qtype=qtype)
+    
+    match = TLD_TREE.lookup(domain)
+    if match.kind == DELEGATION:
+        return referral(domain, qtype, match.node)
     
     # Check if we have delegation for this domain
-    if domain in TLD_ZONES:
-        zone = TLD_ZONES[domain]
+    if match.kind == EXACT and match.node.data is not None:
+        zone = match.node.data
         
         if qtype == "NS":
             # Return NS records for domain delegation
             reply = DNSRecord.question(domain, "NS").reply()
             for ns in zone["NS"]:
                 reply.add_answer(RR(domain, QTYPE.NS, rdata=NS(ns), ttl=3600))
+            add_glue(reply, zone)
             return reply
         
         elif qtype == "A":
-            # Return A records for domain
+            # Return A records for domain, rotated
             reply = DNSRecord.question(domain, "A").reply()
-            for ip in zone["A"]:
+            for ip in rotator.order(domain, "A", zone):
                 reply.add_answer(RR(domain, QTYPE.A, rdata=A(ip), ttl=3600))
             return reply
+        
+        return referral(domain, qtype, match.node)
+    
+    if match.kind == EXACT:
+        # A TLD itself, or an empty non-terminal: the name exists, no data
+        return DNSRecord.question(domain, qtype).reply()
     
     return None
 
+def handle_tld_query(data, addr):
+    """Answer one raw query datagram sent to the TLD server"""
+    start = time.perf_counter()
+    query = decode_query(data)
+    
+    qname = query.qname
+    qtype = qtype_name(query.qtype)
+    stage("tld", "parse", start)
+    
+    # Try to resolve the query
+    start = time.perf_counter()
+    response = resolve_tld_query(qname, qtype)
+    stage("tld", "lookup", start)
+    
+    start = time.perf_counter()
+    if response:
+        response.header.id = query.id
+        response = response.pack()
+    else:
+        # No delegation for this name
+        response = empty_reply(data, query, 3, authoritative=True)  # NXDOMAIN
+    stage("tld", "pack", start)
+    
+    log.query("tld", qname, qtype, addr, response)
+    return response
+
 def run_tld_server():
     """Run the TLD DNS server simulator"""
-    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-    sock.bind(("127.0.0.1", 8056))  # Port 8056 for TLD server
+    parser = argparse.ArgumentParser(description="TLD DNS server simulator")
+    parser.add_argument("--rotation", default="wrr", choices=MODES, help="order of multi-address answers: weighted round-robin, weighted shuffle or zone order")
+    parser.add_argument("--batch", type=int, default=0, help="datagrams received and answered per wakeup (0: one at a time)")
+    add_log_arguments(parser)
+    add_capture_arguments(parser)
+    add_profile_arguments(parser)
+    add_metrics_arguments(parser)
+    args = parser.parse_args()
+    configure_log(args)
+    configure_capture(args)
+    configure_profiler(args, "tld")
+    set_mode(args.rotation)
+    start_metrics(args)
+
     print("🏢 TLD DNS Server Simulator running on 127.0.0.1:8056...")
     print("📍 Simulates TLD servers (.com, .org, .net)")
     print("🔗 Knows about specific domains and their authoritative servers")
-    
-    while True:
-        try:
-            data, addr = sock.recvfrom(512)
-            request = DNSRecord.parse(data)
-            
-            qname = str(request.q.qname)
-            qtype = QTYPE[request.q.qtype]
-            
-            print(f"\n📨 TLD Query: {qname} ({qtype}) from {addr}")
-            
-            # Try to resolve the query
-            response = resolve_tld_query(qname, qtype)
-            
-            if response:
-                print(f"✅ TLD server response for {qname}")
-                sock.sendto(response.pack(), addr)
-            else:
-                print(f"❌ No delegation found for {qname}")
-                reply = request.reply()
-                reply.rcode = 3  # NXDOMAIN
-                sock.sendto(reply.pack(), addr)
-            
-        except Exception as e:
-            print(f"Error handling TLD query: {e}")
+    run_udp_server(handle_tld_query, "127.0.0.1", 8056, name="tld", batch=args.batch)  # Port 8056 for TLD server
 
 if __name__ == "__main__":
     run_tld_server()
@@ -0,0 +1,33 @@
+import sys
+import os
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import time
+import argparse
+from zone.zone_loader import load_zones
+from zone.reloader import validate_zones
+from zone.binary_zone import write_binary_zones
+
+def compile_command(args):
+    """Convert a zones.json file into the memory-mapped binary format"""
+    start = time.perf_counter()
+    zones = load_zones(args.source)
+    validate_zones(zones)
+    count = write_binary_zones(zones, args.output)
+    elapsed = time.perf_counter() - start
+    print(f"✅ Compiled {count} names from {args.source} into {args.output} in {elapsed:.2f}s")
+
+def main():
+    parser = argparse.ArgumentParser(prog="python -m zone", description="Zone file tools")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    compile_parser = commands.add_parser("compile", help="compile zones.json to a binary zone file")
+    compile_parser.add_argument("source", nargs="?", default="zone/zones.json")
+    compile_parser.add_argument("output", nargs="?", default="zone/zones.bin")
+    compile_parser.set_defaults(func=compile_command)
+
+    args = parser.parse_args()
+    args.func(args)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,135 @@
+import os
+import mmap
+import struct
+import tempfile
+from zone.compiler import compile_zones
+from zone.rotation import RotatingAnswer
+
+# File layout (all integers big-endian):
+#
+#   header   magic "MZB1", name count (I), names offset (Q), data offset (Q)
+#   index    one fixed-size entry per name, sorted by name:
+#            name offset (Q), name length (H), rrsets offset (Q), rrset count (H)
+#   names    lowercase ASCII owner names, back to back
+#   data     per name, its rrsets: qtype (H), counts (8s), length (I), sections
+#
+# The rrsets are the compiled answers from zone.compiler, so a lookup
+# hands build_response exactly what the in-memory index would.
+MAGIC = b"MZB1"
+HEADER = struct.Struct("!4sIQQ")
+ENTRY = struct.Struct("!QHQH")
+RRSET = struct.Struct("!H8sI")
+
+def write_binary_zones(zones, path):
+    """Compile a zone table into the memory-mappable binary format at path"""
+    names = sorted({qname.lower() for qname in zones})
+    lowered = {}
+    for qname in zones:
+        lowered.setdefault(qname.lower(), qname)
+
+    index_size = ENTRY.size * len(names)
+    names_offset = HEADER.size + index_size
+
+    entries = []
+    name_blob = bytearray()
+    directory = os.path.dirname(os.path.abspath(path))
+
+    # RRsets are streamed to a temporary file so only the names are held
+    # in memory while compiling
+    with tempfile.TemporaryFile(dir=directory) as data:
+        for name in names:
+            compiled = compile_zones(zones, [lowered[name]])
+            # Multi-address answers are stored in zone order (no rotation)
+            rrsets = [(qtype, entry.static if isinstance(entry, RotatingAnswer) else entry)
+                      for (_, qtype), entry in compiled.items()]
+
+            entries.append((len(name_blob), len(name), data.tell(), len(rrsets)))
+            name_blob += name.encode("ascii")
+            for qtype, (counts, sections) in rrsets:
+                data.write(RRSET.pack(qtype, counts, len(sections)))
+                data.write(sections)
+
+        data_offset = names_offset + len(name_blob)
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "wb") as out:
+            out.write(HEADER.pack(MAGIC, len(names), names_offset, data_offset))
+            for name_off, name_len, data_off, count in entries:
+                out.write(ENTRY.pack(names_offset + name_off, name_len, data_offset + data_off, count))
+            out.write(name_blob)
+            data.seek(0)
+            while True:
+                chunk = data.read(1 << 20)
+                if not chunk:
+                    break
+                out.write(chunk)
+
+    # Readers that already mapped the old file keep their (unlinked) copy
+    os.replace(tmp_path, path)
+    return len(names)
+
+class MappedZoneIndex:
+    """Read-only (qname, qtype) -> compiled answer index over an mmap
+
+    Behaves like the dict built by zone.compiler.compile_zones for get()
+    and "in", but only touches the pages of the names that are looked up,
+    and the pages are shared by every process mapping the same file.
+    """
+
+    def __init__(self, path):
+        with open(path, "rb") as file:
+            self.map = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self.count, self.names_offset, self.data_offset = HEADER.unpack_from(self.map)
+        if magic != MAGIC:
+            raise ValueError(f"{path}: not a binary zone file")
+
+    def __len__(self):
+        return self.count
+
+    def __contains__(self, key):
+        return self.get(key) is not None
+
+    def _entry(self, i):
+        return ENTRY.unpack_from(self.map, HEADER.size + i * ENTRY.size)
+
+    def _name(self, name_off, name_len):
+        return self.map[name_off:name_off + name_len]
+
+    def find(self, qname):
+        """Binary search for qname; returns (rrsets offset, count) or None"""
+        target = qname.encode("ascii", "replace")
+        lo, hi = 0, self.count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            name_off, name_len, data_off, rrset_count = self._entry(mid)
+            name = self._name(name_off, name_len)
+            if name < target:
+                lo = mid + 1
+            elif name > target:
+                hi = mid
+            else:
+                return data_off, rrset_count
+        return None
+
+    def get(self, key, default=None):
+        qname, qtype = key
+        found = self.find(qname)
+        if found is None:
+            return default
+
+        offset, rrset_count = found
+        for _ in range(rrset_count):
+            rtype, counts, length = RRSET.unpack_from(self.map, offset)
+            offset += RRSET.size
+            if rtype == qtype:
+                return counts, self.map[offset:offset + length]
+            offset += length
+        return default
+
+    def names(self):
+        """Iterate over every owner name in the file"""
+        for i in range(self.count):
+            name_off, name_len, _, _ = self._entry(i)
+            yield self._name(name_off, name_len).decode("ascii")
+
+    def close(self):
+        self.map.close()
@@ -0,0 +1,215 @@
+import struct
+from dnslib import DNSRecord, DNSBuffer, DNSHeader, DNSLabel, QTYPE, RCODE
+from core.wire import REPLY_FLAGS
+from zone.records import zone_records
+from zone.rotation import RotatingAnswer, address_values, health_target
+
+# Record types the authoritative server knows how to answer
+SUPPORTED_QTYPES = ("A", "AAAA", "CNAME", "NS", "SOA", "TXT", "MX", "PTR", "SRV")
+
+def compile_answer(qname, qtype, answer):
+    """Pack a resolver answer into (counts, sections) wire-format bytes
+
+    The sections are packed behind the question for qname, so name
+    compression pointers stay valid for any client question of the same
+    name (the question always starts at offset 12 and only its case can
+    differ).
+    """
+    if answer is None:
+        answer = []
+    elif not isinstance(answer, list):
+        answer = [answer]
+
+    reply = DNSRecord.question(qname, qtype).reply()
+    for rr in answer:
+        reply.add_answer(rr)
+    packed = reply.pack()
+
+    question = DNSBuffer()
+    reply.q.pack(question)
+    question_end = 12 + len(question.data)
+    counts = struct.pack("!HHHH", 1, len(reply.rr), len(reply.auth), len(reply.ar))
+    return counts, bytes(packed[question_end:])
+
+def compile_rotating(zones, qname, qtype, answer):
+    """Pack an answer with several addresses as a RotatingAnswer
+
+    Returns None (compile it statically) unless the addresses are one
+    run of RRs whose owner names are compression pointers, which is what
+    lets them be reordered without breaking any pointer.
+    """
+    rtype = getattr(QTYPE, qtype)
+    positions = [i for i, rr in enumerate(answer) if rr.rtype == rtype]
+    if len(positions) < 2 or positions != list(range(positions[0], positions[-1] + 1)):
+        return None
+    owner = str(answer[positions[0]].rname)
+    zone = zones.get(owner)
+    if zone is None or qtype not in zone:
+        return None
+
+    # Pack exactly as DNSRecord.pack() would, noting where each RR starts
+    buffer = DNSBuffer()
+    DNSHeader().pack(buffer)
+    DNSRecord.question(qname, qtype).q.pack(buffer)
+    question_end = len(buffer.data)
+    offsets = []
+    for rr in answer:
+        offsets.append(len(buffer.data))
+        rr.pack(buffer)
+    offsets.append(len(buffer.data))
+    data = bytes(buffer.data)
+
+    first, last = positions[0], positions[-1] + 1
+    members = [data[offsets[i]:offsets[i + 1]] for i in range(first, last)]
+    if any(member[0] & 0xC0 != 0xC0 for member in members):
+        return None
+
+    values = address_values(zone[qtype])
+    counts = struct.pack("!HHHH", 1, len(answer), 0, 0)
+    return RotatingAnswer(
+        counts,
+        data[question_end:offsets[first]],
+        members,
+        data[offsets[last]:],
+        [weight for _, weight in values],
+        [health_target(zone, address) for address, _ in values],
+    )
+
+def compile_zones(zones, names=None):
+    """Turn a zone table into a (qname, qtype) -> prepacked answer index
+
+    Every name is resolved for every supported type once, here, instead of
+    on each query. Pass names to compile only part of the table.
+    """
+    index = {}
+    for qname in zones if names is None else names:
+        if qname not in zones:
+            continue
+        for qtype in SUPPORTED_QTYPES:
+            answer = zone_records(zones, qname, qtype)
+            if answer:
+                entry = None
+                if qtype in ("A", "AAAA") and isinstance(answer, list):
+                    # Several addresses: rotated per query (zone.rotation)
+                    entry = compile_rotating(zones, qname, qtype, answer)
+                index[(qname.lower(), QTYPE.reverse[qtype])] = entry or compile_answer(qname, qtype, answer)
+    return index
+
+def affected_names(old_zones, new_zones, names):
+    """Names whose compiled answers depend on any of names
+
+    Besides the names themselves, that is every name that CNAMEs to one of
+    them (in either version of the table), since A answers follow CNAMEs.
+    """
+    affected = set(names)
+    for table in (old_zones, new_zones):
+        for qname, zone in table.items():
+            if zone.get("CNAME") in names:
+                affected.add(qname)
+    return affected
+
+def update_index(index, old_zones, new_zones, names):
+    """Return a copy of index with only the entries for names recompiled"""
+    affected = affected_names(old_zones, new_zones, names)
+    lowered = {qname.lower() for qname in affected}
+    updated = {key: entry for key, entry in index.items() if key[0] not in lowered}
+    updated.update(compile_zones(new_zones, affected))
+    return updated
+
+class _QuestionBuffer(DNSBuffer):
+    """Packs names uncompressed, except owner, which points at the question
+
+    Sections packed this way don't depend on the question's length, so
+    one compiled entry serves every name a wildcard matches.
+    """
+
+    def __init__(self, owner=None):
+        super().__init__()
+        self.owner = DNSLabel(owner) if owner else None
+
+    def encode_name(self, name):
+        if not isinstance(name, DNSLabel):
+            name = DNSLabel(name)
+        if name == self.owner:
+            self.pack("!H", 0xC000 | 12)
+        else:
+            self.encode_name_nocompress(name)
+
+def compile_sections(answer=(), authority=(), additional=(), owner=None):
+    """Pack RRs into (counts, sections) usable behind any question
+
+    Records owned by owner (e.g. "*.example.") are written with the
+    question's name instead, which is how wildcard answers are synthesized.
+    """
+    buffer = _QuestionBuffer(owner)
+    for rr in list(answer) + list(authority) + list(additional):
+        rr.pack(buffer)
+    counts = struct.pack("!HHHH", 1, len(answer), len(authority), len(additional))
+    return counts, bytes(buffer.data)
+
+def negative_answer(zones, apex, rcode):
+    """(counts, sections, rcode) for NXDOMAIN/NODATA, with the zone's SOA (RFC 2308)"""
+    authority = zone_records(zones, apex, "SOA") if apex in zones else None
+    return compile_sections(authority=[authority] if authority else []) + (rcode,)
+
+def referral_answer(zones, cut):
+    """(counts, sections, rcode) sending the client to a zone cut's nameservers"""
+    nameservers = zone_records(zones, cut, "NS") or []
+    if not isinstance(nameservers, list):
+        nameservers = [nameservers]
+    glue = []
+    for rr in nameservers:
+        nameserver = str(rr.rdata)
+        for rtype in ("A", "AAAA"):
+            if rtype in zones.get(nameserver, {}):
+                addresses = zone_records(zones, nameserver, rtype)
+                glue.extend(addresses if isinstance(addresses, list) else [addresses])
+    return compile_sections(authority=nameservers, additional=glue) + (RCODE.NOERROR,)
+
+def wildcard_answers(zones, wildcard):
+    """qtype -> compiled answer for a *. name, owned by whatever name matches it"""
+    answers = {}
+    for qtype in SUPPORTED_QTYPES:
+        answer = zone_records(zones, wildcard, qtype)
+        if answer:
+            answer = answer if isinstance(answer, list) else [answer]
+            answers[QTYPE.reverse[qtype]] = compile_sections(answer, owner=wildcard)
+    return answers
+
+# Reply body for names/types we have no data for: NOERROR, no answers
+EMPTY_ANSWER = (struct.pack("!HHHH", 1, 0, 0, 0), b"")
+
+def compile_tree_answers(zones, tree):
+    """Answers found through a ZoneTree rather than by exact name
+
+    Keys are ("nxdomain" | "nodata", apex or None), ("referral", cut) and
+    ("wildcard", *.name); wildcard values map qtype -> compiled answer.
+    """
+    lowered = {}
+    for name in zones:
+        lowered.setdefault(name.lower(), name)
+
+    answers = {
+        ("nxdomain", None): EMPTY_ANSWER + (RCODE.NXDOMAIN,),
+        ("nodata", None): EMPTY_ANSWER,
+    }
+    for apex in tree.apexes:
+        answers[("nxdomain", apex)] = negative_answer(zones, lowered.get(apex, apex), RCODE.NXDOMAIN)
+        answers[("nodata", apex)] = negative_answer(zones, lowered.get(apex, apex), RCODE.NOERROR)
+    for cut in tree.cuts:
+        answers[("referral", cut)] = referral_answer(zones, lowered.get(cut, cut))
+    for wildcard in tree.wildcards:
+        answers[("wildcard", wildcard)] = wildcard_answers(zones, lowered.get(wildcard, wildcard))
+    return answers
+
+def build_response(data, question_end, entry):
+    """Patch the request's ID, flags and question into a compiled answer
+
+    entry is (counts, sections) or, for non-NOERROR answers, (counts,
+    sections, rcode).
+    """
+    counts, sections = entry[0], entry[1]
+    flags = (data[2] << 8 | data[3]) | REPLY_FLAGS
+    if len(entry) > 2:
+        flags = (flags & ~0x000F) | entry[2]
+    return data[:2] + struct.pack("!H", flags) + counts + data[12:question_end] + sections
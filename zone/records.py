@@ -0,0 +1,96 @@
+from dnslib import QTYPE, RR, A, AAAA, CNAME, NS, SOA, TXT, MX, PTR, SRV
+from zone.rotation import address_values
+
+ADDRESS_RDATA = {"A": A, "AAAA": AAAA}
+
+def address_records(qname, rtype, zone):
+    """One RR per address in an A/AAAA value (a single RR for a plain string)"""
+    rdata = ADDRESS_RDATA[rtype]
+    ttl = zone.get("TTL", 300)
+    records = [RR(qname, getattr(QTYPE, rtype), rdata=rdata(address), ttl=ttl)
+               for address, _ in address_values(zone[rtype])]
+    return records if isinstance(zone[rtype], list) else records[0]
+
+def zone_records(table, qname, qtype):
+    """Build the answer RRs for qname/qtype from a zone table
+
+    Returns a single RR, a list of RRs, or None when there is no data.
+    """
+    if qname in table:
+        zone = table[qname]
+
+        # Direct A/AAAA match
+        if qtype in ("A", "AAAA"):
+            if qtype in zone:
+                return address_records(qname, qtype, zone)
+
+            # CNAME fallback
+            elif "CNAME" in zone:
+                cname = zone["CNAME"]
+                cname_rr = RR(qname, QTYPE.CNAME, rdata=CNAME(cname), ttl=zone.get("TTL", 300))
+
+                if cname in table and qtype in table[cname]:
+                    target = address_records(cname, qtype, table[cname])
+                    return [cname_rr] + (target if isinstance(target, list) else [target])
+                else:
+                    return cname_rr
+
+        # Explicit CNAME query
+        elif qtype == "CNAME" and "CNAME" in zone:
+            cname = zone["CNAME"]
+            return RR(qname, QTYPE.CNAME, rdata=CNAME(cname), ttl=zone.get("TTL", 300))
+
+        # NS (Name Server) records
+        elif qtype == "NS" and "NS" in zone:
+            ns_servers = zone["NS"]
+            if isinstance(ns_servers, list):
+                return [RR(qname, QTYPE.NS, rdata=NS(ns), ttl=zone.get("TTL", 300)) for ns in ns_servers]
+            else:
+                return RR(qname, QTYPE.NS, rdata=NS(ns_servers), ttl=zone.get("TTL", 300))
+
+        # SOA (Start of Authority) records
+        elif qtype == "SOA" and "SOA" in zone:
+            soa_data = zone["SOA"]
+            soa_rr = RR(qname, QTYPE.SOA, rdata=SOA(
+                mname=soa_data["mname"],
+                rname=soa_data["rname"],
+                times=(
+                    soa_data["serial"],
+                    soa_data["refresh"],
+                    soa_data["retry"],
+                    soa_data["expire"],
+                    soa_data["minimum"]
+                )
+            ), ttl=zone.get("TTL", 300))
+            return soa_rr
+
+        # TXT records
+        elif qtype == "TXT" and "TXT" in zone:
+            txt_data = zone["TXT"]
+            if isinstance(txt_data, list):
+                return [RR(qname, QTYPE.TXT, rdata=TXT(txt), ttl=zone.get("TTL", 300)) for txt in txt_data]
+            else:
+                return RR(qname, QTYPE.TXT, rdata=TXT(txt_data), ttl=zone.get("TTL", 300))
+
+        # MX (Mail Exchange) records
+        elif qtype == "MX" and "MX" in zone:
+            mx_records = zone["MX"]
+            if isinstance(mx_records, list):
+                return [RR(qname, QTYPE.MX, rdata=MX(mx["exchange"], mx["priority"]), ttl=zone.get("TTL", 300)) for mx in mx_records]
+            else:
+                return RR(qname, QTYPE.MX, rdata=MX(mx_records["exchange"], mx_records["priority"]), ttl=zone.get("TTL", 300))
+
+        # PTR (Pointer) records for reverse DNS
+        elif qtype == "PTR" and "PTR" in zone:
+            ptr_target = zone["PTR"]
+            return RR(qname, QTYPE.PTR, rdata=PTR(ptr_target), ttl=zone.get("TTL", 300))
+
+        # SRV (Service) records for service discovery
+        elif qtype == "SRV" and "SRV" in zone:
+            srv_records = zone["SRV"]
+            if isinstance(srv_records, list):
+                return [RR(qname, QTYPE.SRV, rdata=SRV(srv["priority"], srv["weight"], srv["port"], srv["target"]), ttl=zone.get("TTL", 300)) for srv in srv_records]
+            else:
+                return RR(qname, QTYPE.SRV, rdata=SRV(srv_records["priority"], srv_records["weight"], srv_records["port"], srv_records["target"]), ttl=zone.get("TTL", 300))
+
+    return None
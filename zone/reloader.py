@@ -0,0 +1,167 @@
+import os
+import signal
+import ipaddress
+import threading
+from zone.zone_loader import load_zones
+
+def _is_name(value):
+    return isinstance(value, str) and value.endswith(".")
+
+def _check_list(name, rtype, value, check):
+    values = value if isinstance(value, list) else [value]
+    for item in values:
+        if not check(item):
+            raise ValueError(f"{name}: invalid {rtype} record {item!r}")
+
+def _is_ipv4(value):
+    try:
+        ipaddress.IPv4Address(value)
+        return True
+    except (ipaddress.AddressValueError, ValueError, TypeError):
+        return False
+
+def _is_ipv6(value):
+    try:
+        ipaddress.IPv6Address(value)
+        return True
+    except (ipaddress.AddressValueError, ValueError, TypeError):
+        return False
+
+def _is_address(check):
+    # "ip" or {"address": "ip", "weight": n}
+    def is_address(value):
+        if isinstance(value, dict):
+            weight = value.get("weight", 1)
+            return check(value.get("address")) and isinstance(weight, int) and weight > 0
+        return check(value)
+    return is_address
+
+def _is_health_check(value):
+    return (isinstance(value, dict) and value.get("check", "tcp") in ("tcp", "http")
+            and isinstance(value.get("port"), int) and 0 < value["port"] < 65536
+            and isinstance(value.get("path", "/"), str))
+
+def _has_ints(value, keys):
+    return isinstance(value, dict) and all(isinstance(value.get(key), int) for key in keys)
+
+# How each record type in zones.json is validated
+RECORD_CHECKS = {
+    "A": _is_address(_is_ipv4),
+    "AAAA": _is_address(_is_ipv6),
+    "CNAME": _is_name,
+    "NS": _is_name,
+    "PTR": _is_name,
+    "TXT": lambda value: isinstance(value, str),
+    "MX": lambda value: _has_ints(value, ("priority",)) and _is_name(value.get("exchange")),
+    "SRV": lambda value: _has_ints(value, ("priority", "weight", "port")) and _is_name(value.get("target")),
+    "SOA": lambda value: _has_ints(value, ("serial", "refresh", "retry", "expire", "minimum"))
+        and _is_name(value.get("mname")) and _is_name(value.get("rname")),
+}
+
+def validate_zones(zones):
+    """Raise ValueError if a zone table is not something the servers can load"""
+    if not isinstance(zones, dict):
+        raise ValueError("zone file must contain an object of names")
+
+    for name, zone in zones.items():
+        if not _is_name(name):
+            raise ValueError(f"{name!r}: names must be fully qualified (end with '.')")
+        if not isinstance(zone, dict):
+            raise ValueError(f"{name}: records must be an object")
+
+        for rtype, value in zone.items():
+            if rtype == "TTL":
+                if not isinstance(value, int) or value < 0:
+                    raise ValueError(f"{name}: invalid TTL {value!r}")
+            elif rtype == "HEALTH":
+                if not _is_health_check(value):
+                    raise ValueError(f"{name}: invalid HEALTH check {value!r}")
+            elif rtype in RECORD_CHECKS:
+                _check_list(name, rtype, value, RECORD_CHECKS[rtype])
+            else:
+                raise ValueError(f"{name}: unknown record type {rtype}")
+
+def diff_zones(old, new):
+    """Return the names that were added, removed or changed between tables"""
+    old_names = set(old)
+    new_names = set(new)
+    changed = {name for name in old_names & new_names if old[name] != new[name]}
+    return {
+        "added": new_names - old_names,
+        "removed": old_names - new_names,
+        "changed": changed,
+    }
+
+def changed_names(diff):
+    """All names touched by a diff"""
+    return diff["added"] | diff["removed"] | diff["changed"]
+
+class ZoneReloader:
+    """Watch a zones file and hand validated new versions to a callback
+
+    Reloads happen in a background thread, either when the file's mtime
+    changes (polled every interval seconds) or on SIGHUP. The callback is
+    called as on_reload(new_zones, diff) and should swap its live table.
+    With loop given, the callback runs in that event loop's thread instead
+    (for state only the loop may touch, like a resolver's cache).
+    """
+
+    def __init__(self, path, zones, on_reload, interval=2.0, loop=None):
+        self.path = path
+        self.zones = zones
+        self.on_reload = on_reload
+        self.interval = interval
+        self.loop = loop
+        self.mtime = self._mtime()
+        self.wakeup = threading.Event()
+        self.thread = None
+
+    def start(self):
+        """Start watching; call from the main thread so SIGHUP can be hooked"""
+        if threading.current_thread() is threading.main_thread() and hasattr(signal, "SIGHUP"):
+            signal.signal(signal.SIGHUP, lambda signum, frame: self.trigger())
+        self.thread = threading.Thread(target=self._watch, name="zone-reloader", daemon=True)
+        self.thread.start()
+        return self
+
+    def trigger(self):
+        """Ask the watcher thread to reload now"""
+        self.wakeup.set()
+
+    def reload(self):
+        """Load, validate and diff the zones file; returns the diff or None"""
+        try:
+            new_zones = load_zones(self.path)
+            validate_zones(new_zones)
+        except (OSError, ValueError) as e:
+            print(f"❌ Zone reload failed, keeping current zones: {e}")
+            return None
+
+        diff = diff_zones(self.zones, new_zones)
+        if not changed_names(diff):
+            return diff
+
+        if self.loop is not None:
+            self.loop.call_soon_threadsafe(self.on_reload, new_zones, diff)
+        else:
+            self.on_reload(new_zones, diff)
+        self.zones = new_zones
+        print(f"🔄 Zones reloaded: {len(diff['added'])} added, "
+              f"{len(diff['removed'])} removed, {len(diff['changed'])} changed")
+        return diff
+
+    def _mtime(self):
+        try:
+            return os.stat(self.path).st_mtime_ns
+        except OSError:
+            return None
+
+    def _watch(self):
+        while True:
+            forced = self.wakeup.wait(self.interval or None)
+            self.wakeup.clear()
+
+            mtime = self._mtime()
+            if forced or mtime != self.mtime:
+                self.mtime = mtime
+                self.reload()
@@ -0,0 +1,142 @@
+import random
+import struct
+import ipaddress
+from core.health import health
+
+# How answers with several addresses are ordered
+WRR = "wrr"          # smooth weighted round-robin: the first address follows the weights
+SHUFFLE = "shuffle"  # weighted random order on every query
+FIXED = "fixed"      # zone file order
+MODES = (WRR, SHUFFLE, FIXED)
+
+MODE = WRR
+
+def set_mode(mode):
+    """Pick the rotation used from now on (--rotation)"""
+    global MODE
+    if mode not in MODES:
+        raise ValueError(f"unknown rotation {mode!r}")
+    MODE = mode
+
+def address_values(value):
+    """[(address, weight)] from an A/AAAA value
+
+    Accepts "ip", ["ip", ...] or [{"address": "ip", "weight": n}, ...]
+    (entries can be mixed; weight defaults to 1).
+    """
+    values = value if isinstance(value, list) else [value]
+    return [
+        (item["address"], item.get("weight", 1)) if isinstance(item, dict) else (item, 1)
+        for item in values
+    ]
+
+def health_target(zone, address):
+    """The HealthChecker target for one of a name's addresses, or None if unchecked"""
+    check = zone.get("HEALTH")
+    if not check:
+        return None
+    return (ipaddress.ip_address(address).compressed, check.get("check", "tcp"), check["port"], check.get("path", "/"))
+
+def health_targets(zones):
+    """Every target the zones ask to be health checked"""
+    targets = set()
+    for zone in zones.values():
+        if "HEALTH" not in zone:
+            continue
+        for rtype in ("A", "AAAA"):
+            for address, _ in address_values(zone.get(rtype, [])):
+                targets.add(health_target(zone, address))
+    return targets
+
+class Rotation:
+    """Orders the members of one RRset on every query"""
+
+    __slots__ = ("weights", "current")
+
+    def __init__(self, weights):
+        self.weights = list(weights)
+        self.current = [0] * len(self.weights)
+
+    def order(self, up, mode=None):
+        """Return the member indexes in up, in the order to answer them"""
+        mode = mode or MODE
+        if mode == FIXED or len(up) < 2:
+            return up
+        if mode == SHUFFLE:
+            # Weighted random permutation (Efraimidis-Spirakis keys)
+            return sorted(up, key=lambda i: random.random() ** (1.0 / self.weights[i]), reverse=True)
+
+        # Smooth weighted round-robin (as in nginx): weight 3 vs 1 leads
+        # with the first member 3 times out of 4, interleaved
+        current, weights = self.current, self.weights
+        total = 0
+        best = up[0]
+        for i in up:
+            current[i] += weights[i]
+            total += weights[i]
+            if current[i] > current[best]:
+                best = i
+        current[best] -= total
+        k = up.index(best)
+        return up[k:] + up[:k]
+
+def up_members(targets):
+    """Indexes of the members whose health target isn't down (all of them if every one is)"""
+    down = health.down
+    if not down:
+        return list(range(len(targets)))
+    up = [i for i, target in enumerate(targets) if target not in down]
+    # With every address down, answering with all of them beats answering nothing
+    return up or list(range(len(targets)))
+
+class RotatingAnswer:
+    """A compiled answer whose address RRset is filtered and reordered per query
+
+    The sections are kept as head (e.g. a CNAME), one packed RR per
+    address, and tail. Every member's owner name is a compression pointer
+    to something in the head or question, so members can be emitted in
+    any order. static is the plain (counts, sections) entry, in zone file
+    order.
+    """
+
+    __slots__ = ("counts", "head", "members", "tail", "targets", "rotation", "static")
+
+    def __init__(self, counts, head, members, tail, weights, targets):
+        self.counts = counts
+        self.head = head
+        self.members = members
+        self.tail = tail
+        self.targets = targets
+        self.rotation = Rotation(weights)
+        self.static = (counts, head + b"".join(members) + tail)
+
+    def answer(self):
+        """(counts, sections) for the next query"""
+        up = up_members(self.targets)
+        order = self.rotation.order(up)
+        counts = self.counts
+        if len(up) != len(self.members):
+            qd, an, ns, ar = struct.unpack("!HHHH", counts)
+            counts = struct.pack("!HHHH", qd, an - (len(self.members) - len(up)), ns, ar)
+        members = self.members
+        return counts, self.head + b"".join([members[i] for i in order]) + self.tail
+
+class AddressRotator:
+    """Rotation state for servers that build answers from zone data directly
+
+    order() returns a name's addresses in answer order; the state is
+    reset whenever the addresses in the zone data change.
+    """
+
+    def __init__(self):
+        self.rotations = {}
+
+    def order(self, name, rtype, zone):
+        values = address_values(zone[rtype])
+        key = (name, rtype)
+        state = self.rotations.get(key)
+        if state is None or state[0] != values:
+            targets = [health_target(zone, address) for address, _ in values]
+            state = self.rotations[key] = (values, targets, Rotation([weight for _, weight in values]))
+        values, targets, rotation = state
+        return [values[i][0] for i in rotation.order(up_members(targets))]
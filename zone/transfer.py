@@ -0,0 +1,569 @@
+import json
+import time
+import socket
+import struct
+import threading
+import ipaddress
+import socketserver
+from dnslib import DNSRecord, DNSHeader, DNSQuestion, DNSBuffer, QTYPE, OPCODE, RCODE, RR, RD, SOA
+from zone.records import zone_records
+from zone.rotation import address_values
+from core.querylog import log
+
+# Private-use RR type carrying what zones.json knows about a name but DNS
+# doesn't (address weights, HEALTH), so secondaries answer exactly like
+# their primary
+META_TYPE = 65280
+
+# Order in which a name's record types are written back into zones.json form
+ENTRY_TYPES = ("A", "AAAA", "CNAME", "NS", "SOA", "MX", "TXT", "SRV", "PTR")
+
+# RRs per message in an AXFR/IXFR response
+RRS_PER_MESSAGE = 200
+
+def entry_records(name, entry):
+    """The RRs for one zones.json entry (no CNAME chasing)"""
+    records = []
+    for rtype in ENTRY_TYPES:
+        if rtype in entry:
+            answer = zone_records({name: entry}, name, rtype)
+            records.extend(answer if isinstance(answer, list) else [answer])
+
+    meta = {}
+    weights = {rtype: [weight for _, weight in address_values(entry[rtype])]
+               for rtype in ("A", "AAAA") if rtype in entry}
+    weights = {rtype: values for rtype, values in weights.items() if any(weight != 1 for weight in values)}
+    if weights:
+        meta["weights"] = weights
+    if "HEALTH" in entry:
+        meta["HEALTH"] = entry["HEALTH"]
+    if meta:
+        data = json.dumps(meta, sort_keys=True).encode()
+        records.append(RR(name, META_TYPE, rdata=RD(data), ttl=entry.get("TTL", 300)))
+    return records
+
+def records_entry(records):
+    """Turn one name's RRs back into a zones.json entry"""
+    values = {}
+    meta = {}
+    for rr in records:
+        rtype = QTYPE.get(rr.rtype, rr.rtype)
+        rdata = rr.rdata
+        if rr.rtype == META_TYPE:
+            meta = json.loads(bytes(rdata.data))
+            continue
+        if rtype in ("A", "AAAA"):
+            value = str(rdata)
+        elif rtype in ("CNAME", "NS", "PTR"):
+            value = str(rdata.label)
+        elif rtype == "TXT":
+            value = b"".join(rdata.data).decode()
+        elif rtype == "MX":
+            value = {"priority": rdata.preference, "exchange": str(rdata.label)}
+        elif rtype == "SRV":
+            value = {"priority": rdata.priority, "weight": rdata.weight, "port": rdata.port, "target": str(rdata.target)}
+        elif rtype == "SOA":
+            serial, refresh, retry, expire, minimum = rdata.times
+            value = {"mname": str(rdata.mname), "rname": str(rdata.rname), "serial": serial,
+                     "refresh": refresh, "retry": retry, "expire": expire, "minimum": minimum}
+        else:
+            continue
+        values.setdefault(rtype, []).append(value)
+
+    entry = {}
+    for rtype in ENTRY_TYPES:
+        if rtype not in values:
+            continue
+        value = values[rtype]
+        weights = meta.get("weights", {}).get(rtype)
+        if weights and len(weights) == len(value):
+            value = [{"address": address, "weight": weight} for address, weight in zip(value, weights)]
+        # Single values stay scalars, like in a hand-written zones.json
+        entry[rtype] = value if len(value) > 1 or rtype in ("A", "AAAA") and weights else value[0]
+    if "HEALTH" in meta:
+        entry["HEALTH"] = meta["HEALTH"]
+    if records:
+        entry["TTL"] = records[0].ttl
+    return entry
+
+def rr_key(rr):
+    """Identity of an RR for diffing two versions of a zone"""
+    buffer = DNSBuffer()
+    rr.rdata.pack(buffer)
+    return (str(rr.rname).lower(), rr.rtype, rr.ttl, bytes(buffer.data))
+
+def soa_serial(rr):
+    return rr.rdata.times[0]
+
+def zone_apexes(table):
+    """Names with an SOA: the zones a table holds"""
+    return {name.lower(): name for name, entry in table.items() if "SOA" in entry}
+
+def zone_names(table, apex):
+    """Names that belong to apex: at or below it, but not inside a deeper zone"""
+    apex = apex.lower()
+    apexes = set(zone_apexes(table))
+    names = []
+    for name in table:
+        lowered = name.lower()
+        if lowered != apex and not lowered.endswith("." + apex):
+            continue
+        # The closest enclosing apex must be this one
+        labels = lowered.split(".")
+        closest = next((".".join(labels[i:]) for i in range(len(labels)) if ".".join(labels[i:]) in apexes), None)
+        if closest == apex:
+            names.append(name)
+    return names
+
+class ZoneVersion:
+    """One serial of a zone: its SOA and every RR, keyed by rr_key()"""
+
+    def __init__(self, soa, records):
+        self.soa = soa
+        self.serial = soa_serial(soa)
+        self.records = records
+
+    @classmethod
+    def from_table(cls, table, apex):
+        apex_name = zone_apexes(table)[apex.lower()]
+        soa = None
+        records = {}
+        for name in zone_names(table, apex):
+            for rr in entry_records(name, table[name]):
+                if rr.rtype == QTYPE.SOA and name == apex_name:
+                    soa = rr
+                else:
+                    records[rr_key(rr)] = rr
+        return cls(soa, records)
+
+    def axfr(self):
+        """SOA, every other RR, SOA (RFC 5936)"""
+        return [self.soa] + list(self.records.values()) + [self.soa]
+
+class ZonePrimary:
+    """Serves AXFR/IXFR for the zones in a table and NOTIFYs secondaries of new serials
+
+    update() is called with every new version of the table; for each zone
+    whose SOA serial went up it records what changed (the journal IXFR is
+    served from, up to journal_size versions back) and sends NOTIFY to
+    every notify target.
+    """
+
+    def __init__(self, table, notify=(), allow=("127.0.0.0/8", "::1/128"), journal_size=100):
+        self.notify_targets = list(notify)
+        self.allow = [ipaddress.ip_network(network) for network in allow]
+        self.journal_size = journal_size
+        self.lock = threading.Lock()
+        self.versions = {}
+        # apex -> [(old ZoneVersion, new ZoneVersion, removed RRs, added RRs)]
+        self.journals = {}
+
+        # Counters
+        self.axfrs = 0
+        self.ixfrs = 0
+        self.refused = 0
+        self.notifies = 0
+
+        self.update(table, notify=False)
+
+    def update(self, table, notify=True):
+        """Take a new version of the table, journaling and announcing changed zones"""
+        changed = []
+        with self.lock:
+            apexes = zone_apexes(table)
+            for apex in list(self.versions):
+                if apex not in apexes:
+                    del self.versions[apex]
+                    self.journals.pop(apex, None)
+
+            for apex in apexes:
+                new = ZoneVersion.from_table(table, apex)
+                old = self.versions.get(apex)
+                self.versions[apex] = new
+                if old is None:
+                    changed.append(new)
+                    continue
+                if new.serial == old.serial:
+                    if new.records.keys() != old.records.keys():
+                        log.warning("zone_changed_without_serial", zone=apex, serial=new.serial)
+                    continue
+
+                journal = self.journals.setdefault(apex, [])
+                if new.serial < old.serial:
+                    # Went backwards: old deltas no longer lead here
+                    journal.clear()
+                else:
+                    removed = [rr for key, rr in old.records.items() if key not in new.records]
+                    added = [rr for key, rr in new.records.items() if key not in old.records]
+                    journal.append((old, new, removed, added))
+                    del journal[:-self.journal_size]
+                changed.append(new)
+
+        if notify:
+            for version in changed:
+                self.notify(version.soa)
+        return changed
+
+    def notify(self, soa):
+        """Send NOTIFY for a zone to every target, from a background thread"""
+        for target in self.notify_targets:
+            self.notifies += 1
+            threading.Thread(target=send_notify, args=(target, soa), name="notify", daemon=True).start()
+
+    def allowed(self, address):
+        try:
+            address = ipaddress.ip_address(address)
+        except ValueError:
+            return False
+        return any(address in network for network in self.allow)
+
+    def transfer(self, request, client):
+        """Response messages for an AXFR/IXFR request (a parsed DNSRecord)"""
+        apex = str(request.q.qname).lower()
+        version = self.versions.get(apex)
+        if version is None or not self.allowed(client):
+            self.refused += 1
+            reply = request.reply()
+            reply.header.rcode = RCODE.REFUSED if version is not None else RCODE.NOTAUTH
+            return [reply.pack()]
+
+        records = None
+        if request.q.qtype == QTYPE.IXFR:
+            client_serial = next((soa_serial(rr) for rr in request.auth if rr.rtype == QTYPE.SOA), None)
+            records = self.incremental(apex, version, client_serial)
+        if records is None:
+            self.axfrs += 1
+            records = version.axfr()
+        else:
+            self.ixfrs += 1
+        log.info("zone_transfer", zone=apex, client=client, qtype=QTYPE.get(request.q.qtype),
+                 serial=version.serial, records=len(records))
+
+        messages = []
+        for start in range(0, len(records), RRS_PER_MESSAGE):
+            reply = request.reply()
+            for rr in records[start:start + RRS_PER_MESSAGE]:
+                reply.add_answer(rr)
+            messages.append(reply.pack())
+        return messages
+
+    def incremental(self, apex, version, client_serial):
+        """IXFR records from client_serial (RFC 1995), or None if the journal can't bridge it"""
+        if client_serial is None:
+            return None
+        if client_serial == version.serial:
+            # Up to date: the current SOA alone
+            return [version.soa]
+        journal = self.journals.get(apex, [])
+        start = next((i for i, (old, _, _, _) in enumerate(journal) if old.serial == client_serial), None)
+        if start is None or journal[-1][1].serial != version.serial:
+            return None
+        records = [version.soa]
+        for old, new, removed, added in journal[start:]:
+            records += [old.soa] + removed + [new.soa] + added
+        return records + [version.soa]
+
+    def serve(self, host, port, handler=None):
+        """Serve transfers (and, through handler(data, addr), plain queries) over TCP"""
+        server_class = _TCPServer6 if ":" in host else _TCPServer
+        server = server_class((host, port), _TCPHandler)
+        server.primary = self
+        server.handler = handler
+        threading.Thread(target=server.serve_forever, name="zone-transfer", daemon=True).start()
+        return server
+
+    def answer_tcp(self, data, client, handler):
+        try:
+            request = DNSRecord.parse(data)
+        except Exception:
+            return []
+        if request.header.opcode == OPCODE.QUERY and request.q.qtype in (QTYPE.AXFR, QTYPE.IXFR):
+            return self.transfer(request, client[0])
+        if handler is None:
+            return []
+        response = handler(data, client)
+        return [response] if response else []
+
+    def stats(self):
+        """Return transfer counters"""
+        return {
+            "zones": len(self.versions),
+            "axfrs": self.axfrs,
+            "ixfrs": self.ixfrs,
+            "refused": self.refused,
+            "notifies": self.notifies,
+        }
+
+class _TCPServer(socketserver.ThreadingTCPServer):
+    allow_reuse_address = True
+    daemon_threads = True
+
+class _TCPServer6(_TCPServer):
+    address_family = socket.AF_INET6
+
+class _TCPHandler(socketserver.BaseRequestHandler):
+    """One TCP connection: length-prefixed queries in, length-prefixed responses out"""
+
+    def handle(self):
+        self.request.settimeout(30)
+        while True:
+            try:
+                data = recv_message(self.request)
+            except (OSError, EOFError):
+                return
+            for response in self.server.primary.answer_tcp(data, self.client_address, self.server.handler):
+                self.request.sendall(struct.pack("!H", len(response)) + response)
+
+def send_notify(target, soa, attempts=3, timeout=1.0):
+    """Send NOTIFY for soa's zone to target (host, port) until it is acknowledged"""
+    request = DNSRecord(DNSHeader(opcode=OPCODE.NOTIFY, aa=1), q=DNSQuestion(soa.rname, QTYPE.SOA))
+    request.add_answer(soa)
+    packet = request.pack()
+    with socket.socket(socket.AF_INET6 if ":" in target[0] else socket.AF_INET, socket.SOCK_DGRAM) as sock:
+        sock.settimeout(timeout)
+        for _ in range(attempts):
+            try:
+                sock.sendto(packet, target)
+                while True:
+                    data, _ = sock.recvfrom(4096)
+                    if data[:2] == packet[:2] and data[2] & 0x80:
+                        log.info("notify_sent", zone=str(soa.rname), target=f"{target[0]}:{target[1]}", serial=soa_serial(soa))
+                        return True
+            except OSError:
+                continue
+    log.warning("notify_failed", zone=str(soa.rname), target=f"{target[0]}:{target[1]}", serial=soa_serial(soa))
+    return False
+
+def recv_exact(sock, size):
+    data = b""
+    while len(data) < size:
+        chunk = sock.recv(size - len(data))
+        if not chunk:
+            raise EOFError("connection closed")
+        data += chunk
+    return data
+
+def recv_message(sock):
+    """Read one length-prefixed DNS message from a TCP socket"""
+    size, = struct.unpack("!H", recv_exact(sock, 2))
+    return recv_exact(sock, size)
+
+def request_transfer(primary, apex, serial=None, timeout=5.0):
+    """Fetch a zone from primary (host, port) over TCP
+
+    With serial, asks for IXFR from it. Returns ("current", soa, []),
+    ("ixfr", soa, [(old_soa, removed, new_soa, added), ...]) or
+    ("axfr", soa, records); raises OSError/ValueError on failure.
+    """
+    qtype = QTYPE.IXFR if serial is not None else QTYPE.AXFR
+    request = DNSRecord(DNSHeader(), q=DNSQuestion(apex, qtype))
+    if serial is not None:
+        request.add_auth(RR(apex, QTYPE.SOA, rdata=SOA(".", ".", (serial, 0, 0, 0, 0))))
+    packet = request.pack()
+
+    records = []
+    with socket.create_connection(primary, timeout=timeout) as sock:
+        sock.sendall(struct.pack("!H", len(packet)) + packet)
+        while True:
+            response = DNSRecord.parse(recv_message(sock))
+            if response.header.id != request.header.id:
+                continue
+            if response.header.rcode != RCODE.NOERROR:
+                raise ValueError(f"{apex} transfer refused: {RCODE.get(response.header.rcode)}")
+            records += response.rr
+            result = parse_transfer(records, serial, incremental=serial is not None)
+            if result is not None:
+                return result
+
+def parse_transfer(records, serial, incremental=True):
+    """Interpret the records received so far; None until the transfer is complete"""
+    if not records or records[0].rtype != QTYPE.SOA:
+        raise ValueError("transfer does not start with an SOA")
+    soa = records[0]
+    latest = soa_serial(soa)
+    if len(records) == 1:
+        return ("current", soa, []) if incremental and latest == serial else None
+
+    if not incremental or records[1].rtype != QTYPE.SOA:
+        # AXFR-style: SOA, records..., SOA
+        last = records[-1]
+        if last.rtype == QTYPE.SOA and soa_serial(last) == latest:
+            return "axfr", soa, records[1:-1]
+        return None
+
+    # Incremental: (old SOA, removed..., new SOA, added...)*, final SOA
+    deltas = []
+    i = 1
+    while i < len(records):
+        old = records[i]
+        if soa_serial(old) == latest:
+            return ("ixfr", soa, deltas) if i == len(records) - 1 else None
+        i += 1
+        removed = []
+        while i < len(records) and records[i].rtype != QTYPE.SOA:
+            removed.append(records[i])
+            i += 1
+        if i >= len(records):
+            return None
+        new = records[i]
+        i += 1
+        added = []
+        while i < len(records) and records[i].rtype != QTYPE.SOA:
+            added.append(records[i])
+            i += 1
+        deltas.append((old, removed, new, added))
+    return None
+
+class ZoneSecondary:
+    """Keeps zones in step with a primary and applies changes to the live table
+
+    Each zone is fetched with AXFR once, then with IXFR whenever the
+    primary sends a NOTIFY and at least every refresh interval (the SOA's,
+    capped at refresh_interval). Only the names an IXFR touched are
+    rebuilt and handed to on_update(new_table, diff), the same callback a
+    zone file reload uses.
+    """
+
+    def __init__(self, primary, apexes, get_table, on_update, refresh_interval=300, timeout=5.0, clock=time.monotonic):
+        self.primary = primary
+        # NOTIFYs are only taken from the primary's addresses
+        try:
+            self.primary_addresses = {info[4][0] for info in socket.getaddrinfo(primary[0], primary[1])}
+        except OSError:
+            self.primary_addresses = {primary[0]}
+        self.get_table = get_table
+        self.on_update = on_update
+        self.refresh_interval = refresh_interval
+        self.timeout = timeout
+        self.clock = clock
+        self.zones = {apex.lower(): None for apex in apexes}
+        self.due = {apex: 0.0 for apex in self.zones}
+        self.lock = threading.Lock()
+        self.wakeup = threading.Event()
+        self.thread = None
+
+        # Counters
+        self.axfrs = 0
+        self.ixfrs = 0
+        self.up_to_date = 0
+        self.failures = 0
+        self.notifies = 0
+
+    def serial(self, apex):
+        version = self.zones.get(apex.lower())
+        return version.serial if version else None
+
+    def notify(self, request, addr):
+        """Handle a NOTIFY from the primary; returns True if it was accepted"""
+        apex = str(request.q.qname).lower()
+        if apex not in self.zones or addr[0] not in self.primary_addresses:
+            return False
+        self.notifies += 1
+        self.due[apex] = 0.0
+        self.wakeup.set()
+        return True
+
+    def refresh(self, apex):
+        """Bring one zone up to date; returns True on success"""
+        with self.lock:
+            current = self.zones.get(apex)
+            try:
+                kind, soa, data = request_transfer(self.primary, apex, current.serial if current else None, self.timeout)
+            except (OSError, EOFError, ValueError) as e:
+                self.failures += 1
+                log.warning("zone_transfer_failed", zone=apex, primary=f"{self.primary[0]}:{self.primary[1]}", error=repr(e))
+                return False
+
+            if kind == "current":
+                self.up_to_date += 1
+                return True
+            if kind == "axfr":
+                self.axfrs += 1
+                records = {rr_key(rr): rr for rr in data}
+                touched = {key[0] for key in records}
+                if current is not None:
+                    touched |= {key[0] for key in current.records}
+            else:
+                self.ixfrs += 1
+                records = dict(current.records)
+                touched = set()
+                for old, removed, new, added in data:
+                    for rr in removed:
+                        records.pop(rr_key(rr), None)
+                        touched.add(str(rr.rname).lower())
+                    for rr in added:
+                        records[rr_key(rr)] = rr
+                        touched.add(str(rr.rname).lower())
+            touched.add(str(soa.rname).lower())
+
+            version = ZoneVersion(soa, records)
+            self.apply(apex, version, touched)
+            self.zones[apex] = version
+            log.info("zone_updated", zone=apex, kind=kind, serial=version.serial, names=len(touched))
+            return True
+
+    def apply(self, apex, version, touched):
+        """Rebuild the touched names from version's records and swap the table"""
+        by_name = {}
+        for key, rr in version.records.items():
+            if key[0] in touched:
+                by_name.setdefault(key[0], []).append(rr)
+        soa_owner = str(version.soa.rname).lower()
+        by_name.setdefault(soa_owner, []).insert(0, version.soa)
+
+        table = self.get_table()
+        existing = {name.lower(): name for name in table}
+        new_table = dict(table)
+        diff = {"added": set(), "removed": set(), "changed": set()}
+        for lowered in touched:
+            name = existing.get(lowered)
+            if lowered in by_name:
+                rrs = by_name[lowered]
+                entry = records_entry(rrs)
+                if name is None:
+                    name = str(rrs[0].rname)
+                    diff["added"].add(name)
+                elif table[name] != entry:
+                    diff["changed"].add(name)
+                new_table[name] = entry
+            elif name is not None:
+                del new_table[name]
+                diff["removed"].add(name)
+        if diff["added"] or diff["removed"] or diff["changed"]:
+            self.on_update(new_table, diff)
+
+    def next_refresh(self, apex, ok):
+        version = self.zones.get(apex)
+        if version is None:
+            delay = 2.0
+        else:
+            _, refresh, retry, _, _ = version.soa.rdata.times
+            delay = min(refresh if ok else retry, self.refresh_interval)
+        self.due[apex] = self.clock() + delay
+
+    def start(self):
+        """Fetch every zone now, then keep them fresh from a daemon thread"""
+        self.thread = threading.Thread(target=self._run, name="zone-secondary", daemon=True)
+        self.thread.start()
+        return self
+
+    def _run(self):
+        while True:
+            self.wakeup.clear()
+            now = self.clock()
+            for apex, due in list(self.due.items()):
+                if due <= now:
+                    self.next_refresh(apex, self.refresh(apex))
+            wait = min(self.due.values()) - self.clock() if self.due else None
+            self.wakeup.wait(max(wait, 0.05) if wait is not None else None)
+
+    def stats(self):
+        """Return transfer counters"""
+        return {
+            "zones": sum(1 for version in self.zones.values() if version is not None),
+            "axfrs": self.axfrs,
+            "ixfrs": self.ixfrs,
+            "up_to_date": self.up_to_date,
+            "failures": self.failures,
+            "notifies": self.notifies,
+        }
@@ -0,0 +1,182 @@
+from collections import namedtuple
+
+# lookup() outcomes
+EXACT = "exact"            # the name exists (possibly as an empty non-terminal)
+WILDCARD = "wildcard"      # it doesn't, but *.<closest encloser> does
+DELEGATION = "delegation"  # it is below a zone cut; node is the cut
+NXDOMAIN = "nxdomain"      # nothing at or below the closest encloser
+
+# node: the matched, wildcard, cut or closest-encloser node
+# zone: the deepest zone apex above the name (for the SOA), or None
+Match = namedtuple("Match", "kind node zone")
+
+def name_labels(name):
+    """Labels of a domain name, lowercased, top-level first"""
+    name = name.lower().rstrip(".")
+    return name.split(".")[::-1] if name else []
+
+class Node:
+    """One label in the tree; data is None for empty non-terminals"""
+
+    __slots__ = ("name", "children", "data", "apex", "cut")
+
+    def __init__(self, name):
+        self.name = name
+        self.children = {}
+        self.data = None
+        self.apex = False
+        self.cut = False
+
+    def copy(self):
+        node = Node(self.name)
+        node.children = dict(self.children)
+        node.data, node.apex, node.cut = self.data, self.apex, self.cut
+        return node
+
+def zone_flags(name, data):
+    """Classify a zones.json entry: SOA makes an apex, NS without SOA a cut"""
+    apex = "SOA" in data
+    return apex, "NS" in data and not apex
+
+class ZoneTree:
+    """Owner names stored as a tree of reversed labels
+
+    lookup() walks one label at a time from the root, so finding the
+    deepest zone cut, the closest encloser, a wildcard, or telling
+    NXDOMAIN from NODATA costs O(labels in the name) whatever the size of
+    the zone. classify(name, data) returns (is_apex, is_cut) per entry.
+
+    Trees are never changed in place: updated() returns a new tree that
+    shares every node off the changed paths, so readers can keep using
+    the old one until it is swapped in.
+    """
+
+    def __init__(self, entries=None, classify=zone_flags, apexes=()):
+        self.classify = classify
+        self.root = Node(".")
+        self.apexes = set()
+        self.cuts = set()
+        self.wildcards = set()
+        self.count = 0
+        for name in apexes:
+            # Zones we serve that have no entry of their own (e.g. ".")
+            node = self._node(name, set())
+            node.apex = True
+            self.apexes.add(node.name)
+        copied = set()
+        for name, data in (entries or {}).items():
+            self._set(name, data, copied)
+
+    def __len__(self):
+        return self.count
+
+    def lookup(self, qname):
+        """Match qname against the tree (see the Match kinds above)"""
+        labels = name_labels(qname)
+        node = self.root
+        zone = node if node.apex else None
+        last = len(labels) - 1
+        for i, label in enumerate(labels):
+            child = node.children.get(label)
+            if child is None:
+                wildcard = node.children.get("*")
+                if wildcard is not None and wildcard.data is not None:
+                    return Match(WILDCARD, wildcard, zone)
+                return Match(NXDOMAIN, node, zone)
+            node = child
+            if node.cut and i < last:
+                # Everything below a cut belongs to the child zone
+                return Match(DELEGATION, node, zone)
+            if node.apex:
+                zone = node
+        return Match(EXACT, node, zone)
+
+    def find_cut(self, qname):
+        """Return the deepest zone cut at or above qname, or None"""
+        cut = None
+        node = self.root
+        for label in name_labels(qname):
+            node = node.children.get(label)
+            if node is None:
+                break
+            if node.cut:
+                cut = node
+        return cut
+
+    def updated(self, entries, names):
+        """Return a new tree with names re-read from entries (removed if absent)"""
+        tree = ZoneTree.__new__(ZoneTree)
+        tree.classify = self.classify
+        tree.root = self.root.copy()
+        tree.apexes = set(self.apexes)
+        tree.cuts = set(self.cuts)
+        tree.wildcards = set(self.wildcards)
+        tree.count = self.count
+        copied = {id(tree.root)}
+        for name in names:
+            if name in entries:
+                tree._set(name, entries[name], copied)
+            else:
+                tree._remove(name, copied)
+        return tree
+
+    def _node(self, name, copied):
+        # Walk to name, creating (or copying, for updated()) the path
+        node = self.root
+        for label in name_labels(name):
+            child = node.children.get(label)
+            if child is None:
+                child = Node(".".join([label, node.name]) if node.name != "." else label + ".")
+                copied.add(id(child))
+            elif id(child) not in copied:
+                child = child.copy()
+                copied.add(id(child))
+            node.children[label] = child
+            node = child
+        return node
+
+    def _set(self, name, data, copied):
+        node = self._node(name, copied)
+        key = node.name
+        if node.data is None:
+            self.count += 1
+        node.data = data
+        node.apex, node.cut = self.classify(key, data)
+        for flag, names in ((node.apex, self.apexes), (node.cut, self.cuts)):
+            if flag:
+                names.add(key)
+            else:
+                names.discard(key)
+        if key.startswith("*."):
+            self.wildcards.add(key)
+
+    def _remove(self, name, copied):
+        labels = name_labels(name)
+        path = [self.root]
+        for label in labels:
+            node = path[-1].children.get(label)
+            if node is None:
+                return
+            path.append(node)
+        if path[-1].data is None:
+            return
+
+        # Copy the path, clear the name, then prune nodes left empty
+        node = self._node(name, copied)
+        key = node.name
+        node.data = None
+        node.apex = node.cut = False
+        self.count -= 1
+        for names in (self.apexes, self.cuts, self.wildcards):
+            names.discard(key)
+
+        parent = self.root
+        parents = []
+        for label in labels:
+            parents.append((parent, label))
+            parent = parent.children[label]
+        for parent, label in reversed(parents):
+            child = parent.children[label]
+            if child.data is not None or child.apex or child.children:
+                break
+            del parent.children[label]
@@ -2,3 +2,8 @@ import json
 def load_zones(path="zone/zones.json"):
     with open(path, "r") as file:
         return json.load(file)
+
+def load_binary_zones(path="zone/zones.bin"):
+    """Map a compiled binary zone file (see `python -m zone compile`)"""
+    from zone.binary_zone import MappedZoneIndex
+    return MappedZoneIndex(path)